@@ -0,0 +1,31 @@
+import numpy
+from tvb_epilepsy.base.utils import initialize_logger
+from tvb_epilepsy.base.analyzers_factory import filter_data, filter_data_blocks, spectral_analysis
+
+if __name__ == "__main__":
+
+    logger = initialize_logger(__name__)
+
+    random_state = numpy.random.RandomState(0)
+    fs = 1000.0
+    data = 3.0 + random_state.normal(size=(10000, 4))
+
+    # Filtering block by block gives the same result as filtering at once, from a zero or a steady initial state:
+    for steady_state in [False, True]:
+        filtered = filter_data(data, 10.0, 100.0, fs, order=3, steady_state=steady_state)
+        for block_size in [1, 137, 10000, 20000]:
+            filtered_blocks = filter_data_blocks(data, 10.0, 100.0, fs, order=3, steady_state=steady_state,
+                                                 block_size=block_size)
+            assert numpy.allclose(filtered_blocks, filtered)
+    logger.info("\nBlock filtering tests passed.")
+
+    # The total power of white noise is its variance, for the periodogram and for the multitaper estimates:
+    noise = random_state.normal(size=(4096, 4))
+    variance = numpy.var(noise, axis=0)
+    periodogram_power = numpy.sum(spectral_analysis(noise, fs, method="periodogram", window="boxcar")[0], axis=0)
+    multitaper_power = numpy.sum(spectral_analysis(noise, fs, method="multitaper", NW=4.0)[0], axis=0)
+    logger.info("\nVariance = " + str(variance) + "\nPeriodogram power = " + str(periodogram_power) +
+                "\nMultitaper power = " + str(multitaper_power))
+    assert numpy.allclose(periodogram_power, variance)
+    assert numpy.allclose(multitaper_power, periodogram_power, rtol=0.1)
+    logger.info("\nMultitaper spectrum tests passed.")
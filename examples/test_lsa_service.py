@@ -0,0 +1,68 @@
+import numpy
+from tvb_epilepsy.base.utils import initialize_logger
+from tvb_epilepsy.base.model_vep import Connectivity
+from tvb_epilepsy.base.disease_hypothesis import DiseaseHypothesis
+from tvb_epilepsy.base.model_configuration_service import ModelConfigurationService
+from tvb_epilepsy.base.lsa_service import LSAService, sort_eigen_pairs, update_eigen_decomposition
+
+
+def assert_equal_eigen_pairs(eigen_values, eigen_vectors, jacobian):
+    # Compare to a full eigen decomposition
+    full_eigen_values, full_eigen_vectors = sort_eigen_pairs(*numpy.linalg.eig(jacobian))
+    assert numpy.allclose(eigen_values, full_eigen_values, rtol=0.0, atol=1e-10)
+    assert numpy.allclose(eigen_vectors, full_eigen_vectors, rtol=0.0, atol=1e-8)
+
+
+if __name__ == "__main__":
+
+    logger = initialize_logger(__name__)
+
+    n_regions = 80
+    random_state = numpy.random.RandomState(0)
+    weights = random_state.uniform(size=(n_regions, n_regions))
+    weights *= random_state.uniform(size=(n_regions, n_regions)) < 0.3
+    weights = weights + weights.T
+    numpy.fill_diagonal(weights, 0.0)
+    connectivity = Connectivity("", weights, weights, numpy.array(["r" + str(ii) for ii in range(n_regions)]),
+                                random_state.normal(size=(n_regions, 3)))
+    model_configuration_service = ModelConfigurationService(n_regions)
+
+    lsa_service = LSAService(eigen_vectors_number_selection="auto_disease")
+    base_hypothesis = DiseaseHypothesis(connectivity, epileptogenicity_hypothesis={(0, 5): [0.8, 0.5]})
+    base_decomposition = \
+        lsa_service.eigen_decomposition(model_configuration_service.configure_model_from_E_hypothesis(base_hypothesis))
+
+    # The epileptogenicity of a region changes a single column of the jacobian.
+    # Small and large changes are updated without any full eigen decomposition:
+    for e_value in [0.801, 0.81, 0.9, 0.5]:
+        hypothesis = DiseaseHypothesis(connectivity, epileptogenicity_hypothesis={(0, 5): [e_value, 0.5]})
+        model_configuration = model_configuration_service.configure_model_from_E_hypothesis(hypothesis)
+        jacobian = lsa_service._compute_jacobian(model_configuration)
+        eigen_pairs = update_eigen_decomposition(base_decomposition, jacobian)
+        assert eigen_pairs is not None
+        assert_equal_eigen_pairs(*(sort_eigen_pairs(*eigen_pairs) + (jacobian, )))
+
+        # ...and LSA results are the same as those of a full eigen decomposition:
+        lsa_hypothesis = lsa_service.run_lsa_incremental(hypothesis, model_configuration, base_decomposition)
+        assert_equal_eigen_pairs(lsa_service.eigen_values, lsa_service.eigen_vectors, jacobian)
+        assert numpy.allclose(lsa_hypothesis.propagation_strenghts,
+                              lsa_service.run_lsa(hypothesis, model_configuration).propagation_strenghts)
+
+    # The excitability of a region changes all equilibria, and, therefore, the whole jacobian...
+    hypothesis = DiseaseHypothesis(connectivity, excitability_hypothesis={(0, 5): [0.8, 0.5]})
+    model_configuration = model_configuration_service.configure_model_from_hypothesis(hypothesis)
+    jacobian = lsa_service._compute_jacobian(model_configuration)
+    assert update_eigen_decomposition(base_decomposition, jacobian) is None
+    # ...so that run_lsa_incremental falls back to a full eigen decomposition:
+    lsa_service.run_lsa_incremental(hypothesis, model_configuration, base_decomposition)
+    assert_equal_eigen_pairs(lsa_service.eigen_values, lsa_service.eigen_vectors, jacobian)
+
+    # An update failing its residual check falls back to a full eigen decomposition too:
+    hypothesis = DiseaseHypothesis(connectivity, epileptogenicity_hypothesis={(0, 5): [0.81, 0.5]})
+    model_configuration = model_configuration_service.configure_model_from_E_hypothesis(hypothesis)
+    jacobian = lsa_service._compute_jacobian(model_configuration)
+    assert update_eigen_decomposition(base_decomposition, jacobian, rtol=0.0) is None
+    lsa_service.run_lsa_incremental(hypothesis, model_configuration, base_decomposition, rtol=0.0)
+    assert_equal_eigen_pairs(lsa_service.eigen_values, lsa_service.eigen_vectors, jacobian)
+
+    logger.info("\nIncremental LSA tests passed.")
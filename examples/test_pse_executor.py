@@ -0,0 +1,37 @@
+import os
+import time
+import shutil
+import tempfile
+from tvb_epilepsy.base.utils import initialize_logger
+from tvb_epilepsy.base.pse_executor import FileSystemPSEExecutor, PENDING_FOLDER, RUNNING_FOLDER, _claim_job
+
+if __name__ == "__main__":
+
+    logger = initialize_logger(__name__)
+
+    folder = tempfile.mkdtemp()
+    executor = FileSystemPSEExecutor(folder, stale_job_time=60.0)
+    executor._prepare_folder()
+
+    # A job that has been pending for longer than stale_job_time...
+    job_path = os.path.join(folder, PENDING_FOLDER, "job_000000.pkl")
+    open(job_path, "wb").close()
+    submission_time = time.time() - 10 * executor.stale_job_time
+    os.utime(job_path, (submission_time, submission_time))
+
+    # ...is not stale once claimed, before any heartbeat of its worker:
+    job, running_path = _claim_job(folder, "worker")
+    assert job == "job_000000.pkl"
+    executor._requeue_stale_jobs()
+    assert os.path.isfile(running_path)
+    assert len(os.listdir(os.path.join(folder, PENDING_FOLDER))) == 0
+
+    # A running job without heartbeats for longer than stale_job_time is requeued:
+    os.utime(running_path, (submission_time, submission_time))
+    executor._requeue_stale_jobs()
+    assert os.listdir(os.path.join(folder, RUNNING_FOLDER)) == []
+    assert os.path.isfile(job_path)
+
+    shutil.rmtree(folder)
+
+    logger.info("\nPSE job queue stale job tests passed.")
@@ -0,0 +1,39 @@
+import numpy
+from tvb_epilepsy.base.utils import initialize_logger
+from tvb_epilepsy.base.sampling_service import QuasiRandomSamplingService, feistel_permutation
+
+if __name__ == "__main__":
+
+    logger = initialize_logger(__name__)
+
+    # A keyed Feistel permutation is a bijection of range(n), for any n:
+    for n in [1, 2, 7, 100, 1000]:
+        keys = numpy.random.RandomState(n).randint(0, 2 ** 62, size=6, dtype=numpy.int64).astype(numpy.uint64)
+        assert numpy.all(numpy.sort(feistel_permutation(numpy.arange(n), n, keys)) == numpy.arange(n))
+
+    n_samples = 1000
+    n_outputs = 10
+    sampler = QuasiRandomSamplingService(n_samples=n_samples, n_outputs=n_outputs, sampler="latin",
+                                         random_seed=123, chunk_size=77)
+    samples = sampler.sample()
+
+    # Latin hypercube: exactly one sample per stratum of each dimension...
+    for io in range(n_outputs):
+        assert numpy.all(numpy.sort(numpy.floor(samples[io] * n_samples)) == numpy.arange(n_samples))
+
+    # ...independently of the chunk size...
+    sampler.chunk_size = n_samples
+    assert numpy.allclose(sampler.sample(), samples)
+
+    # ...and with uncorrelated dimensions, i.e., within the ~ 4 / sqrt(n_samples) spread of random permutations:
+    correlations = numpy.corrcoef(samples)[numpy.triu_indices(n_outputs, 1)]
+    logger.info("\nMaximum absolute correlation of latin hypercube columns = " + str(numpy.max(numpy.abs(correlations))))
+    assert numpy.max(numpy.abs(correlations)) < 4.0 / numpy.sqrt(n_samples)
+
+    # No two dimensions are (cyclic shifts of) the same permutation:
+    strata = numpy.floor(samples * n_samples).astype("i")
+    for io in range(n_outputs):
+        for jo in range(io + 1, n_outputs):
+            assert len(numpy.unique((strata[jo] - strata[io]) % n_samples)) > 1
+
+    logger.info("\nLatin hypercube sampling tests passed.")
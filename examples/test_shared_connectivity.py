@@ -0,0 +1,46 @@
+import numpy
+from tvb_epilepsy.base.utils import initialize_logger
+from tvb_epilepsy.base.model_vep import Connectivity
+from tvb_epilepsy.base.disease_hypothesis import DiseaseHypothesis
+from tvb_epilepsy.base.model_configuration_service import ModelConfigurationService
+
+if __name__ == "__main__":
+
+    logger = initialize_logger(__name__)
+
+    # A small random connectivity, whose arrays are shared via read-only memory mapped files:
+    n_regions = 6
+    random_state = numpy.random.RandomState(0)
+    weights = random_state.uniform(size=(n_regions, n_regions))
+    weights = weights + weights.T
+    numpy.fill_diagonal(weights, 0.0)
+    connectivity = Connectivity("", weights, weights, numpy.array(["r" + str(ii) for ii in range(n_regions)]),
+                                random_state.normal(size=(n_regions, 3)))
+    shared_folder = connectivity.share()
+    normalized_weights = numpy.array(connectivity.normalized_weights)
+
+    # Hypotheses with a connectivity scaling, configured on the shared weights:
+    w_indices = [1, 2 * n_regions + 4]
+    w_values = [2.0, 0.5]
+    connectivity_disease = numpy.ones((n_regions, n_regions))
+    for w_index, w_value in zip(w_indices, w_values):
+        connectivity_disease[numpy.unravel_index(w_index, (n_regions, n_regions))] = w_value
+        connectivity_disease[numpy.unravel_index(w_index, (n_regions, n_regions))[::-1]] = w_value
+
+    hyp_x0_w = DiseaseHypothesis(connectivity, excitability_hypothesis={(0,): [0.8]},
+                                 connectivity_hypothesis={tuple(w_indices): w_values})
+    hyp_E_w = DiseaseHypothesis(connectivity, epileptogenicity_hypothesis={(0,): [0.8]},
+                                connectivity_hypothesis={tuple(w_indices): w_values})
+
+    model_configuration_service = ModelConfigurationService(n_regions)
+    for model_configuration in [model_configuration_service.configure_model_from_hypothesis(hyp_x0_w),
+                                model_configuration_service.configure_model_from_E_hypothesis(hyp_E_w)]:
+        # The hypothesis' scaling applies to the model configuration...
+        assert numpy.allclose(model_configuration.connectivity_matrix, normalized_weights * connectivity_disease)
+        # ...and not to the shared weights, which remain unchanged and shared:
+        assert numpy.all(connectivity.normalized_weights == normalized_weights)
+        assert isinstance(connectivity.normalized_weights, numpy.memmap)
+
+    connectivity.unshare(remove_files=True)
+
+    logger.info("\nConfiguration of connectivity hypotheses on a shared connectivity tests passed.")
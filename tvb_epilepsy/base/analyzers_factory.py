@@ -1,19 +1,33 @@
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+
 import numpy as np
-from scipy.signal import butter, lfilter, welch, periodogram
+from numpy.lib.stride_tricks import as_strided
+from scipy.signal import butter, sosfilt, sosfilt_zi, sosfiltfilt, get_window
+from scipy.signal import detrend as signal_detrend
+from scipy.signal.windows import dpss
+
+from tvb_epilepsy.base.utils import formal_repr
 
 # x is assumed to be data (real numbers) arranged along the first dimension of an ndarray
 # this factory makes use of the numpy array properties
 
+# Maximum number of elements of the temporary arrays of a block of segments or windows
+MAX_BLOCK_SIZE = 2 ** 22
+
 
 # Pointwise analyzers:
 
 
+# cntr, sc, and the statistics along the first dimension broadcast to the remaining dimensions (e.g., channels)
+
+
 def center(x, cntr=0.0):
-    return (x.T-np.array(cntr)).T
+    return x - np.array(cntr)
 
 
 def scale(x, sc=1.0):
-    return (x.T / np.array(sc)).T
+    return x / np.array(sc)
 
 
 def mean_center(x):
@@ -45,22 +59,22 @@ def interval_scaling(x, min_targ=0.0, max_targ=1.0, min_orig=None, max_orig=None
         min_orig = np.min(x, axis=0)
     if max_orig is None:
         max_orig = np.max(x, axis=0)
-        scale_factor = (max_targ - max_orig) / (min_targ - min_orig)
-    return max_orig + (x - min_orig) * scale_factor
+    scale_factor = (max_targ - min_targ) / (np.array(max_orig) - min_orig)
+    return min_targ + (x - min_orig) * scale_factor
+
 
+# threshold and subthreshold return new arrays, leaving x unchanged:
 
 def threshold(x, th=0.0, out=None):
     if out is None:
         out = th
-    x[x < th] = out
-    return x
+    return np.where(x < th, out, x)
 
 
 def subthreshold(x, th=0.0, out=None):
     if out is None:
         out = th
-    x[x > th] = out
-    return x
+    return np.where(x > th, out, x)
 
 
 def sigmoid(x, sc=1.0):
@@ -87,6 +101,250 @@ def log(x, base="natural"):
     else:
         return np.log(x)
 
+# Chains of pointwise analyzers, applied in place:
+
+def _step_center(x, stats, cntr=0.0):
+    x -= np.array(cntr, dtype=x.dtype)
+
+
+def _step_scale(x, stats, sc=1.0):
+    x /= np.array(sc, dtype=x.dtype)
+
+
+def _step_mean_center(x, stats):
+    x -= stats["mean"].astype(x.dtype)
+
+
+def _step_median_center(x, stats):
+    x -= stats["median"].astype(x.dtype)
+
+
+def _step_zscore(x, stats):
+    x -= stats["mean"].astype(x.dtype)
+    x /= stats["std"].astype(x.dtype)
+
+
+def _step_max_norm(x, stats):
+    x /= stats["max"].astype(x.dtype)
+
+
+def _step_maxabs_norm(x, stats):
+    x /= stats["maxabs"].astype(x.dtype)
+
+
+def _step_std_norm(x, stats):
+    x /= stats["std"].astype(x.dtype)
+
+
+def _step_interval_scaling(x, stats, min_targ=0.0, max_targ=1.0, min_orig=None, max_orig=None):
+    if min_orig is None:
+        min_orig = stats["min"]
+    if max_orig is None:
+        max_orig = stats["max"]
+    x -= np.array(min_orig, dtype=x.dtype)
+    x *= np.array((max_targ - min_targ) / (np.array(max_orig) - min_orig), dtype=x.dtype)
+    x += np.array(min_targ, dtype=x.dtype)
+
+
+def _step_threshold(x, stats, th=0.0, out=None):
+    if out is None:
+        out = th
+    np.copyto(x, np.array(out, dtype=x.dtype), where=x < th)
+
+
+def _step_subthreshold(x, stats, th=0.0, out=None):
+    if out is None:
+        out = th
+    np.copyto(x, np.array(out, dtype=x.dtype), where=x > th)
+
+
+def _step_sigmoid(x, stats, sc=1.0):
+    x *= np.array(-sc, dtype=x.dtype)
+    np.exp(x, out=x)
+    x += 1
+    np.reciprocal(x, out=x)
+
+
+def _step_rectify(x, stats):
+    np.abs(x, out=x)
+
+
+def _step_point_power(x, stats, p=2.0):
+    np.power(x, np.array(p, dtype=x.dtype), out=x)
+
+
+def _step_log(x, stats, base="natural"):
+    if base == 10:
+        np.log10(x, out=x)
+    elif base == 2:
+        np.log2(x, out=x)
+    else:
+        np.log(x, out=x)
+
+
+# The statistics along the first dimension and the in place function of each step of an AnalyzerChain
+POINTWISE_STEPS = {"center": ([], _step_center),
+                   "scale": ([], _step_scale),
+                   "mean_center": (["mean"], _step_mean_center),
+                   "median_center": (["median"], _step_median_center),
+                   "zscore": (["mean", "std"], _step_zscore),
+                   "max_norm": (["max"], _step_max_norm),
+                   "maxabs_norm": (["maxabs"], _step_maxabs_norm),
+                   "std_norm": (["std"], _step_std_norm),
+                   "interval_scaling": (["min", "max"], _step_interval_scaling),
+                   "threshold": ([], _step_threshold),
+                   "subthreshold": ([], _step_subthreshold),
+                   "sigmoid": ([], _step_sigmoid),
+                   "rectify": ([], _step_rectify),
+                   "point_power": ([], _step_point_power),
+                   "log": ([], _step_log)}
+
+
+def _statistics(x, names):
+    # Statistics of x along the first dimension
+    stats = {}
+    for name in names:
+        if name == "mean":
+            stats[name] = np.mean(x, axis=0, dtype="float64")
+        elif name == "std":
+            stats[name] = np.std(x, axis=0, dtype="float64")
+        elif name == "median":
+            stats[name] = np.median(x, axis=0)
+        elif name == "max":
+            stats[name] = np.max(x, axis=0)
+        elif name == "min":
+            stats[name] = np.min(x, axis=0)
+        elif name == "maxabs":
+            stats[name] = np.max(np.abs(x), axis=0)
+    return stats
+
+
+class _RunningStatistics(object):
+    # Statistics along the first dimension, accumulated over blocks of data
+
+    def __init__(self, names):
+        if "median" in names:
+            raise ValueError("\nThe median cannot be computed block by block!")
+        self.names = names
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.extrema = {}
+
+    def update(self, block):
+        n = block.shape[0]
+        if n == 0:
+            return
+        # Chan et al. parallel combination of means and sums of squared deviations:
+        mean = np.mean(block, axis=0, dtype="float64")
+        m2 = np.sum((block - mean) ** 2, axis=0, dtype="float64")
+        delta = mean - self.mean
+        total = self.n + n
+        self.mean = self.mean + delta * n / total
+        self.m2 = self.m2 + m2 + delta ** 2 * self.n * n / total
+        self.n = total
+        for name, reduce in [("max", np.maximum), ("min", np.minimum), ("maxabs", np.maximum)]:
+            if name in self.names:
+                value = _statistics(block, [name])[name]
+                self.extrema[name] = value if name not in self.extrema else reduce(self.extrema[name], value)
+
+    def statistics(self):
+        stats = dict(self.extrema)
+        stats["mean"] = self.mean
+        stats["std"] = np.sqrt(self.m2 / max(self.n, 1))
+        return dict([(name, stats[name]) for name in self.names])
+
+
+class AnalyzerChain(object):
+
+    def __init__(self, steps=[]):
+        """
+        A chain of pointwise analyzers, fused to run in place on a single array, preserving its (float) dtype,
+        e.g., AnalyzerChain().add("zscore").add("rectify").add("threshold", th=1.0)
+        Statistics (mean, std, median, max, min, maxabs) are computed along the first dimension of the data,
+        at the step that needs them, i.e., after the preceding steps, as the respective functions of this module do.
+        :param steps: a list of (name, kwargs) tuples, with names of POINTWISE_STEPS, or "sigmoidal_scaling"
+        """
+        self.steps = []
+        for name, kwargs in steps:
+            self.add(name, **kwargs)
+
+    def __repr__(self):
+        d = {"01. Steps": [name + str(kwargs) for name, kwargs in self.steps]}
+        return formal_repr(self, d)
+
+    def __str__(self):
+        return self.__repr__()
+
+    def add(self, name, **kwargs):
+        if name == "sigmoidal_scaling":
+            # min_targ + max_targ * sigmoid(maxabs_norm(center(x, cntr)), sc)
+            self.add("center", cntr=kwargs.get("cntr", 0.0))
+            self.add("maxabs_norm")
+            self.add("sigmoid", sc=kwargs.get("sc", 10.0))
+            self.add("scale", sc=1.0 / kwargs.get("max_targ", 1.0))
+            return self.add("center", cntr=-kwargs.get("min_targ", 0.0))
+        if name not in POINTWISE_STEPS:
+            raise ValueError("\nAnalyzer " + str(name) + " is not one of " + str(POINTWISE_STEPS.keys()) +
+                             " or sigmoidal_scaling!")
+        self.steps.append((name, kwargs))
+        return self
+
+    def _apply_step(self, x, istep, stats=None):
+        name, kwargs = self.steps[istep]
+        stats_names, fun = POINTWISE_STEPS[name]
+        if stats is None:
+            stats = _statistics(x, stats_names)
+        fun(x, stats, **kwargs)
+
+    def __call__(self, x, inplace=False):
+        """
+        :param x: data arranged along the first dimension
+        :param inplace: if True, overwrite x, if it has a float dtype, instead of copying it once
+        :return: the output, of the same (float) dtype as x
+        """
+        dtype = np.result_type(np.asarray(x).dtype, np.float32)
+        if not (inplace and isinstance(x, np.ndarray) and x.dtype == dtype):
+            x = np.array(x, dtype=dtype)
+        for istep in range(len(self.steps)):
+            self._apply_step(x, istep)
+        return x
+
+    def apply_blocks(self, x, out=None, block_size=100000):
+        """
+        Apply the chain block by block to data that need not fit in memory, e.g., an h5 dataset or a memmap.
+        Every step needing statistics takes one more pass over the data, to accumulate them
+        on the output of the preceding steps. The median is not available then.
+        :param x: an array-like of data arranged along the first dimension, which can be sliced along it
+        :param out: an array-like of the same shape to write the output to (default a new array in memory),
+                    which may be x itself
+        :return: out
+        """
+        dtype = np.result_type(x.dtype, np.float32)
+        if out is None:
+            out = np.empty(x.shape, dtype=dtype)
+        n_samples = x.shape[0]
+        stats = [None] * len(self.steps)
+        for istep, (name, kwargs) in enumerate(self.steps):
+            stats_names = POINTWISE_STEPS[name][0]
+            if len(stats_names) == 0:
+                stats[istep] = {}
+                continue
+            running_stats = _RunningStatistics(stats_names)
+            for start in range(0, n_samples, block_size):
+                block = np.array(x[start:start + block_size], dtype=dtype)
+                for iprev in range(istep):
+                    self._apply_step(block, iprev, stats[iprev])
+                running_stats.update(block)
+            stats[istep] = running_stats.statistics()
+        for start in range(0, n_samples, block_size):
+            block = np.array(x[start:start + block_size], dtype=dtype)
+            for istep in range(len(self.steps)):
+                self._apply_step(block, istep, stats[istep])
+            out[start:start + block_size] = block
+        return out
+
+
 # Across points analyzers:
 
 # Univariate:
@@ -114,62 +372,378 @@ def power(x, n=None):
 
 # Frequency domain:
 
-def _butterworth_bandpass(lowcut, highcut, fs, order=3):
+def _butterworth_bandpass(lowcut, highcut, fs, order=3, output="ba"):
     """
     Build a diggital Butterworth filter
+    output: "ba" for numerator/denominator coefficients, or "sos" for second-order sections
     """
     nyq = 0.5 * fs
     low = lowcut / nyq  # normalize frequency
     high = highcut / nyq  # normalize frequency
-    b, a = butter(order, [low, high], btype='band')
-    return b, a
+    return butter(order, [low, high], btype='band', output=output)
+
+
+def _steady_state(sos, first_sample):
+    # The filter state (n_sections, 2, ...channels) of a step input of first_sample, i.e., without its onset transient
+    zi = sosfilt_zi(sos)
+    return zi.reshape(zi.shape + (1, ) * np.ndim(first_sample)) * first_sample
+
+
+def filter_data(data, lowcut, highcut, fs, order=3, zero_phase=False, steady_state=False):
+    # Filter all channels along the first dimension at once, with second-order sections,
+    # which are numerically stable also for high orders and narrow bands.
+    # zero_phase: if True, filter forwards and backwards, for no phase distortion (and doubled order)
+    # steady_state: if True, and not zero_phase, start from the steady state of the first sample, instead of zero
+    sos = _butterworth_bandpass(lowcut, highcut, fs, order=order, output="sos")
+    if zero_phase:
+        return sosfiltfilt(sos, data, axis=0)
+    elif steady_state:
+        data = np.asarray(data)
+        return sosfilt(sos, data, axis=0, zi=_steady_state(sos, data[0]))[0]
+    else:
+        return sosfilt(sos, data, axis=0)
+
+
+class BlockFilter(object):
+
+    def __init__(self, lowcut, highcut, fs, order=3, steady_state=False):
+        """
+        A Butterworth bandpass filter of blocks of data, which carries the filter state from one block to the next,
+        so that arbitrarily long recordings can be filtered block by block, with the same result as at once,
+        i.e., as filter_data with the same steady_state.
+        Blocks are arranged along the first dimension, and all channels are filtered at once.
+        The state is initialized to zero, or, if steady_state is True, to the steady state of the first sample of
+        the first block.
+        """
+        self.sos = _butterworth_bandpass(lowcut, highcut, fs, order=order, output="sos")
+        self.steady_state = steady_state
+        self.zi = None
+
+    def reset(self):
+        self.zi = None
+
+    def filter(self, block):
+        block = np.asarray(block)
+        if self.zi is None:
+            if self.steady_state:
+                self.zi = _steady_state(self.sos, block[0])
+            else:
+                self.zi = np.zeros((self.sos.shape[0], 2) + block.shape[1:])
+        y, self.zi = sosfilt(self.sos, block, axis=0, zi=self.zi)
+        return y
+
+
+def filter_data_blocks(data, lowcut, highcut, fs, order=3, zero_phase=False, steady_state=False, block_size=100000,
+                       out=None):
+    """
+    Filter data, which need not fit in memory, e.g., an h5 dataset or a memory mapped array, block by block
+    :param data: an array-like of data arranged along the first dimension, which can be sliced along it
+    :param zero_phase: if True, filter the output backwards in a second pass, block by block in reverse order.
+                       Unlike filter_data, the signal is not padded at its edges then.
+    :param steady_state: if True, start (each pass) from the steady state of its first sample, instead of zero
+    :param block_size: the number of samples per block
+    :param out: an array-like of the same shape to write the output to (default a new array in memory)
+    :return: out
+    """
+    n_samples = data.shape[0]
+    if out is None:
+        out = np.empty(data.shape, dtype=np.result_type(data.dtype, np.float32))
+    block_filter = BlockFilter(lowcut, highcut, fs, order=order, steady_state=steady_state)
+    for start in range(0, n_samples, block_size):
+        out[start:start + block_size] = block_filter.filter(data[start:start + block_size])
+    if zero_phase:
+        block_filter.reset()
+        for stop in range(n_samples, 0, -block_size):
+            start = max(0, stop - block_size)
+            out[start:stop] = block_filter.filter(np.asarray(out[start:stop])[::-1])[::-1]
+    return out
+
+
+def _sliding_windows(x, window_length, window_step, axis):
+    # A read-only strided view of the windows of x along axis, with the windows' dimension inserted before it
+    n_windows = max(0, (x.shape[axis] - window_length) // window_step + 1)
+    shape = x.shape[:axis] + (n_windows, window_length) + x.shape[axis + 1:]
+    strides = x.strides[:axis] + (window_step * x.strides[axis], x.strides[axis]) + x.strides[axis + 1:]
+    return as_strided(x, shape=shape, strides=strides, writeable=False)
+
+
+def sliding_windows(x, window_length, window_step=1):
+    """
+    A view of the windows of data arranged along the first dimension, without copying them
+    :return: a read-only (n_windows, window_length) + x.shape[1:] array
+    """
+    return _sliding_windows(np.asarray(x), window_length, window_step, 0)
+
+
+def _spectral_tapers(method, window, nperseg, NW):
+    # The window (or the dpss tapers for multitaper) of segments, as a (n_tapers, nperseg) array, scaled so that
+    # the squared magnitude of the fft of a tapered segment is its power spectrum:
+    if method == "multitaper":
+        # Each taper is normalized by its energy (and not by its sum, which is ~0 for the odd dpss tapers),
+        # so that the power summed over frequencies is the mean square of the signal,
+        # as for a periodogram with a boxcar window
+        tapers = dpss(nperseg, NW, Kmax=max(1, int(2 * NW) - 1)).reshape((-1, nperseg))
+        return tapers / np.sqrt(nperseg * np.sum(tapers ** 2, axis=1))[:, np.newaxis]
+    else:
+        # As scipy.signal.welch(scaling="spectrum"), i.e., the power of a sinusoid is the peak of its spectrum
+        taper = get_window(window, nperseg)
+        return (taper / np.sum(taper))[np.newaxis]
+
+
+def _power_spectrum(segments, tapers, nfft, detrend):
+    # segments: (n_windows, n_segments, nperseg, n_channels)
+    # return the one-sided power spectrum averaged over segments and tapers: (n_windows, nfft / 2 + 1, n_channels),
+    # scaled as a "spectrum", i.e., in units of the square of the signal, as scipy.signal.welch(scaling="spectrum")
+    n_windows, n_segments, nperseg, n_channels = segments.shape
+    n_freq = nfft // 2 + 1
+    psd = np.zeros((n_windows, n_freq, n_channels))
+    # Blocks of segments, to bound the size of the stacked ffts:
+    n_block = max(1, MAX_BLOCK_SIZE // (n_windows * n_freq * n_channels))
+    for taper in tapers:
+        for start in range(0, n_segments, n_block):
+            block = segments[:, start:start + n_block]
+            if detrend == "constant":
+                block = block - block.mean(axis=2)[:, :, np.newaxis]
+            elif detrend == "linear":
+                block = signal_detrend(block, axis=2)
+            X = np.fft.rfft(block * taper[:, np.newaxis], n=nfft, axis=2)
+            psd += np.sum(X.real ** 2 + X.imag ** 2, axis=1)
+    psd /= n_segments * tapers.shape[0]
+    # One-sided spectrum:
+    if nfft % 2 == 0:
+        psd[:, 1:-1] *= 2
+    else:
+        psd[:, 1:] *= 2
+    return psd
+
+
+def _resample_spectrum(f, psd, freq, resample="interp"):
+    # Resample psd of (..., len(f), n_channels) from the frequencies f onto the frequencies freq:
+    # "interp" for linear interpolation, or "bin" for the mean of the frequencies closest to each one of freq
+    # (where there are any, and interpolation elsewhere)
+    idx = np.clip(np.searchsorted(f, freq) - 1, 0, f.size - 2)
+    w = np.clip((freq - f[idx]) / (f[idx + 1] - f[idx]), 0.0, 1.0)[:, np.newaxis]
+    resampled = psd[..., idx, :] * (1 - w) + psd[..., idx + 1, :] * w
+    if resample == "bin":
+        edges = np.concatenate([[-np.inf], 0.5 * (freq[1:] + freq[:-1]), [np.inf]])
+        bins = np.searchsorted(f, edges)
+        cumsum = np.concatenate([np.zeros(psd.shape[:-2] + (1, psd.shape[-1])), np.cumsum(psd, axis=-2)], axis=-2)
+        counts = np.diff(bins)
+        binned = (cumsum[..., bins[1:], :] - cumsum[..., bins[:-1], :]) / np.maximum(counts, 1)[:, np.newaxis]
+        resampled = np.where((counts > 0)[:, np.newaxis], binned, resampled)
+    elif resample != "interp":
+        raise ValueError("\nresample = " + str(resample) + " is not one of 'interp' or 'bin'!")
+    return resampled
+
+
+def _spectral_output(psd, freq, output):
+    # psd: (..., n_freq, n_channels)
+    if output == "density":
+        df = freq[1] - freq[0]
+        psd = psd / (np.sum(psd, axis=-2)[..., np.newaxis, :] * df)
+    elif output == "energy":
+        psd = np.sum(psd, axis=-2)
+    return psd
 
 
-def filter_data(data, lowcut, highcut, fs, order=3):
-    # get filter coefficients
-    b, a = _butterworth_bandpass(lowcut, highcut, fs, order=order)
-    # filter data
-    y = lfilter(b, a, data)
-    return y
+def spectral_analysis(x, fs, freq=None, method="periodogram", output="spectrum", nfft=None, window='hanning',
+                      nperseg=512, detrend='constant', noverlap=None, resample="interp", NW=4.0):
+    """
+    Power spectra of all channels at once, computed with rfft
+    :param x: data arranged along the first dimension
+    :param freq: the frequencies of the output (default None for the fft frequencies)
+    :param method: "periodogram", "welch" (averaged over segments of nperseg samples, overlapping by noverlap,
+                   default nperseg / 2), or "multitaper" (averaged over the dpss tapers of time-bandwidth NW)
+    :param output: "spectrum", "density" (normalized to unit area), or "energy" (summed over frequencies)
+    :param resample: "interp" or "bin", see _resample_spectrum
+    :return: the psd of shape (n_freq, ) + x.shape[1:] and the frequencies, or the energy of shape x.shape[1:]
+    """
+    x = np.asarray(x)
+    n_samples = x.shape[0]
+    x2d = x.reshape((n_samples, -1))
+
+    if method == "welch":
+        nperseg = min(nperseg, n_samples)
+        if noverlap is None:
+            noverlap = nperseg // 2
+        step = nperseg - noverlap
+    elif method in ["periodogram", "multitaper"]:
+        nperseg = n_samples
+        step = n_samples
+    else:
+        raise ValueError("\nmethod = " + str(method) + " is not one of 'periodogram', 'welch' or 'multitaper'!")
+    if nfft is None:
+        nfft = nperseg
 
+    segments = _sliding_windows(x2d[np.newaxis], nperseg, step, 1)
+    psd = _power_spectrum(segments, _spectral_tapers(method, window, nperseg, NW), nfft, detrend)[0]
+    f = np.fft.rfftfreq(nfft, 1.0 / fs)
 
-def spectral_analysis(x, fs, freq=None, method="periodogram", output="spectrum", nfft=None, window='hanning',
-                           nperseg=512, detrend='constant', noverlap=None):
     if freq is None:
-        freq = np.linspace(1, nperseg, nperseg)
-
-    if method is welch:
-        f, psd = welch(x,
-                       fs=fs,  # sample rate
-                       nfft=nfft,
-                       window=window,   # apply a Hanning window before taking the DFT
-                       nperseg=nperseg,        # compute periodograms of 256-long segments of x
-                       detrend=detrend,
-                       scaling="spectrum",
-                       noverlap=noverlap,
-                       axis=0)
+        freq = f
     else:
-        f, psd = periodogram(x,
-                             fs=fs,  # sample rate
-                             nfft=nfft,
-                             window=window,  # apply a Hanning window before taking the DFT
-                             detrend=detrend,
-                             scaling="spectrum",
-                             axis=0)
-
-    # Fit to desired frequency grid:
-    df = freq[1] - freq[0]
-    p = np.polyfit(f, psd, psd.shape[0])
-    for k in range(psd.shape[1]):
-        psd[:, k] = np.polyval(p[:, k], freq)
-        if output == "density":
-            psd[:, k] /= (np.sum(psd[:, k]) * df)
+        freq = np.array(freq, dtype="float64")
+        psd = _resample_spectrum(f, psd, freq, resample)
 
+    psd = _spectral_output(psd, freq, output)
     if output == "energy":
-        return np.sum(psd, axis=0)
+        return psd.reshape(x.shape[1:])
+    else:
+        return psd.reshape((freq.size, ) + x.shape[1:]), freq
 
+
+def spectrogram(x, fs, window_length, window_step=None, freq=None, method="welch", output="spectrum", nfft=None,
+                window='hanning', nperseg=256, detrend='constant', noverlap=None, resample="interp", NW=4.0):
+    """
+    Power spectra of sliding windows of long data, computed in blocks of windows,
+    so that data may also be an h5 dataset or a memory mapped array read block by block
+    :param window_length: the number of samples of each window
+    :param window_step: the number of samples between the starts of consecutive windows (default window_length)
+    :param other parameters: as for spectral_analysis, which is applied to each window
+    :return: the psd of shape (n_windows, n_freq) + x.shape[1:] (or the energy of shape (n_windows, ) + x.shape[1:]),
+             the frequencies, and the times (in the units of 1 / fs) of the windows' centers
+    """
+    if window_step is None:
+        window_step = window_length
+    n_samples = x.shape[0]
+    channels_shape = x.shape[1:]
+    n_channels = int(np.prod(channels_shape))
+    n_windows = max(0, (n_samples - window_length) // window_step + 1)
+
+    if method == "welch":
+        nperseg = min(nperseg, window_length)
+        if noverlap is None:
+            noverlap = nperseg // 2
+        step = nperseg - noverlap
+    elif method in ["periodogram", "multitaper"]:
+        nperseg = window_length
+        step = window_length
+    else:
+        raise ValueError("\nmethod = " + str(method) + " is not one of 'periodogram', 'welch' or 'multitaper'!")
+    if nfft is None:
+        nfft = nperseg
+    tapers = _spectral_tapers(method, window, nperseg, NW)
+    f = np.fft.rfftfreq(nfft, 1.0 / fs)
+    if freq is None:
+        freq = f
     else:
-        return psd, freq
+        freq = np.array(freq, dtype="float64")
+
+    if output == "energy":
+        psd = np.zeros((n_windows, n_channels))
+    else:
+        psd = np.zeros((n_windows, freq.size, n_channels))
+    # Blocks of windows, to bound the size of the data read and of the stacked ffts:
+    n_block = max(1, MAX_BLOCK_SIZE // (max(window_length, nfft) * n_channels))
+    for start in range(0, n_windows, n_block):
+        stop = min(start + n_block, n_windows)
+        data = np.asarray(x[start * window_step:(stop - 1) * window_step + window_length]).reshape((-1, n_channels))
+        windows = _sliding_windows(data, window_length, window_step, 0)
+        block_psd = _power_spectrum(_sliding_windows(windows, nperseg, step, 1), tapers, nfft, detrend)
+        if freq is not f:
+            block_psd = _resample_spectrum(f, block_psd, freq, resample)
+        psd[start:stop] = _spectral_output(block_psd, freq, output)
+
+    time = (np.arange(n_windows) * window_step + 0.5 * (window_length - 1)) / fs
+    if output == "energy":
+        return psd.reshape((n_windows, ) + channels_shape), freq, time
+    else:
+        return psd.reshape((n_windows, freq.size) + channels_shape), freq, time
+
+
+# Sliding window features:
+
+def _window_sums(cumsum, window_length, window_step, n_windows):
+    # Sums of windows of values from their cumulative sum along the first dimension, preceded by a zero
+    starts = np.arange(n_windows) * window_step
+    return cumsum[starts + window_length] - cumsum[starts]
+
+
+def onset_times(feature, time, threshold=None, n_baseline=30, n_sd=5.0, min_windows=3):
+    """
+    Onset per channel of a sliding window feature, i.e., the time of the first window starting a run of at least
+    min_windows consecutive windows with feature above threshold
+    :param feature: an array of (n_windows, n_channels) values
+    :param time: the times of the windows
+    :param threshold: a threshold per channel (default: median + n_sd * the robust standard deviation,
+                      i.e., 1.4826 * the median absolute deviation, of the first n_baseline windows)
+    :return: the onset times per channel, nan for channels without onset
+    With the default parameters, the false positive rate on stationary gaussian noise, i.e., the ratio of channels of
+    1000 windows of line length or energy (of 16 samples or more each) with an onset, is below 0.1%.
+    """
+    feature = np.asarray(feature).reshape((feature.shape[0], -1))
+    if threshold is None:
+        baseline = feature[:n_baseline]
+        median = np.median(baseline, axis=0)
+        threshold = median + n_sd * 1.4826 * np.median(np.abs(baseline - median), axis=0)
+    above = np.concatenate([np.zeros((1, feature.shape[1])), np.cumsum(feature > threshold, axis=0)])
+    # Windows starting runs of min_windows suprathreshold windows:
+    runs = (above[min_windows:] - above[:-min_windows]) == min_windows
+    onsets = np.nan * np.ones((feature.shape[1], ))
+    has_onset = np.any(runs, axis=0)
+    onsets[has_onset] = np.asarray(time)[np.argmax(runs, axis=0)[has_onset]]
+    return onsets
+
+
+def sliding_window_features(x, fs, window_length, window_step=None, bands=[], onset_feature="line_length",
+                            onset_threshold=None, n_baseline=30, n_sd=5.0, min_windows=3, window='hanning'):
+    """
+    Line length, energy and band power of sliding windows of all channels, and onset times per channel,
+    computed in one pass over blocks of windows, so that data may also be an h5 dataset (e.g., h5_file["/data"]
+    of a TimeSeries file) or a memory mapped array, read block by block
+    :param x: data arranged along the first dimension
+    :param fs: the sampling frequency
+    :param window_length: the number of samples of each window
+    :param window_step: the number of samples between the starts of consecutive windows (default window_length)
+    :param bands: a list of (low, high) frequency bands, for the power of the windows in each band
+    :param onset_feature: the feature used for onset detection, "line_length" or "energy", see onset_times()
+    :return: a dictionary of "time" (the windows' centers in the units of 1 / fs), "line_length" and "energy" of
+             (n_windows, n_channels), "band_power" of (n_windows, n_bands, n_channels),
+             and "onset_time" of (n_channels) (the start of the onset window), with channels of shape x.shape[1:]
+    """
+    if window_step is None:
+        window_step = window_length
+    n_samples = x.shape[0]
+    channels_shape = x.shape[1:]
+    n_channels = int(np.prod(channels_shape))
+    n_windows = max(0, (n_samples - window_length) // window_step + 1)
+    n_bands = len(bands)
+
+    features = OrderedDict()
+    features["line_length"] = np.zeros((n_windows, n_channels))
+    features["energy"] = np.zeros((n_windows, n_channels))
+    features["band_power"] = np.zeros((n_windows, n_bands, n_channels))
+    if n_bands > 0:
+        tapers = _spectral_tapers("periodogram", window, window_length, None)
+        f = np.fft.rfftfreq(window_length, 1.0 / fs)
+        bands_masks = np.array([(f >= low) & (f <= high) for low, high in bands], dtype="float64")
+
+    # Blocks of windows, to bound the size of the data read and of the stacked ffts:
+    n_block = max(1, MAX_BLOCK_SIZE // (window_length * n_channels))
+    for start in range(0, n_windows, n_block):
+        stop = min(start + n_block, n_windows)
+        data = np.asarray(x[start * window_step:(stop - 1) * window_step + window_length],
+                          dtype="float64").reshape((-1, n_channels))
+        zero = np.zeros((1, n_channels))
+        # Line length and energy from cumulative sums of the block, i.e., in O(n_samples) for any window overlap:
+        cumsum = np.concatenate([zero, np.cumsum(np.abs(np.diff(data, axis=0)), axis=0)])
+        features["line_length"][start:stop] = _window_sums(cumsum, window_length - 1, window_step, stop - start)
+        cumsum = np.concatenate([zero, np.cumsum(data ** 2, axis=0)])
+        features["energy"][start:stop] = _window_sums(cumsum, window_length, window_step, stop - start)
+        if n_bands > 0:
+            windows = _sliding_windows(data, window_length, window_step, 0)
+            psd = _power_spectrum(_sliding_windows(windows, window_length, window_length, 1), tapers, window_length,
+                                  "constant")
+            features["band_power"][start:stop] = np.einsum("bf,wfc->wbc", bands_masks, psd)
+    features["time"] = (np.arange(n_windows) * window_step + 0.5 * (window_length - 1)) / fs
+
+    window_starts = np.arange(n_windows) * window_step / float(fs)
+    features["onset_time"] = onset_times(features[onset_feature].reshape((n_windows, -1)), window_starts,
+                                         onset_threshold, n_baseline, n_sd, min_windows).reshape(channels_shape)
+    for key in ["line_length", "energy"]:
+        features[key] = features[key].reshape((n_windows, ) + channels_shape)
+    features["band_power"] = features["band_power"].reshape((n_windows, n_bands) + channels_shape)
+    return features
 
 
 # Bivariate
@@ -183,6 +757,75 @@ def covariance(x):
     n, m = x.shape
     return np.cov(x.T)[np.triu_indices(n, 1, m)].flatten()
 
-# TODO: a function to return a matrix of pairwise lags...
+def _cross_correlation_block(X, ib, jb, nfft, lags, absolute):
+    # The cross-correlations of channels ib with channels jb, from their ffts X, at the lags,
+    # reduced to their peak value and lag: two (len(ib), len(jb)) arrays
+    xcorr = np.fft.irfft(X[:, ib, np.newaxis] * np.conj(X[:, np.newaxis, jb]), nfft, axis=0)[lags % nfft]
+    if absolute:
+        ipeak = np.argmax(np.abs(xcorr), axis=0)
+    else:
+        ipeak = np.argmax(xcorr, axis=0)
+    peak = np.take_along_axis(xcorr, ipeak[np.newaxis], axis=0)[0]
+    return peak, lags[ipeak]
+
+
+def lagged_cross_correlation(x, max_lag=None, fs=None, absolute=False, block_size=None, n_threads=1):
+    """
+    Peak cross-correlations of all pairs of channels, and their lags, computed by fft in O(n**2 T log T),
+    in blocks of pairs of channels' blocks, optionally by a pool of threads.
+    The cross-correlation of channels i and j at lag k is sum_t x_i[t + k] x_j[t] / (T * std_i * std_j),
+    for mean centered channels, so that a positive peak lag means that channel i follows channel j.
+    :param x: data (T, n_channels) arranged along the first dimension
+    :param max_lag: the maximum absolute lag in samples (default T - 1)
+    :param fs: the sampling frequency, to return lags in the units of 1 / fs (default None for lags in samples)
+    :param absolute: if True, find the peak of the absolute cross-correlation, instead of the maximum one
+    :param block_size: the number of channels per block (default such that a block has about MAX_BLOCK_SIZE values)
+    :param n_threads: the number of threads processing blocks, which speed up the computation
+                      as far as the fft implementation of numpy releases the GIL
+    :return: the (n_channels, n_channels) peak cross-correlations and their lags
+    """
+    x = np.asarray(x, dtype="float64")
+    x = x.reshape((x.shape[0], -1))
+    n_samples, n_channels = x.shape
+    if max_lag is None:
+        max_lag = n_samples - 1
+    max_lag = min(max_lag, n_samples - 1)
+    lags = np.arange(-max_lag, max_lag + 1)
+    # Zero padding to avoid circular wrapping of the lags:
+    nfft = int(2 ** np.ceil(np.log2(n_samples + max_lag)))
+    x = x - x.mean(axis=0)
+    std = x.std(axis=0)
+    std[std == 0.0] = 1.0
+    X = np.fft.rfft(x / (std * np.sqrt(n_samples)), nfft, axis=0)
+    if block_size is None:
+        block_size = max(1, int(np.sqrt(MAX_BLOCK_SIZE / nfft)))
+    blocks = [np.arange(start, min(start + block_size, n_channels)) for start in range(0, n_channels, block_size)]
+    # The upper triangle of pairs of blocks, the lower one following by symmetry:
+    tasks = [(ib, jb) for ii, ib in enumerate(blocks) for jb in blocks[ii:]]
+
+    def run_task(task):
+        return _cross_correlation_block(X, task[0], task[1], nfft, lags, absolute)
+
+    if n_threads > 1:
+        pool = ThreadPool(n_threads)
+        try:
+            results = pool.map(run_task, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [run_task(task) for task in tasks]
+
+    peaks = np.zeros((n_channels, n_channels))
+    peak_lags = np.zeros((n_channels, n_channels), dtype=lags.dtype)
+    for (ib, jb), (peak, peak_lag) in zip(tasks, results):
+        peaks[np.ix_(ib, jb)] = peak
+        peaks[np.ix_(jb, ib)] = peak.T
+        peak_lags[np.ix_(ib, jb)] = peak_lag
+        peak_lags[np.ix_(jb, ib)] = -peak_lag.T
+    if fs is not None:
+        peak_lags = peak_lags / float(fs)
+    return peaks, peak_lags
+
 
 # TODO: multivariate, like PCA, ICA, SVD if needed...
@@ -11,8 +11,10 @@ from tvb_epilepsy.base.utils import initialize_logger, formal_repr, ensure_list,
 from tvb_epilepsy.base.h5_model import convert_to_h5_model
 
 from tvb_epilepsy.base.model_configuration import ModelConfiguration
+from tvb_epilepsy.base.pse_results import PSEResults
 from tvb_epilepsy.base.constants import FOLDER_FIGURES, VERY_LARGE_SIZE, FIG_FORMAT, SAVE_FLAG, SHOW_FLAG
 from tvb_epilepsy.base.plot_factory import plot_in_columns
+from tvb_epilepsy.base.figure_queue import plot_or_submit
 
 from model_vep import Connectivity
 
@@ -118,6 +120,9 @@ class DiseaseHypothesis(object):
             plot_dict_list += dicts_of_lists_to_lists_of_dicts({"name": names, "data": data, "focus_indices": indices,
                                                                 "plot_type": plot_types})
 
+        if isinstance(pse_results, PSEResults):
+            pse_results = pse_results.to_dict()
+
         if isinstance(pse_results, dict):
             ind_ps = len(plot_dict_list) - 2
             for ii, value in enumerate(["propagation_strengths", "e_values", "x0_values"]):
@@ -131,22 +136,29 @@ class DiseaseHypothesis(object):
 
     def plot_lsa(self, model_configuration=None, title="Hypothesis Overview", weighted_eigenvector_sum=False, n_eig=None,
              figure_name='', show_flag=SHOW_FLAG, save_flag=SAVE_FLAG,
-             figure_dir=FOLDER_FIGURES, figure_format=FIG_FORMAT, figsize=VERY_LARGE_SIZE):
+             figure_dir=FOLDER_FIGURES, figure_format=FIG_FORMAT, figsize=VERY_LARGE_SIZE, figure_queue=None):
+        """
+        :param figure_queue: a FigureQueue to render the figure in the background (default None for plotting here)
+        """
 
         if figure_name == '':
             self.name + " " + title
 
         plot_dict_list, width_ratios = self.prepare_for_plot(model_configuration, None, weighted_eigenvector_sum, n_eig)
 
-        return plot_in_columns(plot_dict_list, self.connectivity.region_labels, width_ratios=[],
-                               left_ax_focus_indices=self.get_all_disease_indices(),
-                               right_ax_focus_indices=self.propagation_indices, title=title, figure_name=figure_name,
-                               show_flag=show_flag, save_flag=save_flag, figure_dir=figure_dir,
-                               figure_format=figure_format, figsize=figsize)
+        return plot_or_submit(figure_queue, plot_in_columns, plot_dict_list, self.connectivity.region_labels,
+                              width_ratios=[], left_ax_focus_indices=self.get_all_disease_indices(),
+                              right_ax_focus_indices=self.propagation_indices, title=title, figure_name=figure_name,
+                              show_flag=show_flag, save_flag=save_flag, figure_dir=figure_dir,
+                              figure_format=figure_format, figsize=figsize)
 
     def plot_lsa_pse(self, pse_results, model_configuration=None, title="PSE LSA Hypothesis Overview",
                      weighted_eigenvector_sum=False, n_eig=None, figure_name='', show_flag=SHOW_FLAG,
-                     save_flag=SAVE_FLAG, figure_dir=FOLDER_FIGURES, figure_format=FIG_FORMAT, figsize=VERY_LARGE_SIZE):
+                     save_flag=SAVE_FLAG, figure_dir=FOLDER_FIGURES, figure_format=FIG_FORMAT, figsize=VERY_LARGE_SIZE,
+                     figure_queue=None):
+        """
+        :param figure_queue: a FigureQueue to render the figure in the background (default None for plotting here)
+        """
 
         if figure_name == '':
             self.name + " " + title
@@ -154,11 +166,11 @@ class DiseaseHypothesis(object):
         plot_dict_list, width_ratios = self.prepare_for_plot(model_configuration, pse_results, weighted_eigenvector_sum,
                                                              n_eig)
 
-        return plot_in_columns(plot_dict_list, self.connectivity.region_labels, width_ratios=[],
-                                   left_ax_focus_indices=self.get_all_disease_indices(),
-                                   right_ax_focus_indices=self.propagation_indices, title=title, figure_name=figure_name,
-                                   show_flag=show_flag, save_flag=save_flag, figure_dir=figure_dir,
-                                   figure_format=figure_format, figsize=figsize)
+        return plot_or_submit(figure_queue, plot_in_columns, plot_dict_list, self.connectivity.region_labels,
+                              width_ratios=[], left_ax_focus_indices=self.get_all_disease_indices(),
+                              right_ax_focus_indices=self.propagation_indices, title=title, figure_name=figure_name,
+                              show_flag=show_flag, save_flag=save_flag, figure_dir=figure_dir,
+                              figure_format=figure_format, figsize=figsize)
 
     def sort_disease_indices_values(self, disease_dict):
         indices = []
@@ -0,0 +1,117 @@
+"""
+Queue of figure jobs, rendered in background worker processes with the Agg backend and saved to a figures' folder.
+A figure job is only the name of a plot_factory function (the plot spec) and its (array) arguments, so that
+the pipeline producing the figures does not wait for their rendering.
+"""
+import multiprocessing
+
+from tvb.basic.logger.builder import get_logger
+from tvb_epilepsy.base.constants import FOLDER_FIGURES, FIG_FORMAT
+from tvb_epilepsy.base.utils import formal_repr
+
+LOG = get_logger(__name__)
+
+# The plot_factory functions that can be rendered by figure jobs
+PLOT_FUNCTIONS = ["plot_in_columns", "plot_timeseries", "plot_raster", "plot_trajectories"]
+
+
+def _init_worker():
+    # Workers render without any display
+    from matplotlib import pyplot
+    pyplot.switch_backend("Agg")
+
+
+def _render(plot_fun_name, args, kwargs):
+    from tvb_epilepsy.base import plot_factory
+    getattr(plot_factory, plot_fun_name)(*args, **kwargs)
+    return plot_fun_name
+
+
+class FigureQueue(object):
+
+    def __init__(self, n_workers=1, figure_dir=FOLDER_FIGURES, figure_format=FIG_FORMAT):
+        """
+        :param n_workers: the number of worker processes rendering figures
+        :param figure_dir: the folder where figures are saved, unless a figure job sets its own
+        :param figure_format: the format of the figures, unless a figure job sets its own
+        """
+        self.n_workers = n_workers
+        self.figure_dir = figure_dir
+        self.figure_format = figure_format
+        self.jobs = []
+        self.n_failed = 0
+        # The workers are forked here, so that a queue created before any heavy allocation
+        # does not copy it to the workers:
+        self._pool = multiprocessing.Pool(self.n_workers, initializer=_init_worker)
+
+    def __repr__(self):
+        d = {"01. Number of workers": self.n_workers,
+             "02. Figures' folder": self.figure_dir,
+             "03. Figures' format": self.figure_format,
+             "04. Number of pending figure jobs": len(self.jobs),
+             "05. Number of failed figure jobs": self.n_failed}
+        return formal_repr(self, d)
+
+    def __str__(self):
+        return self.__repr__()
+
+    def submit(self, plot_fun_name, *args, **kwargs):
+        """
+        Submit a figure job and return without waiting for it
+        :param plot_fun_name: the name of the plot_factory function, one of PLOT_FUNCTIONS
+        :param args, kwargs: the arguments of the plot function. Figures are always saved and never shown.
+        :return: the multiprocessing.pool.AsyncResult of the job
+        """
+        if plot_fun_name not in PLOT_FUNCTIONS:
+            raise ValueError("\nPlot function " + str(plot_fun_name) + " is not one of " + str(PLOT_FUNCTIONS) + "!")
+        kwargs["save_flag"] = True
+        kwargs["show_flag"] = False
+        kwargs.setdefault("figure_dir", self.figure_dir)
+        kwargs.setdefault("figure_format", self.figure_format)
+        if self._pool is None:
+            # Restart the workers, after a join or terminate
+            self._pool = multiprocessing.Pool(self.n_workers, initializer=_init_worker)
+        job = self._pool.apply_async(_render, (plot_fun_name, args, kwargs))
+        self.jobs.append((plot_fun_name + " " + str(kwargs.get("title", "")), job))
+        return job
+
+    def join(self):
+        """
+        Wait for all submitted figure jobs to finish, and stop the workers
+        :return: the number of failed figure jobs
+        """
+        if self._pool is None:
+            return 0
+        self._pool.close()
+        self._pool.join()
+        self._pool = None
+        n_failed = 0
+        for name, job in self.jobs:
+            try:
+                job.get()
+            except Exception, e:
+                LOG.warning("Figure job " + name + " failed: " + e.__class__.__name__ + ": " + str(e))
+                n_failed += 1
+        LOG.info("Rendered " + str(len(self.jobs) - n_failed) + " figures to " + self.figure_dir)
+        self.jobs = []
+        self.n_failed += n_failed
+        return n_failed
+
+    def terminate(self):
+        # Stop the workers without waiting for the pending figure jobs
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+        self.jobs = []
+
+
+def plot_or_submit(figure_queue, plot_fun, *args, **kwargs):
+    """
+    Plot directly, if figure_queue is None, or else submit the plot as a figure job to figure_queue
+    :param plot_fun: a plot_factory function, one of PLOT_FUNCTIONS
+    :return: the output of plot_fun, or the multiprocessing.pool.AsyncResult of the figure job
+    """
+    if figure_queue is None:
+        return plot_fun(*args, **kwargs)
+    return figure_queue.submit(plot_fun.__name__, *args, **kwargs)
@@ -162,6 +162,10 @@ def object_to_h5_model_recursively(h5_model, obj, name=""):
                 elif isinstance(obj, dict):
                     obj = sort_dict(obj)
 
+                elif hasattr(obj, "state_for_h5"):
+                    # e.g., a lazy Head, whose components that are not loaded yet are not in its __dict__:
+                    obj = sort_dict(obj.state_for_h5())
+
                 else:
                     obj = sort_dict(vars(obj))
 
@@ -320,7 +324,8 @@ if __name__ == "__main__":
     reader = Reader()
 
     logger.info("Reading from: " + data_folder)
-    head = reader.read_head(data_folder)
+    # Only the connectivity is needed:
+    head = reader.read_head(data_folder, lazy=True)
 
     # # Manual definition of hypothesis...:
     x0_indices = [20]
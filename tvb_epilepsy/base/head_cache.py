@@ -0,0 +1,217 @@
+"""
+Cache of prepared Heads, with a single h5 file per head, keyed by the paths, modification times and sizes of
+the files of the head's folder, the cache format version, and the code and settings deriving the prepared quantities.
+A cached head holds the connectivity with its normalized weights and region labels, the surface, the mappings and T1,
+and the sensors with their region projections, in contiguous datasets, which are memory mapped when read back,
+so that repeated runs skip parsing the head's files and recomputing the derived quantities.
+"""
+import os
+import hashlib
+import inspect
+from collections import OrderedDict
+
+import h5py
+import numpy
+
+from tvb.basic.logger.builder import get_logger
+from tvb_epilepsy.base.constants import FOLDER_VEP_HOME, WEIGHTS_NORM_PERCENT
+from tvb_epilepsy.base.utils import formal_repr, normalize_weights, calculate_projection
+from tvb_epilepsy.base.model_vep import Head, Connectivity, Surface, Sensors
+
+LOG = get_logger(__name__)
+
+# The version of the format of the cached heads' files, to be increased with any change of what is written or how,
+# so that heads cached by previous versions are not read back
+HEAD_CACHE_VERSION = 1
+
+# Connectivity attribute name: Connectivity constructor argument name
+CONNECTIVITY_FIELDS = OrderedDict([("weights", "weights"), ("tract_lengths", "tract_lengths"),
+                                   ("region_labels", "labels"), ("centers", "centers"),
+                                   ("hemispheres", "hemispheres"), ("orientations", "orientation"),
+                                   ("areas", "areas"), ("normalized_weights", "normalized_weights")])
+
+SURFACE_FIELDS = ["vertices", "triangles", "vertex_normals", "triangle_normals"]
+
+SENSORS_FIELDS = ["labels", "locations", "orientations"]
+
+ARRAY_COMPONENTS = ["region_mapping", "volume_mapping", "t1_background"]
+
+SENSORS_COMPONENTS = ["sensorsEEG", "sensorsMEG", "sensorsSEEG"]
+
+
+def _write_array(group, name, value):
+    # None and empty values are written as attributes, arrays as contiguous datasets that can be memory mapped
+    if value is None:
+        group.attrs[name] = "None"
+        return
+    value = numpy.array(value)
+    if value.size == 0:
+        group.attrs[name] = "[]"
+        return
+    if value.dtype.kind == "U":
+        value = value.astype("S")
+    group.create_dataset(name, data=value)
+
+
+def _read_array(group, name, mmap_mode):
+    if name not in group:
+        if group.attrs.get(name, "[]") == "None":
+            return None
+        return numpy.array([])
+    dataset = group[name]
+    offset = dataset.id.get_offset()
+    if mmap_mode is None or offset is None:
+        return dataset[()]
+    return numpy.memmap(dataset.file.filename, mode=mmap_mode, dtype=dataset.dtype, shape=dataset.shape,
+                        offset=offset)
+
+
+def _code_signature(fun):
+    # The source code of a function, or its bytecode and constants if the source is not available
+    try:
+        return inspect.getsource(fun)
+    except (IOError, TypeError):
+        return fun.func_code.co_code + repr(fun.func_code.co_consts)
+
+
+def region_projections(head, sensors_components=["sensorsSEEG"]):
+    """
+    Compute the projections of sensors that are not given per region of the connectivity (e.g., per surface vertex)
+    :param sensors_components: the sensors' components of the head whose projections to compute
+    :return: the head with projections of (n_sensors, n_regions) shape
+    """
+    for component in sensors_components:
+        sensors_dict = getattr(head, component)
+        for sensors, projection in sensors_dict.items():
+            if projection is not None and \
+                    numpy.shape(projection) != (sensors.number_of_sensors, head.number_of_regions):
+                sensors_dict[sensors] = calculate_projection(sensors, head.connectivity)
+    return head
+
+
+class HeadCache(object):
+
+    def __init__(self, folder=os.path.join(FOLDER_VEP_HOME, "head_cache"), mmap_mode="c"):
+        """
+        :param folder: the folder of the cached heads' files
+        :param mmap_mode: the numpy.memmap mode of the arrays of cached heads, "c" (copy-on-write, default) or "r",
+                          or None for reading them into memory
+        """
+        self.folder = folder
+        self.mmap_mode = mmap_mode
+        if not (os.path.isdir(self.folder)):
+            os.makedirs(self.folder)
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        d = {"01. Cache folder": self.folder,
+             "02. Memory map mode": self.mmap_mode,
+             "03. Hits": self.hits,
+             "04. Misses": self.misses}
+        return formal_repr(self, d)
+
+    def __str__(self):
+        return self.__repr__()
+
+    def compute_key(self, reader, root_folder):
+        # The key is a hash of the cache format version, of the code and settings of the prepared quantities,
+        # i.e., the normalized weights and the sensors' projections, of the reader,
+        # and of the paths, modification times and sizes of all files of the head:
+        sha = hashlib.sha1()
+        sha.update("version:" + str(HEAD_CACHE_VERSION))
+        sha.update("weights_norm_percent:" + repr(WEIGHTS_NORM_PERCENT) + repr(normalize_weights.func_defaults))
+        sha.update(_code_signature(normalize_weights))
+        sha.update(_code_signature(calculate_projection))
+        sha.update(_code_signature(region_projections))
+        sha.update(reader.__class__.__name__)
+        root_folder = os.path.abspath(root_folder)
+        sha.update(root_folder)
+        for folder, sub_folders, files in os.walk(root_folder):
+            sub_folders.sort()
+            for filename in sorted(files):
+                path = os.path.join(folder, filename)
+                stat = os.stat(path)
+                sha.update(os.path.relpath(path, root_folder) + ":" + repr(stat.st_mtime) + ":" + str(stat.st_size))
+        return sha.hexdigest()
+
+    def _h5_path(self, key):
+        return os.path.join(self.folder, "Head_" + key + ".h5")
+
+    def _write(self, key, head):
+        # Write to a temporary file first, so that concurrent readers never find a partially written head
+        temp_path = self._h5_path(key) + "." + str(os.getpid()) + ".tmp"
+        h5_file = h5py.File(temp_path, 'w', libver='latest')
+        group = h5_file.create_group("connectivity")
+        group.attrs["file_path"] = str(head.connectivity.file_path)
+        for attribute in CONNECTIVITY_FIELDS:
+            _write_array(group, attribute, getattr(head.connectivity, attribute))
+        if isinstance(head.cortical_surface, Surface):
+            group = h5_file.create_group("cortical_surface")
+            for attribute in SURFACE_FIELDS:
+                _write_array(group, attribute, getattr(head.cortical_surface, attribute))
+        for component in ARRAY_COMPONENTS:
+            _write_array(h5_file, component, getattr(head, component))
+        for component in SENSORS_COMPONENTS:
+            group = h5_file.create_group(component)
+            for ii, (sensors, projection) in enumerate(getattr(head, component).items()):
+                sensors_group = group.create_group(str(ii))
+                sensors_group.attrs["s_type"] = sensors.s_type
+                for attribute in SENSORS_FIELDS:
+                    _write_array(sensors_group, attribute, getattr(sensors, attribute))
+                _write_array(sensors_group, "projection", projection)
+        h5_file.close()
+        os.rename(temp_path, self._h5_path(key))
+
+    def _read(self, key, name=''):
+        h5_file = h5py.File(self._h5_path(key), 'r', libver='latest')
+        group = h5_file["connectivity"]
+        kwargs = dict([(argument, _read_array(group, attribute, self.mmap_mode))
+                       for attribute, argument in CONNECTIVITY_FIELDS.iteritems()])
+        connectivity = Connectivity(group.attrs["file_path"], **kwargs)
+        if "cortical_surface" in h5_file:
+            cortical_surface = Surface(*[_read_array(h5_file["cortical_surface"], attribute, self.mmap_mode)
+                                         for attribute in SURFACE_FIELDS])
+        else:
+            cortical_surface = []
+        rm, vm, t1 = [_read_array(h5_file, component, self.mmap_mode) for component in ARRAY_COMPONENTS]
+        sensors_dicts = []
+        for component in SENSORS_COMPONENTS:
+            sensors_dict = OrderedDict()
+            group = h5_file[component]
+            for ii in sorted(group.keys(), key=int):
+                sensors_group = group[ii]
+                sensors = Sensors(*[_read_array(sensors_group, attribute, self.mmap_mode)
+                                    for attribute in SENSORS_FIELDS], s_type=sensors_group.attrs["s_type"])
+                sensors_dict[sensors] = _read_array(sensors_group, "projection", self.mmap_mode)
+            sensors_dicts.append(sensors_dict)
+        h5_file.close()
+        return Head(connectivity, cortical_surface, rm, vm, t1, name, *sensors_dicts)
+
+    def read_head(self, reader, root_folder, name=''):
+        """
+        Read a prepared head from the cache, or else read it with reader, prepare it and cache it
+        :param reader: a CustomReader or TVBReader instance
+        :param root_folder: the folder of the head's files
+        :return: a Head instance, with all components loaded, and SEEG sensors' projections per region
+        """
+        key = self.compute_key(reader, root_folder)
+        if os.path.isfile(self._h5_path(key)):
+            self.hits += 1
+            LOG.info("Reading cached head of " + root_folder + " from " + self._h5_path(key))
+            return self._read(key, name)
+        self.misses += 1
+        head = region_projections(reader.read_head(root_folder, name, lazy=False))
+        try:
+            self._write(key, head)
+        except Exception, e:
+            LOG.warning("Failed to write head to the cache folder " + str(self.folder) + ": " + str(e))
+        return head
+
+    def clear(self):
+        # Remove all cached heads' files
+        for filename in os.listdir(self.folder):
+            if filename.startswith("Head_") and filename.endswith(".h5"):
+                os.remove(os.path.join(self.folder, filename))
+        self.hits = 0
+        self.misses = 0
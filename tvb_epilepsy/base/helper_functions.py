@@ -8,14 +8,24 @@ def pse_from_hypothesis(hypothesis, n_samples, half_range=0.1, global_coupling=[
                         healthy_regions_parameters=[], model_configuration_service=None, lsa_service=None, 
                         save_services=False, **kwargs):
 
-    from tvb_epilepsy.base.constants import MAX_DISEASE_VALUE, K_DEF, FOLDER_RES
+    from tvb_epilepsy.base.constants import MAX_DISEASE_VALUE, K_DEF, X1_EQ_CR_DEF, FOLDER_RES
     from tvb_epilepsy.base.utils import initialize_logger, linear_index_to_coordinate_tuples, \
-                                        dicts_of_lists_to_lists_of_dicts, list_of_dicts_to_dicts_of_ndarrays
+                                        dicts_of_lists_to_lists_of_dicts
     from tvb_epilepsy.base.sampling_service import StochasticSamplingService
-    from tvb_epilepsy.base.pse_service import PSEService
+    from tvb_epilepsy.base.pse_service import PSEService, lsa_boundary_features
+    from tvb_epilepsy.base.pse_results import PSEResults
 
     logger = initialize_logger(__name__)
-    
+
+    # If a RandomStreams instance is given, each sampler gets its own independent random stream:
+    random_streams = kwargs.get("random_streams", None)
+
+    def random_seed(*key):
+        if random_streams is None:
+            return kwargs.get("random_seed", None)
+        else:
+            return random_streams.seed(*key)
+
     all_regions_indices = range(hypothesis.get_number_of_regions())
     disease_indices = hypothesis.get_regions_disease_indices()
     healthy_indices = np.delete(all_regions_indices, disease_indices).tolist()
@@ -33,7 +43,7 @@ def pse_from_hypothesis(hypothesis, n_samples, half_range=0.1, global_coupling=[
 
         # Now generate samples using a truncated uniform distribution
         sampler = StochasticSamplingService(n_samples=n_samples, n_outputs=1, sampling_module="scipy",
-                                            random_seed=kwargs.get("random_seed", None),
+                                            random_seed=random_seed("x0_values", ii),
                                             trunc_limits={"high": MAX_DISEASE_VALUE},
                                             sampler="uniform",
                                             loc=hypothesis.x0_values[ii] - half_range, scale=2 * half_range)
@@ -47,7 +57,7 @@ def pse_from_hypothesis(hypothesis, n_samples, half_range=0.1, global_coupling=[
 
         # Now generate samples using a truncated uniform distribution
         sampler = StochasticSamplingService(n_samples=n_samples, n_outputs=1, sampling_module="scipy",
-                                            random_seed=kwargs.get("random_seed", None),
+                                            random_seed=random_seed("e_values", ii),
                                             trunc_limits={"high": MAX_DISEASE_VALUE},
                                             sampler="uniform",
                                             loc=hypothesis.e_values[ii] - half_range, scale=2 * half_range)
@@ -65,7 +75,7 @@ def pse_from_hypothesis(hypothesis, n_samples, half_range=0.1, global_coupling=[
 
         # Now generate samples using a truncated normal distribution
         sampler = StochasticSamplingService(n_samples=n_samples, n_outputs=1, sampling_module="scipy",
-                                            random_seed=kwargs.get("random_seed", None),
+                                            random_seed=random_seed("w_values", ii),
                                             trunc_limits={"high": MAX_DISEASE_VALUE},
                                             sampler="norm", loc=hypothesis.w_values[ii], scale=half_range)
         pse_params["samples"].append(sampler.generate_samples(**kwargs))
@@ -85,7 +95,7 @@ def pse_from_hypothesis(hypothesis, n_samples, half_range=0.1, global_coupling=[
 
         # Now generate samples susing a truncated normal distribution
         sampler = StochasticSamplingService(n_samples=n_samples, n_outputs=1, sampling_module="scipy",
-                                            random_seed=kwargs.get("random_seed", None),
+                                            random_seed=random_seed("K_unscaled", str(inds)),
                                             trunc_limits={"low": 0.0}, sampler="norm", loc=kloc, scale=30*half_range)
         pse_params["samples"].append(sampler.generate_samples(**kwargs))
 
@@ -98,7 +108,7 @@ def pse_from_hypothesis(hypothesis, n_samples, half_range=0.1, global_coupling=[
         n_params = len(inds)
         sampler = StochasticSamplingService(n_samples=n_samples, n_outputs=n_params, sampler="uniform",
                                             trunc_limits={"low": 0.0}, sampling_module="scipy",
-                                            random_seed=kwargs.get("random_seed", None),
+                                            random_seed=random_seed("healthy", name),
                                             loc=kwargs.get("loc", 0.0), scale=kwargs.get("scale", 2*half_range))
 
         samples = sampler.generate_samples(**kwargs)
@@ -108,11 +118,47 @@ def pse_from_hypothesis(hypothesis, n_samples, half_range=0.1, global_coupling=[
 
     # Now run pse service to generate output samples:
 
+    # Optionally, the LSA of each sample updates the eigen decomposition of the hypothesis' model configuration:
+    eigen_decomposition = None
+    if kwargs.get("incremental_lsa", False) and kwargs.get("model_configuration", None) is not None:
+        from tvb_epilepsy.base.lsa_service import LSAService
+        if lsa_service is None:
+            eigen_decomposition = LSAService().eigen_decomposition(kwargs["model_configuration"])
+        else:
+            eigen_decomposition = lsa_service.eigen_decomposition(kwargs["model_configuration"])
+
     pse = PSEService("LSA", hypothesis=hypothesis, params_pse=pse_params_list)
-    pse_results, execution_status = pse.run_pse(grid_mode=False, lsa_service_input=lsa_service,
-                                                model_configuration_service_input=model_configuration_service)
 
-    pse_results = list_of_dicts_to_dicts_of_ndarrays(pse_results)
+    n_refinement_samples = kwargs.get("n_refinement_samples", 0)
+    if n_refinement_samples > 0:
+        # Adaptive sweep: n_samples make up the coarse design,
+        # and n_refinement_samples are placed where propagation strengths or equilibrium stability change
+        x1EQcr = getattr(model_configuration_service, "x1EQcr", X1_EQ_CR_DEF)
+        pse_results, execution_status = \
+            pse.run_pse_adaptive(n_refinement_samples, batch_size=kwargs.get("refinement_batch_size", None),
+                                 features_fun=lambda output: lsa_boundary_features(output, x1EQcr),
+                                 params_ids=range(len(pse_params["path"])), random_streams=random_streams,
+                                 policy=kwargs.get("pse_policy", None), lsa_service_input=lsa_service,
+                                 model_configuration_service_input=model_configuration_service,
+                                 eigen_decomposition_input=eigen_decomposition)
+        for ip in range(len(pse_params_list)):
+            pse_params_list[ip]["samples"] = pse.pse_params[:, ip]
+        # The number of loops is known only now:
+        results = pse_results
+        pse_results = PSEResults(pse.n_loops, storage=kwargs.get("pse_results_storage", "memory"),
+                                 path=kwargs.get("pse_results_path", None))
+        pse_results.set_loops(results)
+        del results
+    else:
+        # Outputs are written in place into an (optionally memmap or h5 backed) store of arrays of all loops:
+        pse_results = PSEResults(pse.n_loops, storage=kwargs.get("pse_results_storage", "memory"),
+                                 path=kwargs.get("pse_results_path", None))
+        pse_results, execution_status = pse.run_pse(grid_mode=False, random_streams=random_streams,
+                                                    policy=kwargs.get("pse_policy", None), pse_results=pse_results,
+                                                    lsa_service_input=lsa_service,
+                                                    model_configuration_service_input=model_configuration_service,
+                                                    eigen_decomposition_input=eigen_decomposition)
+    pse_results.flush()
 
     if save_services:
         logger.info(pse.__repr__())
@@ -131,18 +177,20 @@ def sensitivity_analysis_pse_from_hypothesis(hypothesis, n_samples, method="sobo
 
     from tvb_epilepsy.base.constants import MAX_DISEASE_VALUE, FOLDER_RES
     from tvb_epilepsy.base.utils import initialize_logger, linear_index_to_coordinate_tuples, \
-                                        list_of_dicts_to_dicts_of_ndarrays, dicts_of_lists_to_lists_of_dicts
+                                        dicts_of_lists_to_lists_of_dicts
     from tvb_epilepsy.base.sampling_service import StochasticSamplingService
     from tvb_epilepsy.base.pse_service import PSEService
+    from tvb_epilepsy.base.pse_results import PSEResults
     from tvb_epilepsy.base.sensitivity_analysis_service import SensitivityAnalysisService, METHODS
+    from tvb_epilepsy.base.surrogate_model import PolynomialChaosSurrogate
     
     logger = initialize_logger(__name__)
     
     method = method.lower()
     if np.in1d(method, METHODS):
-        if np.in1d(method, ["delta", "dgsm"]):
+        if np.in1d(method, ["delta", "dgsm", "delta_fast"]):
             sampler = "latin"
-        elif method == "sobol":
+        elif np.in1d(method, ["sobol", "sobol_fast"]):
             sampler = "saltelli"
         elif method == "fast":
             sampler = "fast_sampler"
@@ -213,36 +261,69 @@ def sensitivity_analysis_pse_from_hypothesis(hypothesis, n_samples, method="sobo
     n_samples = input_samples.shape[1]
     pse_params.update({"samples": [np.array(value) for value in input_samples.tolist()]})
 
-    pse_params_list = dicts_of_lists_to_lists_of_dicts(pse_params)
-
-    # Add a random jitter to the healthy regions if required...:
-    for val in healthy_regions_parameters:
-        inds = val.get("indices", healthy_indices)
-        name = val.get("name", "x0")
-        n_params = len(inds)
-        sampler = StochasticSamplingService(n_samples=n_samples, n_outputs=n_params, sampler="uniform",
-                                            trunc_limits={"low": 0.0}, sampling_module="scipy",
-                                            random_seed=kwargs.get("random_seed", None),
-                                            loc=kwargs.get("loc", 0.0), scale=kwargs.get("scale", 2*half_range))
-
-        samples = sampler.generate_samples(**kwargs)
-        for ii in range(n_params):
-            pse_params_list.append({"path": "model_configuration_service." + name, "samples": samples[ii],
-                                    "indices": [inds[ii]], "name": name})
-
-    # Now run pse service to generate output samples:
+    def run_lsa_pse(samples):
+
+        pse_params_list = dicts_of_lists_to_lists_of_dicts(dict(pse_params, samples=[np.array(value) for value in
+                                                                                      samples.tolist()]))
+
+        # Add a random jitter to the healthy regions if required...:
+        for val in healthy_regions_parameters:
+            inds = val.get("indices", healthy_indices)
+            name = val.get("name", "x0")
+            n_params = len(inds)
+            sampler = StochasticSamplingService(n_samples=samples.shape[1], n_outputs=n_params, sampler="uniform",
+                                                trunc_limits={"low": 0.0}, sampling_module="scipy",
+                                                random_seed=kwargs.get("random_seed", None),
+                                                loc=kwargs.get("loc", 0.0), scale=kwargs.get("scale", 2*half_range))
+
+            jitter_samples = sampler.generate_samples(**kwargs)
+            for ii in range(n_params):
+                pse_params_list.append({"path": "model_configuration_service." + name, "samples": jitter_samples[ii],
+                                        "indices": [inds[ii]], "name": name})
+
+        # Now run pse service to generate output samples:
+
+        pse = PSEService("LSA", hypothesis=hypothesis, params_pse=pse_params_list)
+        pse_results = PSEResults(pse.n_loops, storage=kwargs.get("pse_results_storage", "memory"),
+                                 path=kwargs.get("pse_results_path", None))
+        pse_results, execution_status = pse.run_pse(grid_mode=False, policy=kwargs.get("pse_policy", None),
+                                                    pse_results=pse_results, lsa_service_input=lsa_service,
+                                                    model_configuration_service_input=model_configuration_service)
+        return pse, pse_results, execution_status
+
+    n_surrogate_samples = kwargs.get("n_surrogate_samples", None)
+    if n_surrogate_samples is None:
+        pse, pse_results, execution_status = run_lsa_pse(input_samples)
+        pse_results.flush()
+        outputs = pse_results.sa_outputs(["propagation_strengths"], ["LSA Propagation Strength"])
 
-    pse = PSEService("LSA", hypothesis=hypothesis, params_pse=pse_params_list)
-    pse_results, execution_status = pse.run_pse(grid_mode=False, lsa_service_input=lsa_service,
-                                                model_configuration_service_input=model_configuration_service)
-
-    pse_results = list_of_dicts_to_dicts_of_ndarrays(pse_results)
+    else:
+        # Emulator mode: run the LSA pse only for a modest latin hypercube design,
+        # fit a polynomial chaos surrogate to its outputs, and evaluate the sensitivity analysis design on it
+        sampler = StochasticSamplingService(n_samples=n_surrogate_samples, n_outputs=n_inputs, sampler="latin",
+                                            trunc_limits={}, sampling_module="salib",
+                                            random_seed=kwargs.get("random_seed", None), bounds=pse_params["bounds"])
+        train_samples = sampler.generate_samples(**kwargs)
+        pse, pse_results, execution_status = run_lsa_pse(train_samples)
+        # Failed loops are left out of the training set:
+        succeeded = np.where(execution_status)[0]
+        pse_results = pse_results.to_dict(succeeded)
+        surrogate = PolynomialChaosSurrogate(pse_params["bounds"], degree=kwargs.get("surrogate_degree", 3),
+                                             regularization=kwargs.get("surrogate_regularization", 0.0))
+        surrogate.fit(train_samples[:, succeeded].T, pse_results["propagation_strengths"])
+        logger.info(surrogate.__repr__())
+        max_error = kwargs.get("surrogate_max_error", 0.1)
+        if np.any(surrogate.validation_error > max_error):
+            logger.warning("Surrogate model leave-one-out relative error is up to " +
+                           str(surrogate.validation_error.max()) + " for outputs " +
+                           str(np.where(surrogate.validation_error > max_error)[0]) + "!")
+        outputs = [{"names": ["LSA Propagation Strength"], "values": surrogate.predict(input_samples.T)}]
+        pse_results.update({"train_samples": train_samples[:, succeeded],
+                            "surrogate_validation_error": surrogate.validation_error})
 
     # Now prepare inputs and outputs and run the sensitivity analysis:
     # NOTE!: Without the jittered healthy regions which we don' want to include into the sensitivity analysis!
     inputs = dicts_of_lists_to_lists_of_dicts(pse_params)
-
-    outputs = [{"names": ["LSA Propagation Strength"], "values": pse_results["propagation_strengths"]}]
     sensitivity_analysis_service = SensitivityAnalysisService(inputs, outputs, method=method,
                                                               calc_second_order=kwargs.get("calc_second_order", True),
                                                               conf_level=kwargs.get("conf_level", 0.95))
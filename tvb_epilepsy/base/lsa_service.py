@@ -4,9 +4,11 @@ Service to do LSA computation.
 """
 import numpy
 from collections import OrderedDict
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
 
 from tvb.basic.logger.builder import get_logger
-from tvb_epilepsy.base.constants import EIGENVECTORS_NUMBER_SELECTION, WEIGHTED_EIGENVECTOR_SUM
+from tvb_epilepsy.base.constants import EIGENVECTORS_NUMBER_SELECTION, WEIGHTED_EIGENVECTOR_SUM, INTERACTIVE_ELBOW_POINT
 from tvb_epilepsy.base.utils import formal_repr, weighted_vector_sum
 from tvb_epilepsy.base.h5_model import convert_to_h5_model
 from tvb_epilepsy.base.calculations_factory import calc_fz_jac_square_taylor
@@ -59,7 +61,12 @@ class LSAService(object):
         h5_model.write_to_h5(folder, filename)
 
     def get_curve_elbow_point(self, values_array):
-        return curve_elbow_point(values_array)
+        elbow = curve_elbow_point(values_array)
+        if INTERACTIVE_ELBOW_POINT:
+            # Opt-in manual selection, which blocks until the user selects or accepts the elbow point
+            from tvb_epilepsy.base.plot_factory import select_curve_elbow_point
+            elbow = select_curve_elbow_point(values_array, elbow)
+        return elbow
 
     def _ensure_eigen_vectors_number(self, eigen_values, e_values, x0_values, disease_indices):
         if self.eigen_vectors_number is None:
@@ -92,16 +99,54 @@ class LSAService(object):
 
         return fz_jacobian
 
+    def eigen_decomposition(self, model_configuration, jacobian=None):
+        """
+        Compute a base eigen decomposition, e.g., of the hypothesis around which a PSE is run,
+        to be updated for each sample by run_lsa_incremental
+        :return: a dictionary of the jacobian, its eigen values and eigenvectors, sorted as in run_lsa,
+                 and the inverse of the eigenvectors' matrix
+        """
+        if jacobian is None:
+            jacobian = self._compute_jacobian(model_configuration)
+
+        eigen_values, eigen_vectors = sort_eigen_pairs(*numpy.linalg.eig(jacobian))
+
+        return {"jacobian": jacobian, "eigen_values": eigen_values, "eigen_vectors": eigen_vectors,
+                "inverse_eigen_vectors": numpy.linalg.inv(eigen_vectors)}
+
     def run_lsa(self, disease_hypothesis, model_configuration):
 
         jacobian = self._compute_jacobian(model_configuration)
 
         # Perform eigenvalue decomposition
-        eigen_values, eigen_vectors = numpy.linalg.eig(jacobian)
+        self.eigen_values, self.eigen_vectors = sort_eigen_pairs(*numpy.linalg.eig(jacobian))
+
+        return self._lsa_hypothesis(disease_hypothesis, model_configuration)
+
+    def run_lsa_incremental(self, disease_hypothesis, model_configuration, base_decomposition, max_rank_ratio=0.25,
+                            max_cluster_ratio=0.25, atol=0.0, rtol=1e-10):
+        """
+        Run LSA by updating a base eigen decomposition, as returned by eigen_decomposition, for a jacobian that differs
+        from the base one only in a few rows and columns, e.g., for changes of the epileptogenicity of a few regions
+        of an epileptogenicity hypothesis, each of which changes a single column of the jacobian.
+        If the update is not possible, or its residual check fails, a full eigen decomposition is computed instead.
+        :param max_rank_ratio, max_cluster_ratio, atol, rtol: see update_eigen_decomposition
+        :return: the LSA hypothesis, as for run_lsa
+        """
+
+        jacobian = self._compute_jacobian(model_configuration)
 
-        sorted_indices = numpy.argsort(eigen_values, kind='mergesort')
-        self.eigen_values = eigen_values[sorted_indices]
-        self.eigen_vectors = eigen_vectors[:, sorted_indices]
+        eigen_pairs = update_eigen_decomposition(base_decomposition, jacobian, max_rank_ratio, max_cluster_ratio,
+                                                 atol, rtol)
+        if eigen_pairs is None:
+            LOG.debug("Incremental LSA update not possible. Computing a full eigen decomposition...")
+            eigen_pairs = numpy.linalg.eig(jacobian)
+
+        self.eigen_values, self.eigen_vectors = sort_eigen_pairs(*eigen_pairs)
+
+        return self._lsa_hypothesis(disease_hypothesis, model_configuration)
+
+    def _lsa_hypothesis(self, disease_hypothesis, model_configuration):
 
         self._ensure_eigen_vectors_number(self.eigen_values, model_configuration.e_values,
                                           model_configuration.x0_values, disease_hypothesis.get_all_disease_indices())
@@ -130,3 +175,136 @@ class LSAService(object):
                                  {tuple(disease_hypothesis.e_indices): disease_hypothesis.e_values},
                                  {tuple(disease_hypothesis.w_indices): disease_hypothesis.w_values},
                                  propagation_indices, lsa_propagation_strength, "LSA_" + disease_hypothesis.name)
+
+
+def sort_eigen_pairs(eigen_values, eigen_vectors):
+    """
+    Sort eigenpairs by their eigen values, and orient each eigenvector so that its largest component is positive (real),
+    so that sums of eigenvectors do not depend on the arbitrary orientation of the eigenvectors of an eigen solver
+    """
+    sorted_indices = numpy.argsort(eigen_values, kind='mergesort')
+    eigen_vectors = eigen_vectors[:, sorted_indices]
+    largest = eigen_vectors[numpy.argmax(numpy.abs(eigen_vectors), axis=0), numpy.arange(eigen_vectors.shape[1])]
+    return eigen_values[sorted_indices], eigen_vectors * (numpy.abs(largest) / largest)
+
+
+def update_eigen_decomposition(base_decomposition, jacobian, max_rank_ratio=0.25, max_cluster_ratio=0.25, atol=0.0,
+                               rtol=1e-10, max_iterations=10):
+    """
+    Low rank update of the eigen decomposition J = X * diag(L) * X^-1 of a base jacobian J for a new jacobian J + dJ,
+    where dJ is nonzero only on r rows and columns.
+    In the base eigenvectors' basis the new jacobian is diag(L) + A * B, with A = X^-1 * U and B = V' * X
+    for a rank r factorization dJ = U * V', computed from the changed rows and columns only in O(r * n^2).
+    Initial eigenpairs are those of first order perturbation theory, and of degenerate perturbation theory,
+    i.e., of the eigen decomposition of small blocks, for clusters of eigenvalues that are close compared to the change.
+    They are refined by inverse iteration with Rayleigh quotient shifts, solving with diag(L) - s + A * B
+    via the Woodbury identity in O(r^2 * n) per eigenpair.
+    :param max_rank_ratio: the maximum number of changed rows and columns, as a ratio of the jacobian's size
+    :param max_cluster_ratio: the maximum size of a cluster of eigenvalues, as a ratio of the jacobian's size
+    :param atol: changes of the jacobian's elements up to atol are neglected, but still count in the residuals
+    :param rtol: the maximum relative residual |(J + dJ) * x - l * x| / (|J + dJ| * |x|) of each updated eigenpair,
+                 with Frobenius norms. Updated eigenvalues closer than 100 * rtol * |J + dJ| to each other
+                 are considered as eigenpairs found twice, i.e., as a failed update.
+    :return: the updated eigen values and (unit norm) eigenvectors, or None if the change is not of low rank,
+             a cluster is too large, or the residual check fails
+    """
+
+    eigen_values = base_decomposition["eigen_values"]
+    eigen_vectors = base_decomposition["eigen_vectors"]
+    inverse_eigen_vectors = base_decomposition["inverse_eigen_vectors"]
+    n = eigen_values.size
+
+    delta_jacobian = jacobian - base_decomposition["jacobian"]
+    changed = numpy.abs(delta_jacobian) > atol
+    # Each row or column covers at most n changed elements:
+    max_lines = int(max_rank_ratio * n)
+    if numpy.sum(changed) > max_lines * n:
+        return None
+    rows, cols = _cover_changes(changed, max_lines)
+    if rows is None:
+        return None
+    if len(rows) + len(cols) == 0:
+        return eigen_values.copy(), eigen_vectors.copy()
+
+    # dJ = dJ[rows, :] + dJ[other rows, cols], so that, in the eigenvectors' basis, A * B has rank r:
+    other_rows = numpy.delete(numpy.arange(n), rows)
+    A = numpy.hstack([inverse_eigen_vectors[:, rows],
+                      numpy.dot(inverse_eigen_vectors[:, other_rows], delta_jacobian[other_rows][:, cols])])
+    B = numpy.vstack([numpy.dot(delta_jacobian[rows], eigen_vectors), eigen_vectors[cols]])
+    r = A.shape[1]
+    projected_delta = numpy.dot(A, B)
+
+    # Clusters of eigenvalues coupled by the change more strongly than they are separated:
+    coupling = numpy.abs(projected_delta)
+    coupled = numpy.abs(eigen_values[:, numpy.newaxis] - eigen_values[numpy.newaxis, :]) < 3.0 * (coupling + coupling.T)
+    labels = connected_components(csr_matrix(coupled), directed=False)[1]
+    sizes = numpy.bincount(labels)
+    if numpy.max(sizes) > max(max_cluster_ratio * n, 1):
+        return None
+    clusters = [numpy.where(labels == label)[0] for label in numpy.where(sizes > 1)[0]]
+    clusters_eigen_pairs = [numpy.linalg.eig(numpy.diag(eigen_values[cluster]) +
+                                             projected_delta[numpy.ix_(cluster, cluster)]) for cluster in clusters]
+
+    # Initial eigenpairs, with eigenvectors in the base eigenvectors' basis:
+    dtype = numpy.result_type(eigen_values, projected_delta, *[values for values, vectors in clusters_eigen_pairs])
+    new_eigen_values = (eigen_values + numpy.diag(projected_delta)).astype(dtype)
+    Y = numpy.eye(n, dtype=dtype)
+    for cluster, (values, vectors) in zip(clusters, clusters_eigen_pairs):
+        new_eigen_values[cluster] = values
+        Y[numpy.ix_(cluster, cluster)] = vectors
+
+    # Inverse iteration: solve (diag(L) - s + A * B) y_new = y via the Woodbury identity, with the r x r matrices
+    # S = I + B * (diag(L) - s)^-1 * A of all eigenpairs computed at once from the outer products of B and A:
+    outer_products = (B.T[:, :, numpy.newaxis] * A[:, numpy.newaxis, :]).reshape(n, r * r)
+    scale = numpy.linalg.norm(jacobian)
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        for iteration in range(max_iterations):
+            residuals = eigen_values[:, numpy.newaxis] * Y + numpy.dot(A, numpy.dot(B, Y)) - Y * new_eigen_values
+            active = numpy.where(numpy.linalg.norm(residuals, axis=0) >
+                                 0.01 * rtol * scale * numpy.linalg.norm(Y, axis=0))[0]
+            if active.size == 0:
+                break
+            inverse_shifted = 1.0 / (eigen_values[:, numpy.newaxis] - new_eigen_values[numpy.newaxis, active])
+            S = numpy.eye(r) + numpy.dot(inverse_shifted.T, outer_products).reshape(-1, r, r)
+            U = inverse_shifted * Y[:, active]
+            coefficients = numpy.linalg.solve(S, numpy.dot(B, U).T[:, :, numpy.newaxis])[:, :, 0]
+            Y_active = U - inverse_shifted * numpy.dot(A, coefficients.T)
+            Y_active /= numpy.linalg.norm(Y_active, axis=0)
+            if not numpy.all(numpy.isfinite(Y_active)):
+                return None
+            # Rayleigh quotients of the unit norm vectors:
+            new_eigen_values[active] = numpy.sum(Y_active.conj() * (eigen_values[:, numpy.newaxis] * Y_active +
+                                                                    numpy.dot(A, numpy.dot(B, Y_active))), axis=0)
+            Y[:, active] = Y_active
+
+    # Eigenvectors in the original basis, and the residual check with the new jacobian:
+    new_eigen_vectors = numpy.dot(eigen_vectors, Y)
+    norms = numpy.linalg.norm(new_eigen_vectors, axis=0)
+    residuals = numpy.dot(jacobian, new_eigen_vectors) - new_eigen_vectors * new_eigen_values
+    if numpy.any(numpy.linalg.norm(residuals, axis=0) > rtol * scale * norms):
+        return None
+    separations = numpy.abs(new_eigen_values[:, numpy.newaxis] - new_eigen_values[numpy.newaxis, :])
+    numpy.fill_diagonal(separations, numpy.inf)
+    if numpy.min(separations) <= 100 * rtol * scale:
+        return None
+
+    return new_eigen_values, new_eigen_vectors / norms
+
+
+def _cover_changes(changed, max_lines):
+    # Greedily select the rows and columns that cover all changed elements of the jacobian
+    changed = numpy.array(changed)
+    rows = []
+    cols = []
+    while numpy.any(changed):
+        if len(rows) + len(cols) >= max_lines:
+            return None, None
+        row_counts = changed.sum(axis=1)
+        col_counts = changed.sum(axis=0)
+        if row_counts.max() >= col_counts.max():
+            rows.append(row_counts.argmax())
+            changed[rows[-1]] = False
+        else:
+            cols.append(col_counts.argmax())
+            changed[:, cols[-1]] = False
+    return rows, cols
@@ -0,0 +1,129 @@
+# coding=utf-8
+"""
+Content addressed cache of ModelConfiguration results of the ModelConfigurationService.
+It holds a bounded LRU in memory, and optionally a tier of h5 files on disk.
+"""
+import os
+import hashlib
+from collections import OrderedDict
+from copy import deepcopy
+
+import h5py
+import numpy
+
+from tvb.basic.logger.builder import get_logger
+from tvb_epilepsy.base.utils import formal_repr
+from tvb_epilepsy.base.model_configuration import ModelConfiguration
+
+LOG = get_logger(__name__)
+
+# ModelConfiguration attribute name: ModelConfiguration constructor argument name
+MODEL_CONFIGURATION_FIELDS = OrderedDict([("yc", "yc"), ("Iext1", "Iext1"), ("K", "K"), ("a", "a"), ("b", "b"),
+                                          ("x0cr", "x0cr"), ("rx0", "rx0"), ("x1EQ", "x1EQ"), ("zEQ", "zEQ"),
+                                          ("Ceq", "Ceq"), ("x0_values", "x0_values"), ("e_values", "e_values"),
+                                          ("connectivity_matrix", "connectivity")])
+
+
+def _update_hash(sha, value):
+    if isinstance(value, basestring):
+        sha.update(value)
+    else:
+        value = numpy.ascontiguousarray(value, dtype=numpy.float64)
+        sha.update(str(value.shape))
+        sha.update(value.tobytes())
+
+
+class ModelConfigurationCache(object):
+
+    def __init__(self, max_size=128, folder=None):
+        self.max_size = max_size
+        self.folder = folder
+        if self.folder is not None and not (os.path.isdir(self.folder)):
+            os.makedirs(self.folder)
+        self._memory = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        d = {"01. Maximum number of configurations in memory": self.max_size,
+             "02. Number of configurations in memory": len(self._memory),
+             "03. Disk folder": self.folder,
+             "04. Hits": self.hits,
+             "05. Misses": self.misses
+             }
+        return formal_repr(self, d)
+
+    def __str__(self):
+        return self.__repr__()
+
+    def compute_key(self, model_configuration_service, disease_hypothesis, mode):
+        # The key is a hash of all inputs that determine the resulting model configuration:
+        sha = hashlib.sha1()
+        _update_hash(sha, mode)
+        _update_hash(sha, model_configuration_service.x1eq_mode)
+        for value in [model_configuration_service.yc, model_configuration_service.Iext1,
+                      model_configuration_service.K_unscaled, model_configuration_service.a,
+                      model_configuration_service.b, model_configuration_service.x0, model_configuration_service.E,
+                      model_configuration_service.x1EQcr,
+                      disease_hypothesis.get_weights(),
+                      disease_hypothesis.x0_indices, disease_hypothesis.x0_values,
+                      disease_hypothesis.e_indices, disease_hypothesis.e_values,
+                      disease_hypothesis.w_indices, disease_hypothesis.w_values]:
+            _update_hash(sha, value)
+        return sha.hexdigest()
+
+    def _h5_path(self, key):
+        return os.path.join(self.folder, "ModelConfig_" + key + ".h5")
+
+    def _read_from_disk(self, key):
+        if self.folder is None or not (os.path.isfile(self._h5_path(key))):
+            return None
+        h5_file = h5py.File(self._h5_path(key), 'r', libver='latest')
+        kwargs = dict()
+        for attribute, argument in MODEL_CONFIGURATION_FIELDS.iteritems():
+            if attribute in h5_file:
+                kwargs[argument] = h5_file["/" + attribute][()]
+        h5_file.close()
+        return ModelConfiguration(**kwargs)
+
+    def _write_to_disk(self, key, model_configuration):
+        if self.folder is None:
+            return
+        # Write to a temporary file first, so that concurrent readers never find a partially written configuration
+        temp_path = self._h5_path(key) + "." + str(os.getpid()) + ".tmp"
+        h5_file = h5py.File(temp_path, 'w', libver='latest')
+        for attribute in MODEL_CONFIGURATION_FIELDS:
+            value = getattr(model_configuration, attribute, None)
+            if value is not None:
+                h5_file.create_dataset("/" + attribute, data=value)
+        h5_file.close()
+        os.rename(temp_path, self._h5_path(key))
+
+    def _remember(self, key, model_configuration):
+        self._memory[key] = model_configuration
+        while len(self._memory) > self.max_size:
+            self._memory.popitem(last=False)
+
+    def get(self, key):
+        model_configuration = self._memory.pop(key, None)
+        if model_configuration is None:
+            model_configuration = self._read_from_disk(key)
+        if model_configuration is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        # Move to the most recently used position:
+        self._remember(key, model_configuration)
+        return deepcopy(model_configuration)
+
+    def put(self, key, model_configuration):
+        self._remember(key, deepcopy(model_configuration))
+        try:
+            self._write_to_disk(key, model_configuration)
+        except Exception, e:
+            LOG.warning("Failed to write model configuration to the cache folder " + str(self.folder) + ": " + str(e))
+
+    def clear(self):
+        self._memory = OrderedDict()
+        self.hits = 0
+        self.misses = 0
@@ -26,6 +26,9 @@ class ModelConfigurationService(object):
 
     x1EQcr = X1_EQ_CR_DEF
 
+    # An optional ModelConfigurationCache, shared by all instances (and deep copies) of the service
+    cache = None
+
     def __init__(self, number_of_regions, x0=X0_DEF,yc=YC_DEF, Iext1=I_EXT1_DEF, K=K_DEF, a=A_DEF, b=B_DEF, E=E_DEF, 
                  x1eq_mode="optimize"):
         self.number_of_regions = number_of_regions
@@ -128,14 +131,33 @@ class ModelConfigurationService(object):
                                                  x0cr, rx0, x1EQ, zEQ, Ceq, x0_values, e_values, connectivity_matrix)
         return model_configuration
 
+    def _configure_model_cached(self, disease_hypothesis, mode, configure_model):
+        if self.cache is None:
+            return configure_model(disease_hypothesis)
+        key = self.cache.compute_key(self, disease_hypothesis, mode)
+        model_configuration = self.cache.get(key)
+        if model_configuration is None:
+            model_configuration = configure_model(disease_hypothesis)
+            self.cache.put(key, model_configuration)
+        else:
+            # Keep the service in the same state as if the configuration was computed:
+            self._normalize_global_coupling()
+        return model_configuration
+
     def configure_model_from_E_hypothesis(self, disease_hypothesis):
+        return self._configure_model_cached(disease_hypothesis, "E", self._configure_model_from_E_hypothesis)
+
+    def configure_model_from_hypothesis(self, disease_hypothesis):
+        return self._configure_model_cached(disease_hypothesis, "x0", self._configure_model_from_hypothesis)
+
+    def _configure_model_from_E_hypothesis(self, disease_hypothesis):
         # Always normalize K first
         self._normalize_global_coupling()
 
         # Then apply connectivity disease hypothesis scaling if any:
         connectivity_matrix = disease_hypothesis.get_weights()
         if len(disease_hypothesis.w_indices) > 0:
-            connectivity_matrix *= disease_hypothesis.get_connectivity_disease()
+            connectivity_matrix = connectivity_matrix * disease_hypothesis.get_connectivity_disease()
 
         # All nodes except for the diseased ones will get the default epileptogenicity:
         e_values = numpy.array(self.E)
@@ -147,14 +169,14 @@ class ModelConfigurationService(object):
 
         return self.configure_model_from_equilibrium(x1EQ, zEQ, connectivity_matrix)
 
-    def configure_model_from_hypothesis(self, disease_hypothesis):
+    def _configure_model_from_hypothesis(self, disease_hypothesis):
         # Always normalize K first
         self._normalize_global_coupling()
 
         # Then apply connectivity disease hypothesis scaling if any:
         connectivity_matrix = disease_hypothesis.get_weights()
         if len(disease_hypothesis.w_indices) > 0:
-            connectivity_matrix *= disease_hypothesis.get_connectivity_disease()
+            connectivity_matrix = connectivity_matrix * disease_hypothesis.get_connectivity_disease()
 
         # We assume that all nodes have the default (healthy) excitability:
         x0_values = numpy.array(self.x0)
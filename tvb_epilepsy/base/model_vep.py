@@ -1,11 +1,15 @@
 """
 A module for Virtual Epileptic Patient model classes
 
+class HeadComponentLoader
 class Head
 class Connectivity
 class Surface
 class Sensors
 """
+import os
+import tempfile
+import threading
 from collections import OrderedDict
 import numpy as np
 
@@ -17,23 +21,51 @@ from tvb_epilepsy.base.constants import FOLDER_FIGURES, LARGE_SIZE, FIG_FORMAT,
 from tvb_epilepsy.base.plot_factory import _plot_vector, _plot_regions2regions, _save_figure, _check_show
 
 
+class HeadComponentLoader(object):
+    """
+    Loader of a component of a Head on its first access: a function and its arguments, called by the first get().
+    For a component read in the background, e.g., by a thread pool, the function is the get() of its AsyncResult.
+    """
+
+    def __init__(self, fun, *args):
+        self.fun = fun
+        self.args = args
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._value = None
+
+    def get(self):
+        with self._lock:
+            if not self._loaded:
+                self._value = self.fun(*self.args)
+                self._loaded = True
+                self.fun = None
+                self.args = ()
+        return self._value
+
+
 class Head(object):
     """
     One patient virtualization. Fully configured for defining hypothesis on it.
+    All components, but the connectivity, can be given as HeadComponentLoader instances, to be loaded on first access.
     """
 
+    # The components that can be loaded on first access
+    LAZY_COMPONENTS = ["cortical_surface", "region_mapping", "volume_mapping", "t1_background", "sensorsEEG",
+                       "sensorsMEG", "sensorsSEEG"]
+
     def __init__(self, connectivity, cortical_surface, rm, vm, t1, name='',
                  eeg_sensors_dict={}, meg_sensors_dict={}, seeg_sensors_dict={}):
 
         self.connectivity = connectivity
-        self.cortical_surface = cortical_surface
-        self.region_mapping = rm
-        self.volume_mapping = vm
-        self.t1_background = t1
 
-        self.sensorsEEG = eeg_sensors_dict
-        self.sensorsMEG = meg_sensors_dict
-        self.sensorsSEEG = seeg_sensors_dict
+        self._loaders = {}
+        for component, value in zip(self.LAZY_COMPONENTS, [cortical_surface, rm, vm, t1, eeg_sensors_dict,
+                                                           meg_sensors_dict, seeg_sensors_dict]):
+            if isinstance(value, HeadComponentLoader):
+                self._loaders[component] = value
+            else:
+                setattr(self, component, value)
 
         if len(name) == 0:
             self.name = 'Head' + str(self.number_of_regions)
@@ -44,6 +76,35 @@ class Head(object):
                               "Surface": Surface(np.array([]), np.array([])),
                               "Sensors": Sensors(np.array([]), np.array([]))}
 
+    def __getattr__(self, name):
+        # Only called for attributes that are not set, i.e., also for components that are not loaded yet
+        loader = self.__dict__.get("_loaders", {}).get(name, None)
+        if loader is None:
+            raise AttributeError("'" + self.__class__.__name__ + "' object has no attribute '" + name + "'")
+        value = loader.get()
+        setattr(self, name, value)
+        self._loaders.pop(name, None)
+        return value
+
+    def is_loaded(self, component):
+        return component not in self.__dict__.get("_loaders", {})
+
+    def load(self):
+        # Load all components that are not loaded yet
+        for component in list(self.__dict__.get("_loaders", {}).keys()):
+            getattr(self, component)
+        return self
+
+    def __getstate__(self):
+        # Loaders cannot be pickled or copied
+        self.load()
+        return self.__dict__.copy()
+
+    def state_for_h5(self):
+        # All components, loaded, without the (private) loaders, to be written to h5 files
+        self.load()
+        return dict([(key, value) for key, value in self.__dict__.iteritems() if key != "_loaders"])
+
     @property
     def number_of_regions(self):
         return self.connectivity.number_of_regions
@@ -52,15 +113,19 @@ class Head(object):
         return self.connectivity.region_labels[filter_arr]
 
     def __repr__(self):
+        # Components that are not loaded yet are not loaded for their representation
+        not_loaded = "not loaded yet"
         d = {"1. name": self.name,
              "2. connectivity": self.connectivity,
-             "5. surface": self.cortical_surface,
-             "3. RM": reg_dict(self.region_mapping, self.connectivity.region_labels),
-             "4. VM": reg_dict(self.volume_mapping, self.connectivity.region_labels),
-             "6. T1": self.t1_background,
-             "7. SEEG": self.sensorsSEEG,
-             "8. EEG": self.sensorsEEG,
-             "9. MEG": self.sensorsMEG }
+             "5. surface": self.cortical_surface if self.is_loaded("cortical_surface") else not_loaded,
+             "3. RM": reg_dict(self.region_mapping, self.connectivity.region_labels)
+                      if self.is_loaded("region_mapping") else not_loaded,
+             "4. VM": reg_dict(self.volume_mapping, self.connectivity.region_labels)
+                      if self.is_loaded("volume_mapping") else not_loaded,
+             "6. T1": self.t1_background if self.is_loaded("t1_background") else not_loaded,
+             "7. SEEG": self.sensorsSEEG if self.is_loaded("sensorsSEEG") else not_loaded,
+             "8. EEG": self.sensorsEEG if self.is_loaded("sensorsEEG") else not_loaded,
+             "9. MEG": self.sensorsMEG if self.is_loaded("sensorsMEG") else not_loaded}
         return formal_repr(self, sort_dict(d))
 
     def __str__(self):
@@ -91,6 +156,12 @@ class Connectivity(object):
     hemispheres = None
     orientations = None
     areas = None
+    # The folder of the memory mapped files of the arrays, when they are shared among processes
+    shared_folder = None
+
+    # The arrays that can be shared among processes via memory mapped files
+    SHARED_ARRAYS = ["weights", "normalized_weights", "tract_lengths", "centers", "hemispheres", "orientations",
+                     "areas"]
 
     def __init__(self, file_path, weights, tract_lengths, labels=np.array([]), centers=np.array([]),
                  hemispheres=np.array([]), orientation=np.array([]), areas=np.array([]),
@@ -132,6 +203,67 @@ class Connectivity(object):
     def __str__(self):
         return self.__repr__()
 
+    def _shared_path(self, name):
+        return os.path.join(self.shared_folder, name + ".npy")
+
+    def _is_shared(self, name, array):
+        # True if the array is the whole memory mapped file of the attribute
+        return isinstance(array, np.memmap) and array.filename is not None and \
+               os.path.abspath(array.filename) == os.path.abspath(self._shared_path(name)) and \
+               array.size * array.itemsize == os.path.getsize(array.filename) - array.offset
+
+    def share(self, folder=None):
+        """
+        Move the arrays to read-only memory mapped .npy files. Pickling (e.g., to the workers of a parallel pse)
+        or deep copying a shared Connectivity then passes only the files' paths, and each copy attaches to
+        the same files without copying the arrays, which the operating system keeps once in memory.
+        The shared arrays are read-only. Use unshare() to get writeable copies in memory again.
+        :param folder: the folder of the files, visible to all processes (default a new temporary folder)
+        :return: the folder of the files
+        """
+        if folder is None:
+            folder = tempfile.mkdtemp(prefix="connectivity_")
+        elif not (os.path.isdir(folder)):
+            os.makedirs(folder)
+        self.shared_folder = folder
+        for name in self.SHARED_ARRAYS:
+            array = np.asarray(getattr(self, name))
+            if array.size == 0 or array.dtype == np.dtype("O") or self._is_shared(name, array):
+                continue
+            np.save(self._shared_path(name), array)
+            setattr(self, name, np.load(self._shared_path(name), mmap_mode="r"))
+        return folder
+
+    def unshare(self, remove_files=False):
+        # Copy the shared arrays back to memory, and optionally remove their files
+        if self.shared_folder is None:
+            return
+        for name in self.SHARED_ARRAYS:
+            array = getattr(self, name)
+            if self._is_shared(name, array):
+                setattr(self, name, np.array(array))
+                if remove_files:
+                    os.remove(self._shared_path(name))
+        if remove_files and len(os.listdir(self.shared_folder)) == 0:
+            os.rmdir(self.shared_folder)
+        self.shared_folder = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self.shared_folder is not None:
+            for name in self.SHARED_ARRAYS:
+                if self._is_shared(name, state.get(name, None)):
+                    # The path instead of the data:
+                    state[name] = None
+                    state.setdefault("_shared_names", []).append(name)
+        return state
+
+    def __setstate__(self, state):
+        shared_names = state.pop("_shared_names", [])
+        self.__dict__.update(state)
+        for name in shared_names:
+            setattr(self, name, np.load(self._shared_path(name), mmap_mode="r"))
+
     def plot(self, show_flag=SHOW_FLAG, save_flag=SAVE_FLAG, figure_dir=FOLDER_FIGURES,
                       figure_format=FIG_FORMAT, figure_name='Connectivity ', figsize=LARGE_SIZE):
 
@@ -5,16 +5,19 @@ Various plotting tools will be placed here.
 
 import matplotlib as mp
 from matplotlib import pyplot, gridspec
+from matplotlib.collections import LineCollection, PolyCollection
 from mpl_toolkits.axes_grid1 import make_axes_locatable
 
 import numpy as np
 from scipy.stats.mstats import zscore
 
+from tvb.basic.logger.builder import get_logger
 from tvb_epilepsy.base.constants import *
-from tvb_epilepsy.base.utils import calculate_in_degree
+from tvb_epilepsy.base.utils import calculate_in_degree, curve_elbow_point
 from tvb_epilepsy.base.calculations_factory import calc_fx1, calc_fx1, calc_fz, calc_fz, calc_fx1_2d_taylor, calc_rescaled_x0, \
     calc_x0cr_r
 from tvb_epilepsy.base.equilibrium_computation import calc_eq_y1, def_x1lin
+from tvb_epilepsy.base.figure_queue import plot_or_submit
 from tvb_epilepsy.tvb_api.epileptor_models import *
 
 try:
@@ -26,6 +29,8 @@ try:
 except ImportError:
     pass
 
+LOG = get_logger(__name__)
+
 
 def _check_show(show_flag=SHOW_FLAG):
     if show_flag:
@@ -258,9 +263,122 @@ def _set_axis_labels(fig, sub, n_regions, region_labels, indices2emphasize, colo
     big_ax.set_axis_bgcolor('none')
 
 
+def envelope_bins(time, data, n_bins):
+    """
+    Min/max envelope of time series in n_bins consecutive bins of their time points
+    :param time: an array of (n_times, ) time points
+    :param data: an array of (n_times, n_signals) time series
+    :return: the times of the first points of the bins (n_bins, ),
+             and the minima and maxima of the bins (n_bins, n_signals)
+    """
+    data = np.asarray(data)
+    starts = (np.arange(int(n_bins)) * data.shape[0]) // int(n_bins)
+    return np.asarray(time)[starts], np.minimum.reduceat(data, starts, axis=0), \
+           np.maximum.reduceat(data, starts, axis=0)
+
+
+def decimate_envelope(time, data, n_bins):
+    """
+    Min/max envelope decimation of time series, e.g., to the width of a figure in pixels:
+    the time points are split in n_bins consecutive bins, and each bin is replaced by its minimum and maximum
+    (at the time of its first point), so that all extrema of the signals are still drawn.
+    :param time: an array of (n_times, ) time points
+    :param data: an array of (n_times, n_signals) time series
+    :param n_bins: the number of bins
+    :return: the decimated time (2 * n_bins, ) and data (2 * n_bins, n_signals), or the original ones,
+             if there are not more than 2 * n_bins time points
+    """
+    n_times = data.shape[0]
+    n_bins = int(n_bins)
+    if n_times <= 2 * n_bins:
+        return time, data
+    bins_time, lower, upper = envelope_bins(time, data, n_bins)
+    envelope = np.empty((n_bins, 2) + lower.shape[1:], dtype=lower.dtype)
+    envelope[:, 0] = lower
+    envelope[:, 1] = upper
+    return np.repeat(bins_time, 2), envelope.reshape((2 * n_bins, ) + lower.shape[1:])
+
+
+def _axes_width_pixels(ax):
+    return int(np.ceil(ax.get_window_extent().width))
+
+
+def _plot_lines(ax, time, data, indices, color, alpha, labels, offset=0.0, rasterized=False):
+    # All time series of the same color in a single LineCollection, except for when they have to be identified
+    # separately by mouse hoovering
+    if len(indices) == 0:
+        return []
+    if MOUSEHOOVER:
+        return [ax.plot(time, data[:, iTS] + offset * iTS, color, alpha=alpha, label=labels[iTS],
+                        rasterized=rasterized)[0] for iTS in indices]
+    segments = np.empty((len(indices), len(time), 2))
+    segments[:, :, 0] = time
+    segments[:, :, 1] = (data[:, indices] + offset * np.array(indices)).T
+    lines = LineCollection(segments, colors=color, alpha=alpha, rasterized=rasterized)
+    ax.add_collection(lines)
+    return [lines]
+
+
+def _plot_bands(ax, time, lower, upper, indices, color, alpha, offset=0.0, rasterized=False):
+    # The min/max envelopes of all time series of the same color as filled bands without edges
+    # in a single PolyCollection
+    if len(indices) == 0:
+        return []
+    n_bins = len(time)
+    offsets = offset * np.array(indices)
+    polygons = np.empty((len(indices), 2 * n_bins, 2))
+    polygons[:, :n_bins, 0] = time
+    polygons[:, n_bins:, 0] = time[::-1]
+    polygons[:, :n_bins, 1] = (upper[:, indices] + offsets).T
+    polygons[:, n_bins:, 1] = (lower[::-1][:, indices] + offsets).T
+    bands = PolyCollection(polygons, facecolors=color, edgecolors="none", alpha=alpha, rasterized=rasterized)
+    ax.add_collection(bands)
+    return [bands]
+
+
+def _plot_time_series(ax, time, data, special_idx, colors, alphas, labels, offset=0.0, decimate=True,
+                      rasterized=False):
+    """
+    Plot time series, with colors[1] and alphas[1] for the special_idx ones, and colors[0] and alphas[0] for the rest
+    :param decimate: if True, and there are more than two time points per pixel of the width of the axes,
+                     the min/max envelopes of the time series in bins of one pixel are drawn as filled bands,
+                     so that plotting time depends neither on the length nor on the fluctuations of the time series
+    """
+    nTS = data.shape[1]
+    if special_idx is None:
+        groups = [(range(nTS), colors[0], alphas[0])]
+    else:
+        groups = [(list(special_idx), colors[1], alphas[1]),
+                  (list(np.delete(np.array(range(nTS)), special_idx)), colors[0], alphas[0])]
+    n_bins = _axes_width_pixels(ax)
+    if decimate and data.shape[0] > 2 * n_bins:
+        if MOUSEHOOVER:
+            # Lines per time series, which can be identified separately
+            time, data = decimate_envelope(time, data, n_bins)
+        else:
+            bins_time, lower, upper = envelope_bins(time, data, n_bins)
+            # Bands are at least one pixel high, so that smooth time series (i.e., with lower ~ upper) remain visible:
+            offsets = offset * np.arange(nTS)
+            half_pixel = 0.5 * (np.max(upper + offsets) - np.min(lower + offsets)) / \
+                         max(ax.get_window_extent().height, 1.0)
+            middle = 0.5 * (upper + lower)
+            half_height = np.maximum(0.5 * (upper - lower), half_pixel)
+            lower = middle - half_height
+            upper = middle + half_height
+            return sum([_plot_bands(ax, bins_time, lower, upper, indices, color, alpha, offset, rasterized)
+                        for indices, color, alpha in groups], [])
+    return sum([_plot_lines(ax, time, data, indices, color, alpha, labels, offset, rasterized)
+                for indices, color, alpha in groups], [])
+
+
 def plot_timeseries(time, data_dict, special_idx=None, title='Time Series', show_flag=SHOW_FLAG,
                     save_flag=False, figure_dir=FOLDER_FIGURES, figure_format=FIG_FORMAT, figure_name='TimeSeries',
-                    labels=None,figsize=LARGE_SIZE):
+                    labels=None,figsize=LARGE_SIZE, decimate=True, rasterized=False):
+    """
+    :param decimate: if True, the min/max envelopes of the time series at the width of the axes in pixels are drawn,
+                     so that plotting time does not depend on the length of the time series, see _plot_time_series
+    :param rasterized: if True, the lines are rasterized in vector graphics output formats (e.g., pdf, svg)
+    """
 
     pyplot.figure(title, figsize=figsize)
     no_rows = len(data_dict)
@@ -274,20 +392,9 @@ def plot_timeseries(time, data_dict, special_idx=None, title='Time Series', show
         nTS = data.shape[1]
         if labels is None:
             labels = np.array(range(nTS)).astype(str)
-        lines.append([])
-        if special_idx is None:
-            for iTS in range(nTS):
-                line, = pyplot.plot(time, data[:, iTS], 'k', alpha=0.3, label = labels[iTS])
-                lines[i].append(line)
-        else:
-            mask = np.array(range(nTS))
-            mask = np.delete(mask,special_idx)
-            for iTS in special_idx:
-                line, = pyplot.plot(time, data[:, iTS], 'r', alpha=0.7, label = labels[iTS])
-                lines[i].append(line)
-            for iTS in mask:
-                line, = pyplot.plot(time, data[:, iTS], 'k', alpha=0.3, label = labels[iTS])
-                lines[i].append(line)
+        lines.append(_plot_time_series(ax, time, data, special_idx, ['k', 'r'], [0.3, 0.7], labels,
+                                       decimate=decimate, rasterized=rasterized))
+        ax.autoscale_view()
         pyplot.ylabel(subtitle)
         ax.set_autoscalex_on(False)
         ax.set_xlim([time[0], time[-1]])
@@ -309,7 +416,13 @@ def plot_timeseries(time, data_dict, special_idx=None, title='Time Series', show
 
 
 def plot_raster(time, data_dict, special_idx=None, title='Time Series', offset=3.0, show_flag=SHOW_FLAG,
-                    save_flag=False, figure_dir=FOLDER_FIGURES, figure_format=FIG_FORMAT, figure_name='TimeSeries',labels=None,figsize=LARGE_SIZE):
+                    save_flag=False, figure_dir=FOLDER_FIGURES, figure_format=FIG_FORMAT, figure_name='TimeSeries',labels=None,figsize=LARGE_SIZE,
+                    decimate=True, rasterized=False):
+    """
+    :param decimate: if True, the min/max envelopes of the time series at the width of the axes in pixels are drawn,
+                     so that plotting time does not depend on the length of the time series, see _plot_time_series
+    :param rasterized: if True, the lines are rasterized in vector graphics output formats (e.g., pdf, svg)
+    """
 
     pyplot.figure(title, figsize=figsize)
     no_rows = len(data_dict)
@@ -324,20 +437,9 @@ def plot_raster(time, data_dict, special_idx=None, title='Time Series', offset=3
         nTS = data.shape[1]
         if labels is None:
             labels = np.array(range(nTS)).astype(str)
-        lines.append([])
-        if special_idx is None:
-            for iTS in range(nTS):
-                line, = pyplot.plot(time, data[:,iTS]+offset*iTS, 'k', label = labels[iTS])
-                lines[i].append(line)
-        else:
-            mask = np.array(range(nTS))
-            mask = np.delete(mask,special_idx)
-            for iTS in special_idx:
-                line, = pyplot.plot(time, data[:, iTS]+offset*iTS, 'r', label = labels[iTS])
-                lines[i].append(line)
-            for iTS in mask:
-                line, = pyplot.plot(time, data[:, iTS]+offset*iTS, 'k', label = labels[iTS])
-                lines[i].append(line)
+        lines.append(_plot_time_series(ax, time, data, special_idx, ['k', 'r'], [1.0, 1.0], labels, offset=offset,
+                                       decimate=decimate, rasterized=rasterized))
+        ax.autoscale_view()
         pyplot.ylabel(subtitle)
         ax.set_autoscalex_on(False)
         ax.set_xlim([time[0], time[-1]])
@@ -428,54 +530,134 @@ def plot_trajectories(data_dict, special_idx=None, title='State space trajectori
     _check_show(show_flag)
 
 
-def plot_sim_results(model, seizure_indices, hyp_name, head, res, sensorsSEEG, hpf_flag=False):
+def select_curve_elbow_point(vals, elbow=None):
+    """
+    Interactive tool for the manual selection of the elbow point of a curve, which blocks until the user
+    either clicks on the elbow point, or presses ENTER to accept the automatic one
+    :param vals: an array of (n, ) values of a curve
+    :param elbow: the automatic elbow point (default None for computing it with curve_elbow_point)
+    :return: the index of the selected elbow point
+    """
+    vals = -np.sort(-np.array(vals, dtype="float64").flatten())
+    if elbow is None:
+        elbow = curve_elbow_point(vals)
+    cumsum_vals = np.cumsum(vals)
+
+    pyplot.ion()
+
+    fig, ax = pyplot.subplots()
+
+    xdata = range(len(vals))
+    lines=[]
+    lines.append(ax.plot(xdata, cumsum_vals, 'g*', picker=None, label="values' cumulative sum")[0])
+    lines.append(ax.plot(xdata, vals, 'bo', picker=None, label="values in descending order")[0])
+
+    lines.append(ax.plot(elbow, vals[elbow], "rd",
+                         label="suggested elbow point (maximum of third central difference)")[0])
+
+    lines.append(ax.plot(elbow, cumsum_vals[elbow], "rd")[0])
+
+    pyplot.legend(handles=lines[:2])
+
+    class MyClickableLines(object):
+
+        def __init__(self, fig, ax, lines):
+            self.x = None
+            #self.y = None
+            self.ax = ax
+            title = "Mouse lef-click please to select the elbow point..." + \
+                    "\n...or click ENTER to continue accepting our automatic choice in red..."
+            self.ax.set_title(title)
+            self.lines = lines
+            self.fig = fig
+
+        def event_loop(self):
+            self.fig.canvas.mpl_connect('button_press_event', self.onclick)
+            self.fig.canvas.mpl_connect('key_press_event', self.onkey)
+            self.fig.canvas.draw_idle()
+            self.fig.canvas.start_event_loop(timeout=-1)
+            return
+
+        def onkey(self, event):
+            if event.key == "enter":
+                self.fig.canvas.stop_event_loop()
+            return
+
+        def onclick(self, event):
+            if event.inaxes != self.lines[0].axes: return
+            dist = np.sqrt((self.lines[0].get_xdata() - event.xdata) ** 2.0)  # + (self.lines[0].get_ydata() - event.ydata) ** 2.)
+            self.x = np.argmin(dist)
+            self.fig.canvas.stop_event_loop()
+            return
+
+    click_point = MyClickableLines(fig, ax, lines)
+    click_point.event_loop()
+    pyplot.close(fig)
+
+    if click_point.x is not None:
+        LOG.info("\nmanual selection: " + str(click_point.x))
+        return click_point.x
+    else:
+        LOG.info("\nautomatic selection: " + str(elbow))
+        return elbow
+
+
+def plot_sim_results(model, seizure_indices, hyp_name, head, res, sensorsSEEG, hpf_flag=False, figure_queue=None):
+    """
+    :param figure_queue: a FigureQueue to render the figures in the background (default None for plotting here)
+    """
 
     if isinstance(model, EpileptorDP2D):
-        plot_timeseries(res['time'], {'x1': res['x1'], 'z(t)': res['z']},
-                        seizure_indices, title=hyp_name + ": Simulated TAVG",
-                        save_flag=SAVE_FLAG, show_flag=SHOW_FLAG, figure_dir=FOLDER_FIGURES,
-                        labels=head.connectivity.region_labels, figsize=VERY_LARGE_SIZE)
+        plot_or_submit(figure_queue, plot_timeseries, res['time'], {'x1': res['x1'], 'z(t)': res['z']},
+                       seizure_indices, title=hyp_name + ": Simulated TAVG",
+                       save_flag=SAVE_FLAG, show_flag=SHOW_FLAG, figure_dir=FOLDER_FIGURES,
+                       labels=head.connectivity.region_labels, figsize=VERY_LARGE_SIZE)
     else:
-        plot_timeseries(res['time'], {'LFP(t)': res['lfp'], 'z(t)': res['z']},
-                        seizure_indices, title=hyp_name + ": Simulated LFP-z",
-                        save_flag=SAVE_FLAG, show_flag=SHOW_FLAG, figure_dir=FOLDER_FIGURES,
-                        labels=head.connectivity.region_labels, figsize=VERY_LARGE_SIZE)
-        plot_timeseries(res['time'], {'x1(t)': res['x1'], 'y1(t)': res['y1']},
-                        seizure_indices, title=hyp_name + ": Simulated pop1",
-                        save_flag=SAVE_FLAG, show_flag=SHOW_FLAG, figure_dir=FOLDER_FIGURES,
-                        labels=head.connectivity.region_labels, figsize=VERY_LARGE_SIZE)
-        plot_timeseries(res['time'], {'x2(t)': res['x2'], 'y2(t)': res['y2'], 'g(t)': res['g']}, seizure_indices,
-                        title=hyp_name + ": Simulated pop2-g",
-                        save_flag=SAVE_FLAG, show_flag=SHOW_FLAG, figure_dir=FOLDER_FIGURES,
-                        labels=head.connectivity.region_labels, figsize=VERY_LARGE_SIZE)
+        plot_or_submit(figure_queue, plot_timeseries, res['time'], {'LFP(t)': res['lfp'], 'z(t)': res['z']},
+                       seizure_indices, title=hyp_name + ": Simulated LFP-z",
+                       save_flag=SAVE_FLAG, show_flag=SHOW_FLAG, figure_dir=FOLDER_FIGURES,
+                       labels=head.connectivity.region_labels, figsize=VERY_LARGE_SIZE)
+        plot_or_submit(figure_queue, plot_timeseries, res['time'], {'x1(t)': res['x1'], 'y1(t)': res['y1']},
+                       seizure_indices, title=hyp_name + ": Simulated pop1",
+                       save_flag=SAVE_FLAG, show_flag=SHOW_FLAG, figure_dir=FOLDER_FIGURES,
+                       labels=head.connectivity.region_labels, figsize=VERY_LARGE_SIZE)
+        plot_or_submit(figure_queue, plot_timeseries, res['time'],
+                       {'x2(t)': res['x2'], 'y2(t)': res['y2'], 'g(t)': res['g']}, seizure_indices,
+                       title=hyp_name + ": Simulated pop2-g",
+                       save_flag=SAVE_FLAG, show_flag=SHOW_FLAG, figure_dir=FOLDER_FIGURES,
+                       labels=head.connectivity.region_labels, figsize=VERY_LARGE_SIZE)
         start_plot = int(np.round(0.01 * res['lfp'].shape[0]))
-        plot_raster(res['time'][start_plot:], {'lfp': res['lfp'][start_plot:, :]}, seizure_indices,
-                    title=hyp_name + ": Simulated LFP rasterplot", offset=10.0,
-                    save_flag=SAVE_FLAG, show_flag=SHOW_FLAG, figure_dir=FOLDER_FIGURES,
-                    labels=head.connectivity.region_labels, figsize=VERY_LARGE_SIZE)
+        plot_or_submit(figure_queue, plot_raster, res['time'][start_plot:], {'lfp': res['lfp'][start_plot:, :]},
+                       seizure_indices, title=hyp_name + ": Simulated LFP rasterplot", offset=10.0,
+                       save_flag=SAVE_FLAG, show_flag=SHOW_FLAG, figure_dir=FOLDER_FIGURES,
+                       labels=head.connectivity.region_labels, figsize=VERY_LARGE_SIZE)
 
     if isinstance(model, EpileptorDPrealistic):
-        plot_timeseries(res['time'], {'1/(1+exp(-10(z-3.03))': 1 / (1 + np.exp(-10 * (res['z'] - 3.03))),
-                                      'slope': res['slopeTS'], 'Iext2': res['Iext2ts']},
-                        seizure_indices, title=hyp_name + ": Simulated controlled parameters",
-                        save_flag=SAVE_FLAG, show_flag=SHOW_FLAG, figure_dir=FOLDER_FIGURES,
-                        labels=head.connectivity.region_labels, figsize=VERY_LARGE_SIZE)
-        plot_timeseries(res['time'], {'x0': res['x0ts'], 'Iext1':  res['Iext1ts'] , 'K': res['Kts']},
-                        seizure_indices, title=hyp_name + ": Simulated parameters",
-                        save_flag=SAVE_FLAG, show_flag=SHOW_FLAG, figure_dir=FOLDER_FIGURES,
-                        labels=head.connectivity.region_labels, figsize=VERY_LARGE_SIZE)
+        plot_or_submit(figure_queue, plot_timeseries, res['time'],
+                       {'1/(1+exp(-10(z-3.03))': 1 / (1 + np.exp(-10 * (res['z'] - 3.03))),
+                        'slope': res['slopeTS'], 'Iext2': res['Iext2ts']},
+                       seizure_indices, title=hyp_name + ": Simulated controlled parameters",
+                       save_flag=SAVE_FLAG, show_flag=SHOW_FLAG, figure_dir=FOLDER_FIGURES,
+                       labels=head.connectivity.region_labels, figsize=VERY_LARGE_SIZE)
+        plot_or_submit(figure_queue, plot_timeseries, res['time'],
+                       {'x0': res['x0ts'], 'Iext1':  res['Iext1ts'] , 'K': res['Kts']},
+                       seizure_indices, title=hyp_name + ": Simulated parameters",
+                       save_flag=SAVE_FLAG, show_flag=SHOW_FLAG, figure_dir=FOLDER_FIGURES,
+                       labels=head.connectivity.region_labels, figsize=VERY_LARGE_SIZE)
 
     for i in range(len(sensorsSEEG)):
         start_plot = int(np.round(0.01*res['seeg'+str(i)].shape[0]))
-        plot_raster(res['time'][start_plot:], {'SEEG': res['seeg'+str(i)][start_plot:, :]},
-                    title=hyp_name + ": Simulated SEEG" + str(i) + " raster plot",
-                    offset=10.0, save_flag=SAVE_FLAG, show_flag=SHOW_FLAG, figure_dir=FOLDER_FIGURES,
-                    labels=sensorsSEEG[i].labels, figsize=VERY_LARGE_SIZE)
+        plot_or_submit(figure_queue, plot_raster, res['time'][start_plot:],
+                       {'SEEG': res['seeg'+str(i)][start_plot:, :]},
+                       title=hyp_name + ": Simulated SEEG" + str(i) + " raster plot",
+                       offset=10.0, save_flag=SAVE_FLAG, show_flag=SHOW_FLAG, figure_dir=FOLDER_FIGURES,
+                       labels=sensorsSEEG[i].labels, figsize=VERY_LARGE_SIZE)
         if hpf_flag:
-            plot_raster(res['time'][start_plot:], {'SEEG hpf': res['seeg_hpf' + str(i)][start_plot:, :]},
-                        title=hyp_name + ": Simulated high pass filtered SEEG" + str(i) + " raster plot",
-                        offset=10.0, save_flag=SAVE_FLAG, show_flag=SHOW_FLAG, figure_dir=FOLDER_FIGURES,
-                        labels=sensorsSEEG[i].labels, figsize=VERY_LARGE_SIZE)
+            plot_or_submit(figure_queue, plot_raster, res['time'][start_plot:],
+                           {'SEEG hpf': res['seeg_hpf' + str(i)][start_plot:, :]},
+                           title=hyp_name + ": Simulated high pass filtered SEEG" + str(i) + " raster plot",
+                           offset=10.0, save_flag=SAVE_FLAG, show_flag=SHOW_FLAG, figure_dir=FOLDER_FIGURES,
+                           labels=sensorsSEEG[i].labels, figsize=VERY_LARGE_SIZE)
 
 
 # def plot_head(head, show_flag=SHOW_FLAG, save_flag=SAVE_FLAG, figure_dir=FOLDER_FIGURES, figure_format=FIG_FORMAT,
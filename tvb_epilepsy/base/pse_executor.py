@@ -0,0 +1,339 @@
+"""
+Executors of parameter search explorations (pse), which distribute the loops of a PSEService to workers.
+FileSystemPSEExecutor uses a job queue in a (shared) folder:
+the executor writes chunks of pse_params rows as job files, workers on any node that sees the folder claim jobs by
+atomically renaming them, run them, and write back their results, which the executor gathers in the original order.
+Workers are started either locally by the executor, or on other nodes by:
+    python -m tvb_epilepsy.base.pse_executor <folder>
+"""
+import os
+import sys
+import time
+import socket
+import pickle
+import threading
+import multiprocessing
+from copy import copy
+
+import numpy as np
+
+from tvb.basic.logger.builder import get_logger
+from tvb_epilepsy.base.utils import formal_repr
+from tvb_epilepsy.base.pse_policy import PSEPolicy, PSEAbortError, LOOP_SUCCESS, LOOP_ABORTED, status_summary
+
+LOG = get_logger(__name__)
+
+PSE_FILE = "pse.pkl"
+STOP_FILE = "STOP"
+PENDING_FOLDER = "pending"
+RUNNING_FOLDER = "running"
+RESULTS_FOLDER = "results"
+
+
+def _dump(obj, path):
+    # Write to a temporary file first, so that readers never find a partially written file
+    temp_path = path + "." + socket.gethostname() + "_" + str(os.getpid()) + ".tmp"
+    with open(temp_path, "wb") as f:
+        pickle.dump(obj, f, pickle.HIGHEST_PROTOCOL)
+    os.rename(temp_path, path)
+
+
+def _load(path):
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def _job_name(loops_offset):
+    return "job_%010d.pkl" % loops_offset
+
+
+class PSEExecutor(object):
+
+    def run(self, pse, **kwargs):
+        """
+        Run all loops of a pse
+        :param pse: a PSEService instance
+        :param kwargs: keyword arguments of PSEService.run_pse, e.g., random_streams, policy, pse_results,
+                       and those of run_fun
+        :return: the results (or the PSEResults store, if given) and execution status of all loops,
+                 in the order of pse_params
+        """
+        raise NotImplementedError
+
+
+class SerialPSEExecutor(PSEExecutor):
+
+    def __repr__(self):
+        return formal_repr(self, {})
+
+    def __str__(self):
+        return self.__repr__()
+
+    def run(self, pse, **kwargs):
+        return pse.run_pse(grid_mode=False, **kwargs)
+
+
+class _Heartbeat(threading.Thread):
+    # Touch a running job's file periodically, so that the executor knows that its worker is still alive
+
+    def __init__(self, path, interval):
+        super(_Heartbeat, self).__init__()
+        self.daemon = True
+        self.path = path
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                os.utime(self.path, None)
+            except OSError:
+                # The job has been requeued by the executor
+                return
+
+
+def _claim_job(folder, worker_id):
+    for job in sorted(os.listdir(os.path.join(folder, PENDING_FOLDER))):
+        if not job.endswith(".pkl"):
+            continue
+        running_path = os.path.join(folder, RUNNING_FOLDER, job + "." + worker_id)
+        try:
+            os.rename(os.path.join(folder, PENDING_FOLDER, job), running_path)
+            # Renaming keeps the time the job was submitted, which would make a job pending for longer than
+            # the executor's stale_job_time look stale, before the first touch of the heartbeat:
+            os.utime(running_path, None)
+        except OSError:
+            # Another worker claimed it first
+            continue
+        return job, running_path
+    return None, None
+
+
+def run_worker(folder, poll_interval=1.0, heartbeat_interval=10.0, max_idle_time=None):
+    """
+    Claim and run jobs of the pse of a job queue folder, until the executor stops the queue
+    :param folder: the job queue folder
+    :param poll_interval: the time in seconds to wait for new jobs when there are none pending
+    :param heartbeat_interval: the time in seconds between touches of the file of the running job
+    :param max_idle_time: the time in seconds after which an idle worker quits (default None for never)
+    :return: the number of jobs run
+    """
+    worker_id = socket.gethostname() + "_" + str(os.getpid())
+    pse = None
+    kwargs = {}
+    n_jobs = 0
+    idle_since = time.time()
+    while not os.path.isfile(os.path.join(folder, STOP_FILE)):
+        if pse is None:
+            if not (os.path.isfile(os.path.join(folder, PSE_FILE))):
+                time.sleep(poll_interval)
+                continue
+            pse, kwargs = _load(os.path.join(folder, PSE_FILE))
+        job, running_path = _claim_job(folder, worker_id)
+        if job is None:
+            if max_idle_time is not None and time.time() - idle_since > max_idle_time:
+                break
+            time.sleep(poll_interval)
+            continue
+        heartbeat = _Heartbeat(running_path, heartbeat_interval)
+        heartbeat.start()
+        try:
+            job_data = _load(running_path)
+            pse.pse_params = job_data["params"]
+            pse.n_loops = pse.pse_params.shape[0]
+            try:
+                results, execution_status = pse.run_pse(grid_mode=False, loops_offset=job_data["loops_offset"],
+                                                        **kwargs)
+            except PSEAbortError, e:
+                # The executor decides whether the whole pse has to be aborted
+                results = e.results
+                execution_status = e.execution_status
+            _dump({"results": results, "execution_status": execution_status,
+                   "status_codes": pse.status_codes, "status_messages": pse.status_messages, "worker": worker_id},
+                  os.path.join(folder, RESULTS_FOLDER, job))
+        finally:
+            heartbeat.stopped.set()
+        try:
+            os.remove(running_path)
+        except OSError:
+            pass
+        n_jobs += 1
+        idle_since = time.time()
+    return n_jobs
+
+
+class FileSystemPSEExecutor(PSEExecutor):
+
+    def __init__(self, folder, chunk_size=10, n_local_workers=0, poll_interval=1.0, heartbeat_interval=10.0,
+                 stale_job_time=60.0, timeout=None):
+        """
+        :param folder: the job queue folder, which has to be shared by all nodes running workers
+        :param chunk_size: the number of loops of each job
+        :param n_local_workers: the number of worker processes started on this machine by the executor
+        :param poll_interval: the time in seconds between checks of the queue
+        :param heartbeat_interval: the time in seconds between touches of the files of running jobs by their workers
+        :param stale_job_time: the time in seconds after the last touch, after which a running job is
+                               considered abandoned by a dead worker and is requeued
+        :param timeout: the maximum time in seconds to wait for all results (default None for no limit)
+        """
+        self.folder = folder
+        self.chunk_size = chunk_size
+        self.n_local_workers = n_local_workers
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.stale_job_time = stale_job_time
+        self.timeout = timeout
+
+    def __repr__(self):
+        d = {"01. Job queue folder": self.folder,
+             "02. Number of loops per job": self.chunk_size,
+             "03. Number of local workers": self.n_local_workers,
+             "04. Poll interval (sec)": self.poll_interval,
+             "05. Heartbeat interval (sec)": self.heartbeat_interval,
+             "06. Stale job time (sec)": self.stale_job_time,
+             "07. Timeout (sec)": self.timeout}
+        return formal_repr(self, d)
+
+    def __str__(self):
+        return self.__repr__()
+
+    def _prepare_folder(self):
+        for sub_folder in [PENDING_FOLDER, RUNNING_FOLDER, RESULTS_FOLDER]:
+            path = os.path.join(self.folder, sub_folder)
+            if not (os.path.isdir(path)):
+                os.makedirs(path)
+            elif len(os.listdir(path)) > 0:
+                raise ValueError("\nJob queue folder " + path + " is not empty!")
+        if os.path.isfile(os.path.join(self.folder, STOP_FILE)):
+            os.remove(os.path.join(self.folder, STOP_FILE))
+
+    def _requeue_stale_jobs(self):
+        running_folder = os.path.join(self.folder, RUNNING_FOLDER)
+        for running_job in os.listdir(running_folder):
+            path = os.path.join(running_folder, running_job)
+            try:
+                if time.time() - os.path.getmtime(path) > self.stale_job_time:
+                    job = running_job.split(".pkl")[0] + ".pkl"
+                    LOG.warning("Requeuing job " + job + " of unresponsive worker " + running_job.split(".pkl.")[-1])
+                    os.rename(path, os.path.join(self.folder, PENDING_FOLDER, job))
+            except OSError:
+                # The job has just been finished
+                pass
+
+    def run(self, pse, **kwargs):
+        self._prepare_folder()
+        # A PSEResults store stays with the executor, which fills it as the results of jobs arrive:
+        pse_results = kwargs.pop("pse_results", None)
+        policy = kwargs.get("policy", None)
+        if policy is None:
+            policy = PSEPolicy()
+        pse_params = pse.pse_params
+        n_loops = pse_params.shape[0]
+        # The failure ratio is checked by the executor on the merged status of all loops, and not per job,
+        # so workers run with a policy that never aborts:
+        worker_policy = copy(policy)
+        worker_policy.max_failure_ratio = None
+        kwargs["policy"] = worker_policy
+        # The pse is sent to workers without its samples, which are sent by jobs:
+        pse.pse_params = pse_params[:0]
+        try:
+            _dump((pse, kwargs), os.path.join(self.folder, PSE_FILE))
+        finally:
+            pse.pse_params = pse_params
+        jobs = []
+        jobs_offsets = {}
+        for loops_offset in range(0, n_loops, self.chunk_size):
+            jobs.append(_job_name(loops_offset))
+            jobs_offsets[jobs[-1]] = loops_offset
+            _dump({"loops_offset": loops_offset, "params": pse_params[loops_offset:loops_offset + self.chunk_size]},
+                  os.path.join(self.folder, PENDING_FOLDER, jobs[-1]))
+        LOG.info("Submitted " + str(n_loops) + " loops as " + str(len(jobs)) + " jobs to " + self.folder)
+
+        workers = []
+        for iw in range(self.n_local_workers):
+            workers.append(multiprocessing.Process(target=run_worker, args=(self.folder, self.poll_interval,
+                                                                          self.heartbeat_interval)))
+            workers[-1].start()
+
+        job_results = {}
+        start_time = time.time()
+        try:
+            while len(job_results) < len(jobs):
+                for job in jobs:
+                    if job not in job_results and os.path.isfile(os.path.join(self.folder, RESULTS_FOLDER, job)):
+                        job_results[job] = _load(os.path.join(self.folder, RESULTS_FOLDER, job))
+                        if pse_results is not None:
+                            pse_results.set_loops(job_results[job]["results"], jobs_offsets[job])
+                            job_results[job]["results"] = []
+                # Global abort threshold, on the status of all loops finished so far:
+                status_codes = np.concatenate([np.array(job_results[job]["status_codes"], dtype="i")
+                                               for job in jobs if job in job_results] + [np.array([], dtype="i")])
+                if policy.abort(status_codes):
+                    results, execution_status = self._merge(pse, pse_params, jobs, jobs_offsets, job_results,
+                                                            pse_results)
+                    raise PSEAbortError("\nPSE aborted after " + str(status_codes.size) +
+                                        " loops, with loop status counts " + str(dict(status_summary(status_codes))) +
+                                        " exceeding the maximum failure ratio " + str(policy.max_failure_ratio) +
+                                        "!", results, execution_status, pse.status_codes, pse.status_messages)
+                if len(job_results) < len(jobs):
+                    if self.timeout is not None and time.time() - start_time > self.timeout:
+                        raise RuntimeError("\nTimeout while waiting for the results of " +
+                                           str(len(jobs) - len(job_results)) + " jobs in " + self.folder + "!")
+                    if len(workers) > 0 and not np.any([worker.is_alive() for worker in workers]):
+                        LOG.warning("All local workers have exited. Waiting for workers on other nodes...")
+                        workers = []
+                    self._requeue_stale_jobs()
+                    time.sleep(self.poll_interval)
+        except:
+            # Stop the local workers at once, without waiting for their running jobs:
+            for worker in workers:
+                worker.terminate()
+            raise
+        finally:
+            # Tell all workers to quit:
+            open(os.path.join(self.folder, STOP_FILE), "w").close()
+            for worker in workers:
+                worker.join()
+
+        results, execution_status = self._merge(pse, pse_params, jobs, jobs_offsets, job_results, pse_results)
+        if np.any(pse.status_codes != LOOP_SUCCESS):
+            LOG.warning("Not all loops succeeded! Loop status counts: " + str(dict(status_summary(pse.status_codes))))
+        return results, execution_status
+
+    def _merge(self, pse, pse_params, jobs, jobs_offsets, job_results, pse_results=None):
+        # Merge the results and status of all jobs in the order of pse_params,
+        # with the loops of the jobs without results marked as aborted
+        results = []
+        execution_status = []
+        status_codes = []
+        status_messages = []
+        for job in jobs:
+            if job in job_results:
+                results += list(job_results[job]["results"])
+                execution_status += list(job_results[job]["execution_status"])
+                status_codes += list(job_results[job]["status_codes"])
+                status_messages += list(job_results[job]["status_messages"])
+            else:
+                n_job_loops = pse_params[jobs_offsets[job]:jobs_offsets[job] + self.chunk_size].shape[0]
+                if pse_results is None:
+                    results += n_job_loops * [None]
+                execution_status += n_job_loops * [False]
+                status_codes += n_job_loops * [LOOP_ABORTED]
+                status_messages += n_job_loops * ["Aborted"]
+        if pse_results is not None:
+            results = pse_results
+        pse.pse_params = pse_params
+        pse.n_loops = pse_params.shape[0]
+        pse.status_codes = np.array(status_codes, dtype="i")
+        pse.status_messages = status_messages
+        return results, execution_status
+
+
+if __name__ == "__main__":
+
+    # Run a worker for the job queue folder given as the first argument, and optionally a poll interval in seconds
+    if len(sys.argv) < 2:
+        print "Usage: python -m tvb_epilepsy.base.pse_executor <job queue folder> [poll interval (sec)]"
+        sys.exit(1)
+    n_jobs = run_worker(sys.argv[1], *[float(arg) for arg in sys.argv[2:3]])
+    print "Worker " + socket.gethostname() + "_" + str(os.getpid()) + " ran " + str(n_jobs) + " jobs."
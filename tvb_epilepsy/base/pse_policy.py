@@ -0,0 +1,168 @@
+"""
+Early termination and failure handling policy of the loops of a parameter search exploration (pse):
+pre-checks that reject samples without running them, per loop timeouts, checks of the loops' outputs,
+structured status codes of all loops, and a global abort threshold for the failure ratio of a pse.
+"""
+import signal
+import warnings
+from collections import OrderedDict
+
+import numpy as np
+
+from tvb_epilepsy.base.constants import X1_EQ_CR_DEF, X0_CR_DEF
+from tvb_epilepsy.base.utils import formal_repr
+
+# Status codes of pse loops:
+LOOP_SUCCESS = 0
+# the run function returned a False status
+LOOP_FAILED = 1
+# the run function raised an exception
+LOOP_ERROR = 2
+# the output contains non finite values
+LOOP_INVALID_OUTPUT = 3
+# a pre-check rejected the sample, which was not run
+LOOP_REJECTED = 4
+# the run function did not return within the timeout
+LOOP_TIMEOUT = 5
+# the loop was not run, because the pse was aborted
+LOOP_ABORTED = 6
+
+LOOP_STATUS_NAMES = OrderedDict([(LOOP_SUCCESS, "success"), (LOOP_FAILED, "failed"), (LOOP_ERROR, "error"),
+                                 (LOOP_INVALID_OUTPUT, "invalid output"), (LOOP_REJECTED, "rejected"),
+                                 (LOOP_TIMEOUT, "timeout"), (LOOP_ABORTED, "aborted")])
+
+
+class PSELoopTimeout(Exception):
+    pass
+
+
+class PSEAbortError(RuntimeError):
+
+    def __init__(self, message, results, execution_status, status_codes, status_messages):
+        super(PSEAbortError, self).__init__(message)
+        # The partial results, so that they can still be inspected
+        self.results = results
+        self.execution_status = execution_status
+        self.status_codes = status_codes
+        self.status_messages = status_messages
+
+
+def _raise_timeout(signum, frame):
+    raise PSELoopTimeout()
+
+
+def lsa_pre_check(params_paths, params_values, params_indices, x1EQcr=X1_EQ_CR_DEF):
+    """
+    Reject samples of LSA pse that are invalid, or that push the equilibrium of a region beyond the critical one
+    :return: None if the sample is accepted, or a message explaining its rejection
+    """
+    for path, values, indices in zip(params_paths, params_values, params_indices):
+        values = np.array(values, dtype="float64")
+        if not (np.all(np.isfinite(values))):
+            return "Non finite values of " + str(path) + str(indices)
+        name = path.rsplit(".", 1)[-1]
+        if name == "e_values" and np.any(values > 3.0 * x1EQcr + 5.0):
+            # x1EQ = (e_values - 5.0) / 3.0 > x1EQcr
+            return "Supercritical epileptogenicity " + str(path) + str(indices) + " = " + str(values)
+        elif name == "x0_values" and np.any(values >= X0_CR_DEF):
+            # Supercritical excitability, even without any coupling
+            return "Supercritical excitability " + str(path) + str(indices) + " = " + str(values)
+        elif name in ["K_unscaled", "w_values"] and np.any(values < 0.0):
+            return "Negative coupling " + str(path) + str(indices) + " = " + str(values)
+    return None
+
+
+def finite_output(output):
+    # True if all numeric values of an output (dictionary) are finite
+    if isinstance(output, dict):
+        return np.all([finite_output(value) for value in output.values()])
+    elif isinstance(output, (np.ndarray, float, int, long)) and np.issubdtype(np.array(output).dtype, np.number):
+        return np.all(np.isfinite(output))
+    return True
+
+
+class PSEPolicy(object):
+
+    def __init__(self, timeout=None, pre_checks=[], check_outputs=False, max_failure_ratio=None, min_loops=10):
+        """
+        :param timeout: the maximum duration of a loop in seconds (default None for no timeout).
+                        Timeouts rely on SIGALRM, and are therefore only available on unix, in the main thread.
+        :param pre_checks: a list of functions of (params_paths, params_values, params_indices),
+                           returning None for accepted samples, or a message for rejected ones, e.g., lsa_pre_check
+        :param check_outputs: if True, outputs with non finite values count as failures
+        :param max_failure_ratio: the pse is aborted when the ratio of unsuccessful loops exceeds it
+                                  (default None for never aborting)
+        :param min_loops: the minimum number of loops run before the failure ratio is checked
+        """
+        self.timeout = timeout
+        self.pre_checks = pre_checks
+        self.check_outputs = check_outputs
+        self.max_failure_ratio = max_failure_ratio
+        self.min_loops = min_loops
+
+    def __repr__(self):
+        d = {"01. Loop timeout (sec)": self.timeout,
+             "02. Pre-checks": [getattr(check, "__name__", str(check)) for check in self.pre_checks],
+             "03. Check outputs": self.check_outputs,
+             "04. Maximum failure ratio": self.max_failure_ratio,
+             "05. Minimum number of loops before aborting": self.min_loops}
+        return formal_repr(self, d)
+
+    def __str__(self):
+        return self.__repr__()
+
+    def pre_check(self, params_paths, params_values, params_indices):
+        for check in self.pre_checks:
+            message = check(params_paths, params_values, params_indices)
+            if message is not None:
+                return LOOP_REJECTED, message
+        return LOOP_SUCCESS, ""
+
+    def call(self, fun, *args, **kwargs):
+        if self.timeout is None:
+            return fun(*args, **kwargs)
+        try:
+            previous_handler = signal.signal(signal.SIGALRM, _raise_timeout)
+        except (AttributeError, ValueError):
+            warnings.warn("\nLoop timeouts are not available on this platform or thread! Running without timeout.")
+            return fun(*args, **kwargs)
+        signal.setitimer(signal.ITIMER_REAL, self.timeout)
+        try:
+            return fun(*args, **kwargs)
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous_handler)
+
+    def run_loop(self, run_fun, pse_object, params_paths, params_values, params_indices, out_fun, **kwargs):
+        """
+        Run a loop of a pse under this policy
+        :return: the status code, a message and the output (None if unsuccessful) of the loop
+        """
+        code, message = self.pre_check(params_paths, params_values, params_indices)
+        if code != LOOP_SUCCESS:
+            return code, message, None
+        try:
+            status, output = self.call(run_fun, pse_object, params_paths, params_values, params_indices, out_fun,
+                                       **kwargs)
+        except PSELoopTimeout:
+            return LOOP_TIMEOUT, "Timed out after " + str(self.timeout) + " sec", None
+        except Exception, e:
+            return LOOP_ERROR, e.__class__.__name__ + ": " + str(e), None
+        if not status:
+            return LOOP_FAILED, "Run function returned a failure status", None
+        if self.check_outputs and not (finite_output(output)):
+            return LOOP_INVALID_OUTPUT, "Non finite output values", None
+        return LOOP_SUCCESS, "", output
+
+    def abort(self, status_codes):
+        # True if the ratio of unsuccessful loops exceeds the threshold
+        if self.max_failure_ratio is None or len(status_codes) < self.min_loops:
+            return False
+        return np.mean(np.array(status_codes) != LOOP_SUCCESS) > self.max_failure_ratio
+
+
+def status_summary(status_codes):
+    # A dictionary of the number of loops per status name
+    status_codes = np.array(status_codes)
+    return OrderedDict([(name, int(np.sum(status_codes == code))) for code, name in LOOP_STATUS_NAMES.iteritems()
+                        if np.any(status_codes == code)])
@@ -0,0 +1,183 @@
+"""
+Structure-of-arrays store of the outputs of the loops of a parameter search exploration (pse).
+Instead of a list of per loop output dictionaries, one array of shape (n_loops, ) + output shape is preallocated
+per output key (e.g., propagation_strengths, x0_values, x1EQ, zEQ, Ceq) at the first successful loop,
+and filled in place by the loops. The arrays can be kept in memory, or backed by memory mapped .npy files,
+or by the datasets of an h5 file, so that large sweeps do not have to fit in memory.
+Loops that do not succeed keep nan values.
+"""
+import os
+from collections import OrderedDict
+
+import numpy as np
+import h5py
+
+from tvb_epilepsy.base.utils import formal_repr
+from tvb_epilepsy.base.h5_model import convert_to_h5_model
+
+STORAGES = ["memory", "memmap", "h5"]
+
+# The key of outputs that are not dictionaries
+OUTPUT_KEY = "output"
+
+
+class PSEResults(object):
+
+    def __init__(self, n_loops, storage="memory", path=None):
+        """
+        :param n_loops: the number of loops of the pse
+        :param storage: "memory", "memmap" for one .npy file per output key in the folder path,
+                        or "h5" for one dataset per output key in the h5 file path
+        :param path: the folder (for "memmap") or file (for "h5") of the storage
+        """
+        if storage not in STORAGES:
+            raise ValueError("\nPSE results' storage " + str(storage) + " is not one of " + str(STORAGES) + "!")
+        if storage != "memory" and path is None:
+            raise ValueError("\nA path is required for the " + storage + " storage of PSE results!")
+        self.n_loops = n_loops
+        self.storage = storage
+        self.path = path
+        self.execution_status = np.zeros((n_loops, ), dtype="bool")
+        self.arrays = OrderedDict()
+        self._h5_file = None
+        if storage == "memmap" and not (os.path.isdir(path)):
+            os.makedirs(path)
+        elif storage == "h5":
+            self._h5_file = h5py.File(path, "w", libver="latest")
+
+    def __repr__(self):
+        d = {"01. Number of loops": self.n_loops,
+             "02. Storage": self.storage,
+             "03. Path": self.path,
+             "04. Number of successful loops": int(np.sum(self.execution_status)),
+             "05. Output shapes": OrderedDict([(key, array.shape) for key, array in self.arrays.iteritems()])}
+        return formal_repr(self, d)
+
+    def __str__(self):
+        return self.__repr__()
+
+    def __getitem__(self, key):
+        return self.arrays[key]
+
+    def __contains__(self, key):
+        return key in self.arrays
+
+    def __iter__(self):
+        return iter(self.arrays)
+
+    def __len__(self):
+        return len(self.arrays)
+
+    def keys(self):
+        return self.arrays.keys()
+
+    def iteritems(self):
+        return self.arrays.iteritems()
+
+    def _allocate(self, key, value):
+        shape = (self.n_loops, ) + value.shape
+        if np.issubdtype(value.dtype, np.number) or value.dtype == np.bool_:
+            # Integer and boolean outputs are stored as floats, so that unsuccessful loops can be nan:
+            dtype = np.result_type(value.dtype, np.float32)
+        elif self.storage == "memory":
+            dtype = np.dtype("O")
+        else:
+            raise ValueError("\nOutput " + key + " of dtype " + str(value.dtype) + " cannot be stored in " +
+                             self.storage + " storage!")
+        if self.storage == "memmap":
+            array = np.lib.format.open_memmap(os.path.join(self.path, key + ".npy"), mode="w+", dtype=dtype,
+                                              shape=shape)
+            array[:] = np.nan
+        elif self.storage == "h5":
+            # Chunks of whole loops, so that writing a loop touches a single chunk:
+            array = self._h5_file.create_dataset(key, shape=shape, dtype=dtype, fillvalue=np.nan,
+                                                 chunks=(1, ) + value.shape if value.ndim > 0 else None)
+        elif dtype == np.dtype("O"):
+            array = np.empty(shape, dtype=dtype)
+        else:
+            array = np.full(shape, np.nan, dtype=dtype)
+        self.arrays[key] = array
+        return array
+
+    def set_loop(self, iloop, output):
+        """
+        Write the output of a loop in place
+        :param iloop: the index of the loop
+        :param output: the output of the loop, i.e., a dictionary of values per key, or a single value,
+                       or None for unsuccessful loops
+        """
+        if output is None:
+            self.execution_status[iloop] = False
+            return
+        if not (isinstance(output, dict)):
+            output = {OUTPUT_KEY: output}
+        for key, value in output.iteritems():
+            value = np.asarray(value)
+            array = self.arrays.get(key, None)
+            if array is None:
+                array = self._allocate(key, value)
+            elif value.shape != array.shape[1:]:
+                raise ValueError("\nOutput " + key + " of loop " + str(iloop) + " has shape " + str(value.shape) +
+                                 " instead of " + str(array.shape[1:]) + "!")
+            array[iloop] = value
+        self.execution_status[iloop] = True
+
+    def set_loops(self, results, loops_offset=0):
+        # Write a list of per loop outputs, starting from loop loops_offset
+        for iloop, output in enumerate(results):
+            self.set_loop(loops_offset + iloop, output)
+
+    def to_dict(self, loops=None):
+        """
+        :param loops: the indices or boolean mask of the loops to select (default None for all loops)
+        :return: a dictionary of in memory arrays per output key
+        """
+        if loops is None:
+            loops = slice(None)
+        elif np.array(loops).dtype != np.bool_:
+            # h5 datasets require increasing indices:
+            loops = np.sort(loops)
+        return OrderedDict([(key, np.array(array[loops])) for key, array in self.arrays.iteritems()])
+
+    def sa_outputs(self, keys=None, names=None):
+        """
+        Outputs in the format of SensitivityAnalysisService
+        :param keys: the output keys (default all numeric ones)
+        :param names: the names of the outputs (default their keys)
+        :return: a list of {"names": [name], "values": array of (n_loops, ...)} dictionaries
+        """
+        if keys is None:
+            keys = [key for key, array in self.arrays.iteritems() if array.dtype != np.dtype("O")]
+        if names is None:
+            names = keys
+        outputs = []
+        for key, name in zip(keys, names):
+            values = self.arrays[key]
+            if self.storage == "h5":
+                values = values[:]
+            outputs.append({"names": [name], "values": values.reshape((self.n_loops, -1))})
+        return outputs
+
+    def flush(self):
+        if self.storage == "memmap":
+            for array in self.arrays.values():
+                array.flush()
+        elif self.storage == "h5":
+            self._h5_file.flush()
+
+    def close(self):
+        # Flush and release the storage. The arrays of memmap and h5 storage remain available in their files.
+        self.flush()
+        if self.storage == "h5":
+            self._h5_file.close()
+
+    def _prepare_for_h5(self):
+        d = self.to_dict()
+        d["execution_status"] = self.execution_status
+        h5_model = convert_to_h5_model(d)
+        h5_model.add_or_update_metadata_attribute("EPI_Type", "HypothesisModel")
+        return h5_model
+
+    def write_to_h5(self, folder, filename):
+        h5_model = self._prepare_for_h5()
+        h5_model.write_to_h5(folder, filename)
@@ -2,16 +2,26 @@
 Mechanism for parameter search exploration for LSA and simulations (it will have TVB or custom implementations)
 """
 
+import shutil
+import inspect
+import tempfile
 import subprocess
 import warnings
+import multiprocessing
 from collections import OrderedDict
 from copy import deepcopy
+from functools import partial
 
 import numpy as np
 
 from tvb.basic.logger.builder import get_logger
-from tvb_epilepsy.base.constants import EIGENVECTORS_NUMBER_SELECTION, K_DEF, YC_DEF, I_EXT1_DEF, A_DEF, B_DEF
+from tvb.simulator.noise import Noise
+from tvb_epilepsy.base.constants import EIGENVECTORS_NUMBER_SELECTION, K_DEF, YC_DEF, I_EXT1_DEF, A_DEF, B_DEF, \
+                                        X1_EQ_CR_DEF
 from tvb_epilepsy.base.utils import formal_repr
+from tvb_epilepsy.base.pse_policy import PSEPolicy, PSEAbortError, LOOP_SUCCESS, LOOP_ABORTED, LOOP_STATUS_NAMES, \
+                                         status_summary
+from tvb_epilepsy.base.pse_executor import FileSystemPSEExecutor
 from tvb_epilepsy.base.h5_model import convert_to_h5_model
 from tvb_epilepsy.base.simulators import ABCSimulator
 from tvb_epilepsy.base.disease_hypothesis import DiseaseHypothesis
@@ -27,65 +37,91 @@ from tvb_epilepsy.custom.read_write import read_ts
 LOG = get_logger(__name__)
 
 
-def set_object_attribute_recursively(object, path, values, indices):
+# The objects a pse parameter's path may start with. Paths starting otherwise refer to attributes of the simulator.
+PSE_OBJECT_TYPES = ["hypothesis", "model_configuration_service", "lsa_service", "model"]
+SIMULATOR_TYPE = "simulator"
 
-    # Convert the parameter's path to a list of strings separated by "."
-    path = path.split(".")
 
-    # If there is more than one levels...
-    if len(path) > 1:
-        #...call the function recursively
-        set_object_attribute_recursively(getattr(object, path[0]), ".".join(path[1:]), values, indices)
-
-    else:
-        # ...else, set the parameter values for the specified indices
-        temp = getattr(object, path[0])
-        if len(indices) > 0:
-            temp[indices] = values #index has to be linear... i.e., 1D...
+def accepts_argument(fun, name):
+    # True if fun (a function, method, functools.partial or callable object) has an argument called name.
+    # If its signature cannot be inspected, the argument is not given, i.e., the run function takes the slow path.
+    while isinstance(fun, partial):
+        fun = fun.func
+    if not (inspect.isfunction(fun) or inspect.ismethod(fun)) and hasattr(fun, "__call__"):
+        fun = fun.__call__
+    try:
+        return name in inspect.getargspec(fun).args
+    except TypeError:
+        return False
+
+
+def compile_setter_plans(params_paths, params_indices):
+    """
+    Precompile the parameters' paths once per pse, instead of splitting and partitioning them at every loop
+    :param params_paths: the dotted paths of the parameters, starting with their object type, e.g.,
+                         "model_configuration_service.x0", or with a simulator's attribute, e.g., "integrator.dt"
+    :param params_indices: the (linear) indices of the parameters' target arrays, or empty ones to set whole attributes
+    :return: a dictionary of setter plans per object type. A plan is a list of (attributes, indices, columns) setters:
+             the attribute names leading to the target, the indices of the target array (None to set the attribute),
+             and the columns of the parameters' values to assign to them.
+             Consecutive parameters of the same target array are merged into a single scatter,
+             e.g., the jitter of all healthy regions' x0 values.
+    """
+    plans = {}
+    scatters = {}
+    for ip, (path, indices) in enumerate(zip(params_paths, params_indices)):
+        path = path.split(".")
+        if path[0] in PSE_OBJECT_TYPES:
+            object_type = path[0]
+            attributes = tuple(path[1:])
         else:
-            temp = values
-        setattr(object, path[0], temp)
-
-
-def pop_object_parameters(object_type, params_paths, params_values, params_indices):
-
-    object_params_paths = []
-    object_params_values = []
-    object_params_indices = []
-    items_to_delete = []
-    for ip in range(len(params_paths)):
-        if params_paths[ip].split(".")[0] == object_type:
-            object_params_paths.append(params_paths[ip].split(".")[1])
-            object_params_values.append(params_values[ip])
-            object_params_indices.append(params_indices[ip])
-            items_to_delete.append(ip)
-
-    params_paths = np.delete(params_paths, items_to_delete)
-    params_values = np.delete(params_values, items_to_delete)
-    params_indices = np.delete(params_indices, items_to_delete)
-
-    return object_params_paths, object_params_values, object_params_indices, params_paths, params_values, params_indices
-
-
-def update_object(object, object_type, params_paths, params_values, params_indices):
-    update_flag = False
-    object_params_paths, object_params_values, object_params_indices, params_paths, params_values, params_indices = \
-        pop_object_parameters(object_type, params_paths, params_values, params_indices)
-    for ip in range(len(object_params_paths)):
-        set_object_attribute_recursively(object, object_params_paths[ip], object_params_values[ip],
-                                         object_params_indices[ip])
-        update_flag = True
-    return object, params_paths, params_values, params_indices, update_flag
+            object_type = SIMULATOR_TYPE
+            attributes = tuple(path)
+        plan = plans.setdefault(object_type, [])
+        indices = np.array(indices, dtype="i").flatten()
+        key = (object_type, attributes)
+        if indices.size == 0:
+            plan.append((attributes, None, ip))
+            # A later scatter to this attribute must come after this setter:
+            scatters.pop(key, None)
+        elif key in scatters:
+            target_indices, columns = scatters[key]
+            target_indices.append(indices)
+            columns.append(ip * np.ones(indices.shape, dtype="i"))
+        else:
+            scatters[key] = ([indices], [ip * np.ones(indices.shape, dtype="i")])
+            plan.append((attributes, scatters[key], None))
+    for object_type, plan in plans.iteritems():
+        for iset, (attributes, scatter, column) in enumerate(plan):
+            if scatter is not None:
+                plan[iset] = (attributes, np.concatenate(scatter[0]), np.concatenate(scatter[1]))
+            else:
+                plan[iset] = (attributes, None, column)
+    return plans
+
+
+def apply_setter_plan(object, plan, params_values):
+    # Set the parameters' values of a loop to an object, with one (vectorized) assignment per target
+    # Return True if any parameter was set
+    for attributes, indices, columns in plan:
+        target = object
+        for attribute in attributes[:-1]:
+            target = getattr(target, attribute)
+        if indices is None:
+            setattr(target, attributes[-1], params_values[columns])
+        else:
+            temp = getattr(target, attributes[-1])
+            temp[indices] = params_values[columns]
+            setattr(target, attributes[-1], temp)
+    return len(plan) > 0
 
 
-def update_hypothesis(hypothesis_input, params_paths, params_values, params_indices,
-                      model_configuration_service_input=None,
+def update_hypothesis(hypothesis_input, params_values, setter_plans, model_configuration_service_input=None,
                       yc=YC_DEF, Iext1=I_EXT1_DEF, K=K_DEF, a=A_DEF, b=B_DEF, x1eq_mode="optimize"):
 
     # Assign possible hypothesis parameters on a new hypothesis object:
     hypothesis = deepcopy(hypothesis_input)
-    hypothesis, params_paths, params_values, params_indices = \
-        update_object(hypothesis, "hypothesis", params_paths, params_values, params_indices)[:4]
+    apply_setter_plan(hypothesis, setter_plans.get("hypothesis", []), params_values)
     hypothesis.update(name=hypothesis.name)
 
     # ...create/update a model configuration service:
@@ -95,9 +131,8 @@ def update_hypothesis(hypothesis_input, params_paths, params_values, params_indi
         model_configuration_service = ModelConfigurationService(yc=yc, Iext1=Iext1, K=K, a=a, b=b, x1eq_mode=x1eq_mode)
 
     # ...modify possible related parameters:
-    model_configuration_service, params_paths, params_values, params_indices = \
-        update_object(model_configuration_service, "model_configuration_service", params_paths, params_values,
-                      params_indices)[:4]
+    apply_setter_plan(model_configuration_service, setter_plans.get("model_configuration_service", []),
+                      params_values)
 
     # ...and compute a new model_configuration:
     if hypothesis.type == "Epileptogenicity":
@@ -105,7 +140,7 @@ def update_hypothesis(hypothesis_input, params_paths, params_values, params_indi
     else:
         model_configuration = model_configuration_service.configure_model_from_hypothesis(hypothesis)
 
-    return hypothesis, model_configuration, params_paths, params_values, params_indices
+    return hypothesis, model_configuration
 
 
 def lsa_out_fun(hypothesis, model_configuration=None, **kwargs):
@@ -121,37 +156,94 @@ def lsa_run_fun(hypothesis_input, params_paths, params_values, params_indices, o
                 model_configuration_service_input=None,
                 yc=YC_DEF, Iext1=I_EXT1_DEF, K=K_DEF, a=A_DEF, b=B_DEF, x1eq_mode="optimize",
                 lsa_service_input=None,
-                n_eigenvectors=EIGENVECTORS_NUMBER_SELECTION, weighted_eigenvector_sum=True):
+                eigen_vectors_number_selection=EIGENVECTORS_NUMBER_SELECTION, n_eigenvectors=None,
+                weighted_eigenvector_sum=True, random_seed=None, setter_plans=None, eigen_decomposition_input=None):
 
-    try:
-        # Update hypothesis and create a new model_configuration:
-        hypothesis, model_configuration, params_paths, params_values, params_indices\
-            = update_hypothesis(hypothesis_input, params_paths, params_values, params_indices,
-                                model_configuration_service_input, yc, Iext1, K, a, b, x1eq_mode)
-
-        # ...create/update lsa service:
-        if isinstance(lsa_service_input, LSAService):
-            lsa_service = deepcopy(lsa_service_input)
-        else:
-            lsa_service = LSAService(n_eigenvectors=n_eigenvectors, weighted_eigenvector_sum=weighted_eigenvector_sum)
+    # Exceptions are not caught here, but by the PSEPolicy running the loop, which records their type and message.
 
-        # ...and modify possible related parameters:
-        lsa_service = \
-            update_object(lsa_service, "lsa_service", params_paths, params_values, params_indices)[0]
+    # setter_plans are precompiled once per pse by run_pse:
+    if setter_plans is None:
+        setter_plans = compile_setter_plans(params_paths, params_indices)
+    params_values = np.array(params_values)
 
-        # Run LSA:
-        lsa_hypothesis = lsa_service.run_lsa(hypothesis, model_configuration)
+    # Update hypothesis and create a new model_configuration:
+    hypothesis, model_configuration = update_hypothesis(hypothesis_input, params_values, setter_plans,
+                                                        model_configuration_service_input,
+                                                        yc, Iext1, K, a, b, x1eq_mode)
 
-        if callable(out_fun):
-            output = out_fun(lsa_hypothesis, model_configuration=model_configuration)
-        else:
-            output = lsa_hypothesis
+    # ...create/update lsa service:
+    if isinstance(lsa_service_input, LSAService):
+        lsa_service = deepcopy(lsa_service_input)
+    else:
+        lsa_service = LSAService(eigen_vectors_number_selection=eigen_vectors_number_selection,
+                                 eigen_vectors_number=n_eigenvectors, weighted_eigenvector_sum=weighted_eigenvector_sum)
 
-        return True, output
+    # ...and modify possible related parameters:
+    apply_setter_plan(lsa_service, setter_plans.get("lsa_service", []), params_values)
 
-    except:
+    # Run LSA, incrementally, if a base eigen decomposition (see LSAService.eigen_decomposition) is given:
+    if isinstance(eigen_decomposition_input, dict):
+        lsa_hypothesis = lsa_service.run_lsa_incremental(hypothesis, model_configuration, eigen_decomposition_input)
+    else:
+        lsa_hypothesis = lsa_service.run_lsa(hypothesis, model_configuration)
 
-        return False, None
+    if callable(out_fun):
+        output = out_fun(lsa_hypothesis, model_configuration=model_configuration)
+    else:
+        output = lsa_hypothesis
+
+    return True, output
+
+
+def lsa_boundary_features(output, x1EQcr=X1_EQ_CR_DEF):
+    # Features of an LSA output, whose changes mark the interesting regions of the parameter space:
+    # the propagation strengths, and whether the equilibrium of each region is (at least) critical.
+    # ModelConfigurationService clips supercritical equilibria to x1EQcr - 10 ** (-3), hence the tolerance.
+    return np.concatenate([np.array(output["propagation_strengths"], dtype="float64").flatten(),
+                           (np.array(output["x1EQ"]).flatten() > x1EQcr - 2 * 10 ** (-3)).astype("float64")])
+
+
+def boundary_pairs(samples, features, n_neighbours=5, block_size=1000):
+    """
+    Find pairs of neighbouring samples, and score them by the change of their features
+    :param samples: an array of (n_samples, n_params) parameter values
+    :param features: an array of (n_samples, n_features) output features
+    :param n_neighbours: the number of nearest neighbours of each sample to pair it with
+    :param block_size: the number of samples whose distances to all others are computed at once
+    :return: the indices of the first and second samples of each pair, and their scores,
+             i.e., the maximum absolute change of any feature normalized to its range, sorted by decreasing score
+    """
+    def normalize(x):
+        x = np.array(x, dtype="float64")
+        x_range = x.max(axis=0) - x.min(axis=0)
+        x_range[x_range == 0.0] = 1.0
+        return (x - x.min(axis=0)) / x_range
+
+    samples = normalize(samples)
+    features = normalize(features)
+    n_samples = samples.shape[0]
+    n_neighbours = min(n_neighbours, n_samples - 1)
+    squared_norms = np.sum(samples ** 2, axis=1)
+    first = []
+    second = []
+    for start in range(0, n_samples, block_size):
+        block = np.arange(start, min(start + block_size, n_samples))
+        # Squared distances as |a|^2 + |b|^2 - 2 a.b, i.e., in (block_size, n_samples) memory:
+        distances = squared_norms[block, np.newaxis] + squared_norms[np.newaxis] - \
+                    2 * np.dot(samples[block], samples.T)
+        distances[np.arange(block.size), block] = np.inf
+        neighbours = np.argpartition(distances, n_neighbours - 1, axis=1)[:, :n_neighbours]
+        first.append(np.repeat(block, n_neighbours))
+        second.append(neighbours.flatten())
+    first = np.concatenate(first)
+    second = np.concatenate(second)
+    # Remove duplicate pairs:
+    pairs = np.unique(np.minimum(first, second) * n_samples + np.maximum(first, second))
+    first = pairs / n_samples
+    second = pairs % n_samples
+    scores = np.max(np.abs(features[first] - features[second]), axis=1)
+    order = np.argsort(-scores, kind="mergesort")
+    return first[order], second[order], scores[order]
 
 
 def sim_out_fun(simulator, time, data, **kwargs):
@@ -165,57 +257,116 @@ def sim_out_fun(simulator, time, data, **kwargs):
 def sim_run_fun(simulator_input, params_paths, params_values, params_indices, out_fun=sim_out_fun, hypothesis_input=None,
                 model_configuration_service_input=None,
                 yc=YC_DEF, Iext1=I_EXT1_DEF, K=K_DEF, a=A_DEF, b=B_DEF, x1eq_mode="optimize",
-                update_initial_conditions=True):
+                update_initial_conditions=True, random_seed=None, setter_plans=None):
 
     # Create new objects from the input simulator
     simulator = deepcopy(simulator_input)
     model_configuration = deepcopy(simulator_input.model_configuration)
     model = deepcopy(simulator_input.model)
 
-    try:
+    # Exceptions are not caught here, but by the PSEPolicy running the loop, which records their type and message.
+
+    # setter_plans are precompiled once per pse by run_pse:
+    if setter_plans is None:
+        setter_plans = compile_setter_plans(params_paths, params_indices)
+    params_values = np.array(params_values)
+
+    # First try to update model_configuration via an input hypothesis...:
+    if isinstance(hypothesis_input, DiseaseHypothesis):
+        hypothesis, model_configuration = update_hypothesis(hypothesis_input, params_values, setter_plans,
+                                                            model_configuration_service_input,
+                                                            yc, Iext1, K, a, b, x1eq_mode)
+        # Update model configuration:
+        simulator.model_configuration = model_configuration
+        # ...in which case a model has to be regenerated:
+        if isinstance(simulator, SimulatorTVB):
+            model = model_build_dict[model._ui_name](model_configuration, zmode=model.zmode)
+        else:
+            model = custom_model_builder(model_configuration)
 
-        # First try to update model_configuration via an input hypothesis...:
-        if isinstance(hypothesis_input, DiseaseHypothesis):
-            hypothesis, model_configuration, params_paths, params_values, params_indices = \
-                update_hypothesis(hypothesis_input, params_paths, params_values, params_indices,
-                                  model_configuration_service_input, yc, Iext1, K, a, b, x1eq_mode)
-            # Update model configuration:
-            simulator.model_configuration = model_configuration
-            # ...in which case a model has to be regenerated:
-            if isinstance(simulator, SimulatorTVB):
-                model = model_build_dict[model._ui_name](model_configuration, zmode=model.zmode)
-            else:
-                model = custom_model_builder(model_configuration)
+    # Now (further) update model if needed:
+    apply_setter_plan(model, setter_plans.get("model", []), params_values)
+    simulator.model = model
+
+    # Now, update other possible remaining parameters, i.e., concerning the integrator, noise etc...
+    apply_setter_plan(simulator, setter_plans.get(SIMULATOR_TYPE, []), params_values)
 
-        # Now (further) update model if needed:
-        model, params_paths, params_values, params_indices = \
-            update_object(model, "model", params_paths, params_values, params_indices)
-        simulator.model = model
+    # Give this simulation its own noise random stream, if a seed is given:
+    if random_seed is not None:
+        simulator.simulation_settings.noise_seed = random_seed
+        if isinstance(simulator.simulation_settings.noise_preconfig, Noise):
+            simulator.simulation_settings.noise_preconfig.random_stream = np.random.RandomState(random_seed)
 
-        # Now, update other possible remaining parameters, i.e., concerning the integrator, noise etc...
-        for ip in range(len(params_paths)):
-            set_object_attribute_recursively(simulator, params_paths[ip], params_values[ip], params_indices[ip])
+    # Now, recalculate the default initial conditions...
+    # If initial conditions were parameters, then, this flag can be set to False
+    if update_initial_conditions:
+        simulator.configure_initial_conditions()
 
-        # Now, recalculate the default initial conditions...
-        # If initial conditions were parameters, then, this flag can be set to False
-        if update_initial_conditions:
-            simulator.configure_initial_conditions()
+    time, data, status = simulator.launch()
 
-        time, data, status = simulator.launch()
+    output = None
+    if status:
+        output = out_fun(simulator, time, data)
 
-        if status:
-            output = out_fun(time, data, simulator)
+    return status, output
 
-        return True, output
 
-    except:
+class ParamsGrid(object):
 
-        return False, None
+    def __init__(self, values):
+        """
+        The Cartesian product of the values of each parameter, as a lazy (n_loops, n_params) array of samples.
+        Rows are generated by their loop index, in C order, i.e., with the last parameter varying the fastest,
+        so that the full product matrix is never materialized, unless it is converted to an array.
+        :param values: a list of vectors of values per parameter
+        """
+        self.values = [np.array(value).flatten() for value in values]
+        self.grid_shape = tuple([value.size for value in self.values])
+        self.shape = (int(np.prod(self.grid_shape)), len(self.values))
+        self.ndim = 2
+        self.dtype = np.result_type(*self.values)
+
+    def __repr__(self):
+        d = {"01. Number of values per parameter": self.grid_shape,
+             "02. Shape": self.shape}
+        return formal_repr(self, d)
+
+    def __str__(self):
+        return self.__repr__()
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            loops, params = key[0], key[1:]
+        else:
+            loops, params = key, ()
+        if isinstance(loops, slice):
+            loops = np.arange(*loops.indices(self.shape[0]))
+        else:
+            loops = np.array(loops)
+            if loops.dtype == np.bool_:
+                loops = np.where(loops)[0]
+            loops = np.where(loops < 0, loops + self.shape[0], loops)
+        indices = np.unravel_index(loops, self.grid_shape)
+        samples = np.stack([value[inds] for value, inds in zip(self.values, indices)], axis=-1)
+        if len(params) > 0:
+            samples = samples[(Ellipsis, ) + params]
+        return samples
+
+    def __array__(self, dtype=None):
+        samples = self[:]
+        if dtype is not None:
+            samples = samples.astype(dtype)
+        return samples
 
 
 class PSEService(object):
 
-    def __init__(self, task, hypothesis=[], simulator=[], params_pse=None, run_fun=None, out_fun=None):
+    def __init__(self, task, hypothesis=[], simulator=[], params_pse=None, run_fun=None, out_fun=None, grid=False):
+        # If grid is True, the "samples" of each parameter are its values, which may differ in number,
+        # and the pse runs the Cartesian product of all parameters' values, generated lazily loop by loop.
 
         if task not in ["LSA", "SIMULATION"]:
             warnings.warn("\ntask = " + str(task) + " is not a valid pse task." +
@@ -228,6 +379,8 @@ class PSEService(object):
         self.n_params_vals = []
         self.params_indices = []
         self.n_loops = 0
+        self.status_codes = np.array([], dtype="i")
+        self.status_messages = []
 
         if task == "LSA":
 
@@ -289,19 +442,24 @@ class PSEService(object):
             self.n_params_vals = np.array(self.n_params_vals)
             self.n_params = len(self.params_paths)
 
-            if not(np.all(self.n_params_vals == self.n_params_vals[0])):
+            if grid:
+                self.pse_params = ParamsGrid(temp)
+
+            elif not(np.all(self.n_params_vals == self.n_params_vals[0])):
                 raise ValueError("\nNot all parameters have the same number of samples!: " +
                                  "\n" + str(self.params_paths) + " = " + str( self.n_params_vals))
             else:
                 self.n_params_vals = self.n_params_vals[0]
+                self.pse_params = np.vstack(temp).T
 
-            self.pse_params = np.vstack(temp).T
             self.params_paths = np.array(self.params_paths)
             self.params_indices = np.array(self.params_indices)
             self.n_loops = self.pse_params.shape[0]
 
             print "\nGenerated a parameter search exploration for " + str(task) + ","
             print "with " + str(self.n_params) + " parameters of " + str(self.n_params_vals) + " values each,"
+            if grid:
+                print "in a grid of their Cartesian product,"
             print "leading to " + str(self.n_loops) + " total execution loops"
 
         else:
@@ -320,11 +478,17 @@ class PSEService(object):
         return self.__repr__()
 
     def _prepare_for_h5(self):
+        if isinstance(self.pse_params, ParamsGrid):
+            # The values of each parameter, instead of the full Cartesian product:
+            params_samples = {"grid_values": OrderedDict(zip(self.params_names, self.pse_params.values))}
+        else:
+            params_samples = self.pse_params.T
         h5_model = convert_to_h5_model({"task": self.task, "n_loops": self.n_loops,
                                    "params_names": self.params_names,
                                    "params_paths": self.params_paths,
                                    "params_indices": np.array([str(inds) for inds in self.params_indices], dtype="S"),
-                                   "params_samples": self.pse_params.T})
+                                   "params_samples": params_samples,
+                                   "status_codes": self.status_codes})
         h5_model.add_or_update_metadata_attribute("EPI_Type", "HypothesisModel")
         return h5_model
 
@@ -334,46 +498,208 @@ class PSEService(object):
         h5_model = self._prepare_for_h5()
         h5_model.write_to_h5(folder, filename)
 
-    def run_pse(self, grid_mode=False, **kwargs):
+    def run_pse(self, grid_mode=False, random_streams=None, loops_offset=0, policy=None, pse_results=None,
+                **kwargs):
+        # If a RandomStreams instance is given, each loop gets its own independent random stream seed,
+        # which depends only on the loop index (plus loops_offset, when pse_params is a chunk of a larger sweep).
+        # A PSEPolicy may set pre-checks, timeouts, output checks and an abort threshold for the loops.
+        # The status code and message of each loop are kept in status_codes and status_messages.
+        # If a PSEResults store is given, outputs are written in place into it, at loops_offset + iloop,
+        # and it is returned instead of a list of outputs (grid_mode reshapes only the execution status then).
+
+        if policy is None:
+            policy = PSEPolicy()
 
-        results = []
+        # The parameters' paths are compiled once into setter plans, for run functions that accept them:
+        if accepts_argument(self.run_fun, "setter_plans"):
+            kwargs["setter_plans"] = compile_setter_plans(self.params_paths, self.params_indices)
+
+        if pse_results is None:
+            results = []
+        else:
+            results = pse_results
         execution_status = []
+        status_codes = []
+        status_messages = []
 
         for iloop in range(self.n_loops):
 
             params = self.pse_params[iloop, :]
 
-            print "\nExecuting loop " + str(iloop) + " of " + str(self.n_loops)
+            print "\nExecuting loop " + str(loops_offset + iloop) + " of " + str(loops_offset + self.n_loops)
             # print "\nParameters:"
             # for ii in range(len(params)):
             #      print self.params_paths[ii] + "[" + str(self.params_indices[ii]) + "] = " + str(params[ii])
 
-            status = False
-            output = None
+            if random_streams is not None:
+                kwargs["random_seed"] = random_streams.seed(self.task, loops_offset + iloop)
+            code, message, output = policy.run_loop(self.run_fun, self.pse_object, self.params_paths, params,
+                                                    self.params_indices, self.out_fun, **kwargs)
+
+            if code != LOOP_SUCCESS:
+                LOG.debug("Execution of loop " + str(loops_offset + iloop) + " failed with status " +
+                          LOOP_STATUS_NAMES[code] + ": " + message)
 
-            try:
-                status, output = self.run_fun(self.pse_object, self.params_paths, params, self.params_indices,
-                                              self.out_fun, **kwargs)
+            if pse_results is None:
+                results.append(output)
+            else:
+                pse_results.set_loop(loops_offset + iloop, output)
+            execution_status.append(code == LOOP_SUCCESS)
+            status_codes.append(code)
+            status_messages.append(message)
+
+            if policy.abort(status_codes):
+                n_left = self.n_loops - iloop - 1
+                if pse_results is None:
+                    results += n_left * [None]
+                execution_status += n_left * [False]
+                status_codes += n_left * [LOOP_ABORTED]
+                status_messages += n_left * ["Aborted"]
+                self._set_status(status_codes, status_messages)
+                raise PSEAbortError("\nPSE aborted after " + str(iloop + 1) + " loops, with loop status counts " +
+                                    str(dict(status_summary(status_codes[:iloop + 1]))) +
+                                    " exceeding the maximum failure ratio " + str(policy.max_failure_ratio) + "!",
+                                    results, execution_status, status_codes, status_messages)
+
+        self._set_status(status_codes, status_messages)
+
+        if grid_mode:
+            if pse_results is None:
+                results = self.reshape_to_grid(np.array(results, dtype="O"))
+            execution_status = self.reshape_to_grid(np.array(execution_status))
 
-            except:
-                pass
+        return results, execution_status
 
-            if not status:
-                warnings.warn("\nExecution of loop " + str(iloop) + "failed!")
+    def reshape_to_grid(self, values):
+        # Reshape values of all loops, e.g., an array of a PSEResults store, to the grid of the parameters' values
+        grid_shape = tuple(np.array(self.n_params_vals).flatten())
+        values = np.asarray(values)
+        return np.reshape(values, grid_shape + values.shape[1:])
+
+    def _set_status(self, status_codes, status_messages):
+        self.status_codes = np.array(status_codes, dtype="i")
+        self.status_messages = status_messages
+        if np.any(self.status_codes != LOOP_SUCCESS):
+            # A single summary, instead of a warning per failed loop
+            warnings.warn("\nNot all loops succeeded! Loop status counts: " +
+                          str(dict(status_summary(self.status_codes))))
+
+    def run_pse_chunks(self, samples_chunks, **kwargs):
+        """
+        A generator that runs the pse for samples streamed in chunks,
+        e.g., by QuasiRandomSamplingService.sample_chunks(), so that the whole design is never in memory.
+        The parameters' paths, indices and names are the ones given at construction (with any samples).
+        :param samples_chunks: an iterable of arrays of shape (n_params, chunk_size)
+        :return: yields the results and execution status of each chunk
+        """
+        loops_offset = 0
+        for samples in samples_chunks:
+            samples = np.array(samples)
+            if samples.shape[0] != self.n_params:
+                raise ValueError("\nSamples' chunk of shape " + str(samples.shape) + " does not match the number " +
+                                 "of parameters " + str(self.n_params) + "!")
+            self.pse_params = samples.T
+            self.n_loops = self.pse_params.shape[0]
+            yield self.run_pse(grid_mode=False, loops_offset=loops_offset, **kwargs)
+            loops_offset += self.n_loops
+
+    def run_pse_adaptive(self, n_refinement_samples, batch_size=None, features_fun=None, params_ids=None,
+                         n_neighbours=5, random_streams=None, **kwargs):
+        """
+        An adaptive parameter search exploration. The current (coarse) design is run first. Then, in batches,
+        n_refinement_samples further loops are spent on samples placed between the neighbouring samples,
+        whose output features differ the most, e.g., across boundaries of changing propagation strengths
+        or equilibrium stability, in order to refine these regions.
+        :param n_refinement_samples: the number of loops to run after the coarse design
+        :param batch_size: the number of samples of each refinement batch (default 1/4 of n_refinement_samples)
+        :param features_fun: a function of a loop's output returning a vector of features
+                             (default lsa_boundary_features for LSA)
+        :param params_ids: the indices of the parameters defining neighbourhoods (default all)
+        :param n_neighbours: the number of neighbours of each sample considered for refinement
+        :param random_streams: a RandomStreams instance, for the loops and the positions of refinement samples
+        :return: the results and execution status of all loops.
+                 pse_params holds the samples of all loops, i.e., the coarse ones followed by the refinement ones
+        """
+        if features_fun is None:
+            if self.task == "LSA":
+                features_fun = lsa_boundary_features
+            else:
+                raise ValueError("\nNo default features_fun for task " + str(self.task) + "!")
+        if batch_size is None:
+            batch_size = max(1, int(np.ceil(n_refinement_samples / 4.0)))
+        if params_ids is None:
+            params_ids = range(self.n_params)
+        if kwargs.get("pse_results", None) is not None:
+            raise ValueError("\nThe number of loops of an adaptive pse is not known in advance! " +
+                             "Fill a PSEResults store from its results instead.")
+        if random_streams is None:
+            random_state = np.random
+        else:
+            random_state = random_streams.stream(self.task, "refinement")
+
+        results, execution_status = self.run_pse(grid_mode=False, random_streams=random_streams, **kwargs)
+        samples = self.pse_params
+        status_codes = self.status_codes
+        status_messages = self.status_messages
+
+        n_left = n_refinement_samples
+        while n_left > 0:
+            succeeded = np.where(execution_status)[0]
+            if succeeded.size < 2:
+                warnings.warn("\nLess than 2 successful loops! Stopping the adaptive refinement.")
+                break
+            features = np.array([np.array(features_fun(results[ii]), dtype="float64").flatten()
+                                 for ii in succeeded])
+            first, second, scores = boundary_pairs(samples[succeeded][:, params_ids], features, n_neighbours)
+            n_batch = min(batch_size, n_left, np.sum(scores > 0.0))
+            if n_batch == 0:
+                LOG.info("No changes of output features between neighbouring samples. " +
+                         "Stopping the adaptive refinement.")
+                break
+            first = succeeded[first[:n_batch]]
+            second = succeeded[second[:n_batch]]
+            # New samples at random positions around the middle of the segments between the pairs' samples:
+            new_samples = samples[first] + random_state.uniform(0.25, 0.75, (n_batch, 1)) * \
+                                           (samples[second] - samples[first])
+            self.pse_params = new_samples
+            self.n_loops = n_batch
+            new_results, new_execution_status = self.run_pse(grid_mode=False, random_streams=random_streams,
+                                                             loops_offset=samples.shape[0], **kwargs)
+            results += new_results
+            execution_status += new_execution_status
+            status_codes = np.concatenate([status_codes, self.status_codes])
+            status_messages = status_messages + self.status_messages
+            samples = np.vstack([samples, new_samples])
+            n_left -= n_batch
+
+        self.pse_params = samples
+        self.n_loops = samples.shape[0]
+        self.status_codes = status_codes
+        self.status_messages = status_messages
+        return results, execution_status
 
-            results.append(output)
-            execution_status.append(status)
+    def run_pse_parallel(self, grid_mode=False, executor=None, **kwargs):
+        # Run the loops with a PSEExecutor, by default with one local worker process per cpu,
+        # over a job queue in a temporary folder
+        temp_folder = None
+        if executor is None:
+            temp_folder = tempfile.mkdtemp(prefix="pse_")
+            n_workers = multiprocessing.cpu_count()
+            executor = FileSystemPSEExecutor(temp_folder, chunk_size=max(1, self.n_loops / (4 * n_workers)),
+                                             n_local_workers=n_workers, poll_interval=0.1)
+        try:
+            results, execution_status = executor.run(self, **kwargs)
+        finally:
+            if temp_folder is not None:
+                shutil.rmtree(temp_folder, ignore_errors=True)
 
         if grid_mode:
-            results = np.reshape(np.array(results, dtype="O"), tuple(self.n_params_vals))
-            execution_status = np.reshape(np.array(execution_status), tuple(self.n_params_vals))
+            if kwargs.get("pse_results", None) is None:
+                results = self.reshape_to_grid(np.array(results, dtype="O"))
+            execution_status = self.reshape_to_grid(np.array(execution_status))
 
         return results, execution_status
 
-    def run_pse_parallel(self, grid_mode=False):
-        # TODO: start each loop on a separate process, gather results and return them
-        raise NotImplementedError
-
 
 if __name__ == "__main__":
 
@@ -389,7 +715,8 @@ if __name__ == "__main__":
 
     reader = Reader()
 
-    head = reader.read_head(data_folder)
+    # Only the connectivity is needed:
+    head = reader.read_head(data_folder, lazy=True)
 
     # --------------------------Hypothesis definition-----------------------------------
 
@@ -441,7 +768,7 @@ if __name__ == "__main__":
                                 weighted_eigenvector_sum=lsa_service.weighted_eigenvector_sum,
                                 n_eig=lsa_service.eigen_vectors_number)
     # , show_flag=True, save_flag=False
-    convert_to_h5_model(pse_results).write_to_h5(FOLDER_RES, lsa_hypothesis.name + "_PSE_LSA_results.h5")
+    pse_results.write_to_h5(FOLDER_RES, lsa_hypothesis.name + "_PSE_LSA_results.h5")
 
 
 
@@ -0,0 +1,59 @@
+"""
+Seed sequence based management of independent and reproducible random streams,
+for sampling, parameter search exploration loops and simulation noise.
+Each stream is identified by a key, i.e., a tuple of strings and/or integers, such as ("PSE", iloop).
+Its seed depends only on the root seed and the key, and not on the order or the process in which streams are created,
+so that results are bit-identical no matter how work is chunked across processes.
+"""
+import hashlib
+
+import numpy as np
+
+from tvb_epilepsy.base.utils import formal_repr
+
+# Number of 32bit words of the seeds given to numpy.random.RandomState
+SEED_WORDS = 8
+
+
+class RandomStreams(object):
+
+    def __init__(self, root_seed=None, key=()):
+        if root_seed is None:
+            # Draw a root seed from the OS entropy, and keep it so that the run can be reproduced:
+            root_seed = int(np.random.RandomState().randint(0, 2 ** 31 - 1))
+        self.root_seed = root_seed
+        self.key = tuple(key)
+
+    def __repr__(self):
+        d = {"01. Root seed": self.root_seed,
+             "02. Key": self.key}
+        return formal_repr(self, d)
+
+    def __str__(self):
+        return self.__repr__()
+
+    def seed(self, *key):
+        """
+        :param key: the identifiers of the stream, appended to the key of this instance
+        :return: an array of SEED_WORDS uint32 words, to be used as seed of a numpy.random.RandomState
+        """
+        sha = hashlib.sha256()
+        sha.update(repr(np.array(self.root_seed).tolist()))
+        for k in self.key + tuple(key):
+            # Separate keys' items unambiguously, and treat python and numpy integers alike:
+            if isinstance(k, (int, long, np.integer)):
+                sha.update("/int:" + str(int(k)))
+            else:
+                sha.update("/" + type(k).__name__ + ":" + str(k))
+        return np.frombuffer(sha.digest()[:4 * SEED_WORDS], dtype="<u4").astype(np.uint32)
+
+    def stream(self, *key):
+        return np.random.RandomState(self.seed(*key))
+
+    def spawn(self, *key):
+        # Return a child manager, whose streams are all independent from the ones of its parent
+        return RandomStreams(self.root_seed, self.key + tuple(key))
+
+    def seeds(self, n, *key):
+        # The seeds of n consecutive streams (e.g., one per sample or loop) of a key
+        return [self.seed(*(key + (ii,))) for ii in range(n)]
@@ -3,6 +3,9 @@ Abstract Reading mechanism for VEP related entities
 """
 
 from abc import ABCMeta, abstractmethod
+from multiprocessing.pool import ThreadPool
+
+from tvb_epilepsy.base.model_vep import HeadComponentLoader
 
 
 class ABCReader(object):
@@ -37,5 +40,23 @@ class ABCReader(object):
         pass
 
     @abstractmethod
-    def read_head(self, root_folder):
+    def read_head(self, root_folder, name='', lazy=False, n_threads=0):
+        """
+        :param lazy: if True, only the connectivity is read at once, and all other components on first access,
+                     so that any failure to read them (e.g., a missing file) is raised then, and not by read_head
+        :param n_threads: if > 0, the other components are read concurrently in the background by a pool of threads
+        """
         pass
+
+    def _component_reader(self, lazy=False, n_threads=0):
+        """
+        :return: a function of (read_fun, *args) returning either the component read by read_fun(*args), or,
+                 if lazy or n_threads > 0, a HeadComponentLoader of it, and the thread pool (or None) that reads
+                 the components in the background, to be closed once all reads are submitted
+        """
+        if n_threads > 0:
+            pool = ThreadPool(n_threads)
+            return lambda read_fun, *args: HeadComponentLoader(pool.apply_async(read_fun, args).get), pool
+        elif lazy:
+            return HeadComponentLoader, None
+        return lambda read_fun, *args: read_fun(*args), None
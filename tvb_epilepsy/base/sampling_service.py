@@ -6,7 +6,9 @@ import numpy as np
 import numpy.random as nr
 import scipy.stats as ss
 import scipy as scp
+
 from SALib.sample import saltelli, fast_sampler, morris, ff
+from SALib.sample.directions import directions
 
 from tvb_epilepsy.base.constants import FOLDER_RES
 from tvb_epilepsy.base.utils import formal_repr, dict_str, dicts_of_lists, dicts_of_lists_to_lists_of_dicts
@@ -225,6 +227,17 @@ class SamplingService(object):
     def _list_params(self):
         self.params = dicts_of_lists(self.params, self.n_outputs)
 
+    def _broadcast_params(self, params):
+        # Convert a dictionary of lists of length n_outputs to one of (n_outputs, 1) arrays,
+        # which broadcast against the (n_outputs, n_samples) shape of the samples
+        broadcast_params = dict()
+        for key, value in params.iteritems():
+            if len(value) != self.n_outputs:
+                raise ValueError("\nParameters are neither an empty list nor a list of length n_parameters = "
+                                 + str(self.n_outputs) + " but one of length " + str(len(value)) + " !")
+            broadcast_params[key] = np.reshape(np.array(value, dtype="float"), (self.n_outputs, 1))
+        return broadcast_params
+
     def compute_stats(self, samples):
         return OrderedDict([("mu", samples.mean(axis=1)), ("m", scp.median(samples, axis=1)),
                             ("std", samples.std(axis=1)), ("var", samples.var(axis=1)),
@@ -289,6 +302,7 @@ class StochasticSamplingService(SamplingService):
         super(StochasticSamplingService, self).__init__(n_samples, n_outputs)
 
         self.random_seed = random_seed
+        self.random_state = None
         self.params = kwargs
         self._list_params()
         self.trunc_limits = trunc_limits
@@ -347,20 +361,22 @@ class StochasticSamplingService(SamplingService):
         return h5_model
 
     def _numpy_sample(self, distribution, size, **params):
-        return getattr(nr, distribution)(size=size, **params)
+        return getattr(self.random_state, distribution)(size=size, **params)
 
     def _scipy_sample(self, distribution, size, **params):
-        return getattr(ss, distribution)(**params).rvs(size)
+        return getattr(ss, distribution)(**params).rvs(size, random_state=self.random_state)
 
     def _truncated_distribution_sampling(self, distribution, trunc_limits, size, **kwargs):
         # Following: https://stackoverflow.com/questions/25141250/
         # how-to-truncate-a-numpy-scipy-exponential-distribution-in-an-efficient-way
         # TODO: to have distributions parameters valid for the truncated distributions instead for the original one
         # pystan might be needed for that...
-        rnd_cdf = nr.uniform(getattr(ss, distribution)(**kwargs).cdf(x=trunc_limits.get("low", -np.inf)),
-                             getattr(ss, distribution)(**kwargs).cdf(x=trunc_limits.get("high", np.inf)),
-                             size=size)
-        return getattr(ss, distribution)(**kwargs).ppf(q=rnd_cdf)
+        # Parameters and truncation limits may be arrays broadcastable to size, so that all outputs are sampled at once
+        frozen_distribution = getattr(ss, distribution)(**kwargs)
+        rnd_cdf = self.random_state.uniform(frozen_distribution.cdf(x=trunc_limits.get("low", -np.inf)),
+                                            frozen_distribution.cdf(x=trunc_limits.get("high", np.inf)),
+                                            size=size)
+        return frozen_distribution.ppf(q=rnd_cdf)
 
     def _salib_sample(self, **kwargs):
 
@@ -388,6 +404,9 @@ class StochasticSamplingService(SamplingService):
             samples = sampler(problem, size, **other_params)
 
         #Adjust samples number:
+        if samples.shape[0] != self.n_samples:
+            warnings.warn("\nSampler " + self.sampling_module + " changed the number of samples from "
+                          + str(self.n_samples) + " to " + str(samples.shape[0]) + "!")
         self.n_samples = samples.shape[0]
         self.shape = (self.n_outputs, self.n_samples)
 
@@ -395,58 +414,240 @@ class StochasticSamplingService(SamplingService):
 
     def sample(self, **kwargs):
 
-        nr.seed(self.random_seed)
+        # A private random stream, so that the global numpy one is neither used nor altered.
+        # random_seed may be an integer or an array seed, e.g., one generated by RandomStreams.seed()
+        self.random_state = nr.RandomState(self.random_seed)
 
         if self.sampling_module.find("SALib") >= 0:
+            # SALib samplers use the global numpy random stream
+            nr.seed(self.random_seed)
             samples = self._salib_sample(**self.params)
 
         else:
 
-            params = dicts_of_lists_to_lists_of_dicts(self.params)
+            # All outputs are sampled with one call, with broadcasted distribution parameters and truncation limits
+            params = self._broadcast_params(self.params)
 
             if self.sampling_module.find("inverse transform") >= 0:
-                trunc_limits = dicts_of_lists_to_lists_of_dicts(self.trunc_limits)
-                samples = []
-                if len(params)== 0:
-                    for io in range(self.n_outputs):
-                        samples.append(self._truncated_distribution_sampling(self.sampler, trunc_limits[io],
-                                                                             self.n_samples))
-                elif len(params) == self.n_outputs:
-                    for io in range(self.n_outputs):
-                        samples.append(self._truncated_distribution_sampling(self.sampler,trunc_limits[io],
-                                                                             self.n_samples, **(params[io])))
-                else:
-                    raise ValueError("\nParameters are neither an empty list nor a list of n_parameters = "
-                                     + str(self.n_outputs) + " but one of length " + str(len(self.params)) + " !")
+                trunc_limits = self._broadcast_params(self.trunc_limits)
+                samples = self._truncated_distribution_sampling(self.sampler, trunc_limits, self.shape, **params)
 
             elif self.sampling_module.find("scipy") >= 0:
-
-                samples = []
-                if len(params) == 0:
-                    for io in range(self.n_outputs):
-                        samples.append(self._scipy_sample(self.sampler, self.n_samples))
-                elif len(params) == self.n_outputs:
-                    for io in range(self.n_outputs):
-                        samples.append(self._scipy_sample(self.sampler, self.n_samples, **(params[io])))
-                else:
-                    raise ValueError("\nParameters are neither an empty list nor a list of length n_parameters = "
-                                     + str(self.n_outputs) + " but one of length " + str(len(self.params)) + " !")
+                samples = self._scipy_sample(self.sampler, self.shape, **params)
 
             elif self.sampling_module.find("numpy") >= 0:
-                samples = []
-                if len(params) == 0:
-                    for io in range(self.n_outputs):
-                        samples.append(self._numpy_sample(self.sampler, self.n_samples))
-                elif len(params) == self.n_outputs:
-                    for io in range(self.n_outputs):
-                        samples.append(self._numpy_sample(self.sampler, self.n_samples, **(params[io])))
-                else:
-                    raise ValueError("\nParameters are neither an empty list nor a list of length n_parameters = "
-                                     + str(self.n_outputs) + " but one of length " + str(len(self.params)) + " !")
+                samples = self._numpy_sample(self.sampler, self.shape, **params)
 
         return np.reshape(samples, self.shape)
 
 
+# Low discrepancy sequences, computed per sample index, so that any chunk of them can be generated independently:
+
+SOBOL_BITS = 31
+
+
+def _sobol_direction_numbers(n_dims):
+    # Following the Joe and Kuo construction of SALib.sample.sobol_sequence, but for all SOBOL_BITS bits
+    if n_dims > len(directions) + 1:
+        raise ValueError("\nNot enough direction numbers for a Sobol sequence of " + str(n_dims) + " dimensions!")
+    V = np.zeros((SOBOL_BITS + 1, n_dims), dtype=np.int64)
+    for i in range(n_dims):
+        if i == 0:
+            for j in range(1, SOBOL_BITS + 1):
+                V[j, i] = 1 << (SOBOL_BITS - j)
+        else:
+            m = np.array(directions[i - 1], dtype=np.int64)
+            a = m[0]
+            s = len(m) - 1
+            for j in range(1, min(s, SOBOL_BITS) + 1):
+                V[j, i] = m[j] << (SOBOL_BITS - j)
+            for j in range(s + 1, SOBOL_BITS + 1):
+                V[j, i] = V[j - s, i] ^ (V[j - s, i] >> s)
+                for k in range(1, s):
+                    V[j, i] ^= ((a >> (s - 1 - k)) & 1) * V[j - k, i]
+    return V
+
+
+def sobol_points(indices, n_dims, direction_numbers=None):
+    """
+    :return: the Sobol sequence points (in gray code order, i.e., the ones of SALib.sample.sobol_sequence)
+    of the given indices, in an array of shape (len(indices), n_dims)
+    """
+    if direction_numbers is None:
+        direction_numbers = _sobol_direction_numbers(n_dims)
+    indices = np.array(indices, dtype=np.int64)
+    gray = indices ^ (indices >> 1)
+    points = np.zeros((indices.size, n_dims), dtype=np.int64)
+    for bit in range(SOBOL_BITS):
+        points ^= ((gray >> bit) & 1)[:, np.newaxis] * direction_numbers[bit + 1][np.newaxis, :]
+    return points / np.power(2.0, SOBOL_BITS)
+
+
+def _first_primes(n):
+    primes = []
+    candidate = 2
+    while len(primes) < n:
+        if np.all([candidate % p for p in primes]):
+            primes.append(candidate)
+        candidate += 1
+    return primes
+
+
+def halton_points(indices, n_dims):
+    """
+    :return: the Halton sequence points of the given indices, in an array of shape (len(indices), n_dims)
+    """
+    indices = np.array(indices, dtype=np.int64)
+    points = np.zeros((indices.size, n_dims))
+    for i_dim, base in enumerate(_first_primes(n_dims)):
+        remaining = np.array(indices)
+        fraction = 1.0
+        while np.any(remaining > 0):
+            fraction /= base
+            points[:, i_dim] += fraction * (remaining % base)
+            remaining //= base
+    return points
+
+
+# Pseudo random permutations, computed per index, so that any chunk of them can be generated independently:
+
+FEISTEL_ROUNDS = 6
+
+
+def _mix(x):
+    # The splitmix64 finalizer, a bijective mixing of 64 bit unsigned integers
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+    return x ^ (x >> np.uint64(31))
+
+
+def feistel_permutation(indices, n, round_keys):
+    """
+    A keyed pseudo random permutation of range(n), i.e., a balanced Feistel network on the smallest even number of
+    bits covering n, with cycle walking for the values that fall outside range(n)
+    :param indices: the indices in range(n) to permute
+    :param round_keys: an array of unsigned 64 bit integers, one per round of the network
+    :return: the permuted indices, in an array of the shape of indices
+    """
+    half_bits = np.uint64((int(np.ceil(np.log2(max(n, 2)))) + 1) // 2)
+    mask = (np.uint64(1) << half_bits) - np.uint64(1)
+
+    def encrypt(x):
+        left = x >> half_bits
+        right = x & mask
+        for key in round_keys:
+            left, right = right, left ^ (_mix(right ^ key) & mask)
+        return (left << half_bits) | right
+
+    n = np.uint64(n)
+    permuted = encrypt(np.array(indices, dtype=np.uint64))
+    outside = permuted >= n
+    while np.any(outside):
+        permuted[outside] = encrypt(permuted[outside])
+        outside = permuted >= n
+    return permuted.astype(np.int64)
+
+
+class QuasiRandomSamplingService(SamplingService):
+    """
+    Low discrepancy (sobol, halton) and latin hypercube ("latin") sampling, mapped through the inverse cdf
+    (scipy.stats ppf) of a distribution, optionally truncated.
+    Samples can be generated in chunks by sample_chunks(), without ever materializing all of them.
+    Chunks do not depend on the chunk size, i.e., their concatenation equals the output of sample().
+    """
+
+    def __init__(self, n_samples=10, n_outputs=1, sampler="sobol", distribution="uniform", trunc_limits={},
+                 random_seed=None, chunk_size=1000, **kwargs):
+
+        super(QuasiRandomSamplingService, self).__init__(n_samples, n_outputs)
+
+        if sampler not in ["sobol", "halton", "latin"]:
+            raise ValueError("\nQuasi random sampler " + str(sampler) + " is not one of 'sobol', 'halton' or 'latin'!")
+        self.sampler = sampler
+        self.distribution = distribution
+        self.sampling_module = "tvb_epilepsy " + sampler + " sequence, scipy.stats." + distribution + \
+                               " inverse transform sampling"
+        self.random_seed = random_seed
+        self.chunk_size = chunk_size
+        self.params = kwargs
+        self._list_params()
+        self.trunc_limits = dicts_of_lists(dict(trunc_limits), self.n_outputs)
+
+    def __repr__(self):
+
+        d = {"01. Sampling module": self.sampling_module,
+             "02. Sampler": self.sampler,
+             "03. Number of samples": self.n_samples,
+             "04. Number of output parameters": self.n_outputs,
+             "05. Samples' shape": self.shape,
+             "06. Random seed": self.random_seed,
+             "07. Chunk size": self.chunk_size,
+             }
+        return formal_repr(self, d) + \
+        "\n08. Distribution parameters: " + dict_str(self.params) + \
+        "\n09. Truncation limits: " + dict_str(self.trunc_limits) + \
+        "\n10. Resulting statistics: " + dict_str(self.stats)
+
+    def __str__(self):
+        return self.__repr__()
+
+    def _inverse_transform(self, unit_samples):
+        # Map (n_outputs, chunk) samples of the unit hypercube to the (truncated) distribution
+        frozen_distribution = getattr(ss, self.distribution)(**self._broadcast_params(self.params))
+        trunc_limits = self._broadcast_params(self.trunc_limits)
+        low_cdf = frozen_distribution.cdf(x=trunc_limits.get("low", -np.inf))
+        high_cdf = frozen_distribution.cdf(x=trunc_limits.get("high", np.inf))
+        return frozen_distribution.ppf(q=low_cdf + unit_samples * (high_cdf - low_cdf))
+
+    def sample_chunks(self, chunk_size=None):
+        """
+        A generator of the samples, in arrays of shape (n_outputs, chunk_size), apart from the last one.
+        """
+
+        if chunk_size is None:
+            chunk_size = self.chunk_size
+
+        random_state = nr.RandomState(self.random_seed)
+
+        if self.sampler == "latin":
+            # The strata of each dimension are permuted by a keyed Feistel permutation of the sample indices,
+            # instead of a materialized random permutation of n_samples indices
+            round_keys = random_state.randint(0, 2 ** 62, size=(self.n_outputs, FEISTEL_ROUNDS),
+                                              dtype=np.int64).astype(np.uint64)
+
+        else:
+            # Randomization by a random (Cranley-Patterson) shift, if a random_seed is given:
+            if self.random_seed is None:
+                shift = np.zeros((self.n_outputs, ))
+            else:
+                shift = random_state.uniform(size=(self.n_outputs, ))
+            if self.sampler == "sobol":
+                direction_numbers = _sobol_direction_numbers(self.n_outputs)
+
+        for start in range(0, self.n_samples, chunk_size):
+
+            indices = np.arange(start, min(start + chunk_size, self.n_samples), dtype=np.int64)
+
+            if self.sampler == "latin":
+                strata = np.array([feistel_permutation(indices, self.n_samples, keys) for keys in round_keys]).T
+                # Drawing the jitter of (chunk, n_outputs) samples at once consumes the random stream
+                # in the same order, whatever the chunk size:
+                unit_samples = (strata + random_state.uniform(size=strata.shape)) / self.n_samples
+
+            else:
+                # The first point (0, ... 0) of the sequences is skipped, as it is singular for most distributions
+                if self.sampler == "sobol":
+                    unit_samples = sobol_points(indices + 1, self.n_outputs, direction_numbers)
+                else:
+                    unit_samples = halton_points(indices + 1, self.n_outputs)
+                unit_samples = np.mod(unit_samples + shift, 1.0)
+
+            yield self._inverse_transform(unit_samples.T)
+
+    def sample(self, **kwargs):
+        return np.hstack(list(self.sample_chunks(kwargs.get("chunk_size", None))))
+
+
 if __name__ == "__main__":
 
     LOG.info("\nDeterministic linspace sampling:")
@@ -1,4 +1,6 @@
+import os
 import warnings
+import multiprocessing
 from collections import OrderedDict
 
 import numpy as np
@@ -6,12 +8,27 @@ import numpy as np
 from SALib.analyze import sobol, delta, fast, morris, dgsm,  ff
 from tvb_epilepsy.base.utils import formal_repr, list_of_dicts_to_dicts_of_ndarrays, dict_str
 from tvb_epilepsy.base.h5_model import convert_to_h5_model
+from tvb_epilepsy.base.random_streams import RandomStreams
+from tvb_epilepsy.base.sensitivity_indices import sobol_fast_analyze, delta_fast_analyze
+from tvb_epilepsy.base.pse_results import PSEResults
 from tvb.basic.logger.builder import get_logger
 
-METHODS = ["sobol", "latin", "delta", "dgsm", "fast", "fast_sampler", "morris", "ff", "fractional_factorial"]
+METHODS = ["sobol", "latin", "delta", "dgsm", "fast", "fast_sampler", "morris", "ff", "fractional_factorial",
+           "sobol_fast", "delta_fast"]
+
+# Methods that analyze all outputs and bootstrap resamples at once
+BATCHED_METHODS = ["sobol_fast", "delta_fast"]
 
 LOG = get_logger(__name__)
 
+# The service analyzed by the processes of a pool. Workers inherit it when they are forked,
+# so that the (possibly large) input and output samples are shared instead of pickled to each one of them.
+_POOL_SERVICE = None
+
+
+def _pool_analyze_output(args):
+    return _POOL_SERVICE._analyze_output(*args)
+
 # TODO: make sensitivity_analysis_from_hypothesis() helper function
 
 # TODO: make example-testing function __main__
@@ -55,6 +72,10 @@ class SensitivityAnalysisService(object):
         self.output_values = []
         self.output_names = []
 
+        # The outputs of a PSEResults store are used directly, without copying them to lists:
+        if isinstance(outputs, PSEResults):
+            outputs = outputs.sa_outputs()
+
         for output in outputs:
 
             if output["values"].size == self.n_samples:
@@ -78,8 +99,11 @@ class SensitivityAnalysisService(object):
             else:
                 self.output_names += output["names"]
 
-        if len(self.output_values) > 0:
-            self.output_values = np.vstack(self.output_values)
+        if len(self.output_values) == 1 and self.output_values[0].ndim == 2:
+            # A single (n_samples, n_outputs) array, e.g., of a PSEResults store, is kept as it is:
+            self.output_values = self.output_values[0]
+        elif len(self.output_values) > 0:
+            self.output_values = np.hstack([values.reshape((self.n_samples, -1)) for values in self.output_values])
 
         self.problem = {}
         self.other_parameters = {}
@@ -153,7 +177,63 @@ class SensitivityAnalysisService(object):
             self._set_conf_level(conf_level)
 
 
-    def run(self, input_ids=None, output_ids=None, method=None, calc_second_order=None, conf_level=None, **kwargs):
+    def _analyze_output(self, io, seed):
+        # The bootstrap resamples of SALib are drawn from the global numpy generator, which is given the state
+        # of a local generator seeded per output, so that results do not depend on the process or order of execution,
+        # and restored afterwards, so that the caller's random stream is left untouched
+        global_state = np.random.get_state()
+        np.random.set_state(np.random.RandomState(seed).get_state())
+        try:
+            return self.analyzer(self.output_values[:, io])
+        finally:
+            np.random.set_state(global_state)
+
+    def _random_streams(self):
+        # Random streams derived from the root random_seed, or from the global numpy generator
+        random_seed = self.other_parameters.get("random_seed", None)
+        if random_seed is None:
+            random_seed = np.random.randint(0, 2 ** 31 - 1)
+            self.other_parameters["random_seed"] = random_seed
+        return RandomStreams(random_seed, key=("SA",))
+
+    def _analyze_outputs(self, output_ids, n_processes=1):
+
+        random_streams = self._random_streams()
+        tasks = [(io, random_streams.seed(io)) for io in output_ids]
+
+        if n_processes is None:
+            n_processes = multiprocessing.cpu_count()
+        n_processes = min(n_processes, len(tasks))
+        if n_processes > 1 and not (hasattr(os, "fork")):
+            warnings.warn("Parallel sensitivity analysis requires forking processes! Running serially instead.")
+            n_processes = 1
+        if n_processes > 1 and self.other_parameters.get("parallel", False):
+            warnings.warn("Parallel sensitivity analysis of outputs combined with parallel analysis of each output!")
+
+        if n_processes <= 1:
+            return [self._analyze_output(*task) for task in tasks]
+
+        global _POOL_SERVICE
+        _POOL_SERVICE = self
+        pool = multiprocessing.Pool(n_processes)
+        try:
+            # Results are returned in the order of output_ids:
+            results = pool.map(_pool_analyze_output, tasks,
+                               chunksize=int(np.ceil(1.0 * len(tasks) / (4 * n_processes))))
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+            _POOL_SERVICE = None
+        return results
+
+    def run(self, input_ids=None, output_ids=None, method=None, calc_second_order=None, conf_level=None,
+            n_processes=1, **kwargs):
+        # n_processes: number of processes analyzing outputs in parallel (default 1 for serial execution,
+        #              None for as many as the cpu count)
+        # random_seed (int): root seed of the bootstrap resamples of all outputs (default drawn from numpy.random)
 
         self._update_parameters(method, calc_second_order, conf_level)
 
@@ -171,6 +251,9 @@ class SensitivityAnalysisService(object):
 
         n_outputs = len(output_ids)
 
+        # Select the input samples once, rather than at every call of the analyzer:
+        input_samples = self.input_samples[:, input_ids]
+
         if self.method.lower() == "sobol":
             warnings.warn("'sobol' method requires 'saltelli' sampling scheme!")
             # Additional keyword parameters and their defaults:
@@ -193,7 +276,7 @@ class SensitivityAnalysisService(object):
             # num_resamples (int): The number of resamples used to compute the confidence intervals (default 1000)
             # conf_level (float): The confidence interval level (default 0.95)
             # print_to_console (bool): Print results directly to console (default False)
-            self.analyzer = lambda output: delta.analyze(self.problem, self.input_samples[:, input_ids], output,
+            self.analyzer = lambda output: delta.analyze(self.problem, input_samples, output,
                                                          conf_level=self.conf_level,
                                                          num_resamples=self.other_parameters.get("num_resamples", 1000),
                                                          print_to_console=self.other_parameters.get("print_to_console",
@@ -214,7 +297,7 @@ class SensitivityAnalysisService(object):
             # second_order (bool, default=False): Include interaction effects
             # print_to_console (bool, default=False): Print results directly to console
             warnings.warn("'fractional_factorial' method requires 'fractional_factorial' sampling scheme!")
-            self.analyzer = lambda output: ff.analyze(self.problem, self.input_samples[:, input_ids], output,
+            self.analyzer = lambda output: ff.analyze(self.problem, input_samples, output,
                                                       calc_second_order=self.calc_second_order,
                                                       conf_level=self.conf_level,
                                                       num_resamples=self.other_parameters.get("num_resamples", 1000),
@@ -232,7 +315,7 @@ class SensitivityAnalysisService(object):
             #                   SALib.sample.morris.sample() (default 2)
             # num_levels (int): The number of grid levels, must be identical to the value passed to
             #                   SALib.sample.morris (default 4)
-            self.analyzer = lambda output: morris.analyze(self.problem, self.input_samples[:, input_ids], output,
+            self.analyzer = lambda output: morris.analyze(self.problem, input_samples, output,
                                                           conf_level=self.conf_level,
                                                           grid_jump=self.other_parameters.get("grid_jump", 2),
                                                           num_levels=self.other_parameters.get("num_levels", 4),
@@ -245,24 +328,45 @@ class SensitivityAnalysisService(object):
             # num_resamples (int): The number of resamples used to compute the confidence intervals (default 1000)
             # conf_level (float): The confidence interval level (default 0.95)
             # print_to_console (bool): Print results directly to console (default False)
-            self.analyzer = lambda output: dgsm.analyze(self.problem, self.input_samples[:, input_ids], output,
+            self.analyzer = lambda output: dgsm.analyze(self.problem, input_samples, output,
                                                         conf_level=self.conf_level,
                                                         num_resamples=self.other_parameters.get("num_resamples", 1000),
                                                         print_to_console=self.other_parameters.get("print_to_console",
                                                                                                    False))
 
+        elif self.method.lower() == "sobol_fast":
+            warnings.warn("'sobol_fast' method requires 'saltelli' sampling scheme!")
+            # Additional keyword parameters and their defaults:
+            # num_resamples (int): The number of resamples used to compute the confidence intervals (default 1000)
+            self.analyzer = lambda outputs, random_state: \
+                sobol_fast_analyze(self.problem, outputs, calc_second_order=self.calc_second_order,
+                                   conf_level=self.conf_level,
+                                   num_resamples=self.other_parameters.get("num_resamples", 1000),
+                                   random_state=random_state)
+
+        elif self.method.lower() == "delta_fast":
+            warnings.warn("'latin' sampling scheme is recommended for 'delta_fast' method!")
+            # Additional keyword parameters and their defaults:
+            # num_resamples (int): The number of resamples used to compute the confidence intervals (default 1000)
+            # n_grid (int): The number of points of the grid of output kernel density estimates (default 100)
+            self.analyzer = lambda outputs, random_state: \
+                delta_fast_analyze(self.problem, input_samples, outputs, conf_level=self.conf_level,
+                                   num_resamples=self.other_parameters.get("num_resamples", 1000),
+                                   n_grid=self.other_parameters.get("n_grid", 100), random_state=random_state)
+
         else:
             raise ValueError(
                 "Method " + str(self.method) + " is not one of the available methods " + str(METHODS) + " !")
 
-        output_names = []
-        results = []
-        for io in output_ids:
-            output_names.append(self.output_names[io])
-            results.append(self.analyzer(self.output_values[:, io]))
+        output_names = [self.output_names[io] for io in output_ids]
 
-         # TODO: Adjust list_of_dicts_to_dicts_of_ndarrays to handle ndarray concatenation
-        results = list_of_dicts_to_dicts_of_ndarrays(results)
+        if self.method in BATCHED_METHODS:
+            # All outputs are analyzed at once, in the calling process:
+            results = self.analyzer(self.output_values[:, output_ids], self._random_streams().stream(self.method))
+            results = dict((key, np.squeeze(val)) for key, val in results.iteritems())
+        else:
+            # TODO: Adjust list_of_dicts_to_dicts_of_ndarrays to handle ndarray concatenation
+            results = list_of_dicts_to_dicts_of_ndarrays(self._analyze_outputs(output_ids, n_processes))
 
         results.update({"output_names": output_names})
 
@@ -287,7 +391,8 @@ if __name__ == "__main__":
 
     reader = Reader()
 
-    head = reader.read_head(data_folder)
+    # Only the connectivity is needed:
+    head = reader.read_head(data_folder, lazy=True)
 
     # --------------------------Hypothesis definition-----------------------------------
 
@@ -341,8 +446,11 @@ if __name__ == "__main__":
                                         figure_name=m + "_PSE_LSA_overview_" + lsa_hypothesis.name)
             # , show_flag=True, save_flag=False
 
-            convert_to_h5_model(pse_results).write_to_h5(FOLDER_RES,
-                                                         m + "_PSE_LSA_results_" + lsa_hypothesis.name + ".h5")
+            if isinstance(pse_results, PSEResults):
+                pse_results.write_to_h5(FOLDER_RES, m + "_PSE_LSA_results_" + lsa_hypothesis.name + ".h5")
+            else:
+                convert_to_h5_model(pse_results).write_to_h5(FOLDER_RES,
+                                                             m + "_PSE_LSA_results_" + lsa_hypothesis.name + ".h5")
             convert_to_h5_model(sa_results).write_to_h5(FOLDER_RES,
                                                         m + "_SA_LSA_results_" + lsa_hypothesis.name + ".h5")
         except:
@@ -0,0 +1,193 @@
+"""
+Batched estimators of Sobol and delta sensitivity indices, and of their bootstrap confidence intervals.
+They follow the estimators of SALib.analyze.sobol and SALib.analyze.delta, but compute all outputs and all bootstrap
+resamples together with stacked numpy operations.
+Bootstrap resamples are represented by the counts of each sample in each resample,
+so that resampled means become matrix products of counts with sample values.
+"""
+import numpy as np
+from scipy import sparse
+from scipy.stats import norm, rankdata
+
+# Maximum number of elements of the temporary arrays of a block of outputs or resamples
+MAX_BLOCK_SIZE = 2 ** 22
+
+
+def _outputs_to_2d(Y):
+    Y = np.array(Y, dtype="float64")
+    if Y.ndim == 1:
+        Y = Y[:, np.newaxis]
+    return Y
+
+
+def bootstrap_counts(n_samples, num_resamples, random_state=np.random):
+    # The same resamples as the ones of SALib, i.e., columns of random_state.randint(n_samples, ...),
+    # given as a (num_resamples, n_samples) array of the number of times each sample is drawn in each resample
+    r = random_state.randint(n_samples, size=(n_samples, num_resamples))
+    counts = np.bincount((r + n_samples * np.arange(num_resamples)).flatten(),
+                         minlength=n_samples * num_resamples)
+    return counts.reshape((num_resamples, n_samples)).astype("float64")
+
+
+def _sobol_indices(weights, A, B, AB, BA=None):
+    # weights: (n_resamples, N) sample weights summing to 1 per resample
+    # A, B: (N, n_outputs), AB, BA: (N, D, n_outputs)
+    def mean(x):
+        return np.dot(weights, x.reshape((x.shape[0], -1))).reshape((weights.shape[0],) + x.shape[1:])
+    # The variance of the concatenation of A and B samples:
+    var = (0.5 * (mean(A ** 2) + mean(B ** 2)) - (0.5 * (mean(A) + mean(B))) ** 2)[:, np.newaxis]
+    S1 = mean(B[:, np.newaxis] * (AB - A[:, np.newaxis])) / var
+    ST = 0.5 * mean((A[:, np.newaxis] - AB) ** 2) / var
+    if BA is None:
+        return S1, ST, None
+    Vjk = (mean(BA[:, :, np.newaxis] * AB[:, np.newaxis]) - mean(A * B)[:, np.newaxis, np.newaxis]) / \
+          var[:, np.newaxis]
+    S2 = Vjk - S1[:, :, np.newaxis] - S1[:, np.newaxis, :]
+    return S1, ST, S2
+
+
+def sobol_fast_analyze(problem, Y, calc_second_order=True, num_resamples=1000, conf_level=0.95,
+                       random_state=np.random):
+    """
+    Sobol first, total and (optionally) second order indices of outputs computed on Saltelli samples
+    :param problem: the SALib problem dictionary
+    :param Y: an array of (n_samples) or (n_samples, n_outputs) output values, in the order of the saltelli samples
+    :return: a dictionary of "S1", "S1_conf", "ST", "ST_conf" arrays of shape (n_outputs, num_vars),
+             and "S2", "S2_conf" arrays of shape (n_outputs, num_vars, num_vars), with nan below the diagonal
+    """
+    D = problem["num_vars"]
+    Y = _outputs_to_2d(Y)
+    n_samples, n_outputs = Y.shape
+    step = 2 * D + 2 if calc_second_order else D + 2
+    if n_samples % step != 0:
+        raise ValueError("Number of output samples " + str(n_samples) + " is not a multiple of " + str(step) +
+                         "! Confirm that calc_second_order matches the option used during saltelli sampling.")
+    if not (0.0 < conf_level < 1.0):
+        raise ValueError("conf_level = " + str(conf_level) + " is not in the (0.0, 1.0) interval as it should!")
+    N = n_samples / step
+    Z = norm.ppf(0.5 + conf_level / 2)
+    # Normalize outputs and separate them into the A, B, AB and BA matrices of the saltelli scheme:
+    Y = ((Y - Y.mean(axis=0)) / Y.std(axis=0)).reshape((N, step, n_outputs))
+    # Point estimates with uniform weights, followed by the bootstrap resamples:
+    weights = np.vstack([np.ones((1, N)), bootstrap_counts(N, num_resamples, random_state)]) / N
+    S = {"S1": np.zeros((n_outputs, D)), "S1_conf": np.zeros((n_outputs, D)),
+         "ST": np.zeros((n_outputs, D)), "ST_conf": np.zeros((n_outputs, D))}
+    if calc_second_order:
+        S.update({"S2": np.nan * np.ones((n_outputs, D, D)), "S2_conf": np.nan * np.ones((n_outputs, D, D))})
+    upper = np.triu_indices(D, 1)
+    # Blocks of outputs, to bound the size of the stacked (second order) products:
+    n_block = max(1, MAX_BLOCK_SIZE / ((N + num_resamples + 1) * (D ** 2 if calc_second_order else D)))
+    for o in range(0, n_outputs, n_block):
+        y = Y[:, :, o:o + n_block]
+        BA = y[:, D + 1:2 * D + 1] if calc_second_order else None
+        S1, ST, S2 = _sobol_indices(weights, y[:, 0], y[:, step - 1], y[:, 1:D + 1], BA)
+        S["S1"][o:o + n_block] = S1[0].T
+        S["S1_conf"][o:o + n_block] = Z * S1[1:].std(axis=0, ddof=1).T
+        S["ST"][o:o + n_block] = ST[0].T
+        S["ST_conf"][o:o + n_block] = Z * ST[1:].std(axis=0, ddof=1).T
+        if calc_second_order:
+            S["S2"][o:o + n_block, upper[0], upper[1]] = S2[0][upper].T
+            S["S2_conf"][o:o + n_block, upper[0], upper[1]] = Z * S2[1:].std(axis=0, ddof=1)[upper].T
+    return S
+
+
+def _delta_indices(weights, n_classes, bins, class_sums, class_sums2, dx, transfer_frequencies, n_grid):
+    # weights: (n_resamples, N) counts of samples
+    # bins: (N, n_outputs * n_classes * n_grid), class_sums, class_sums2: (N, n_outputs * n_classes), dx: (n_outputs, )
+    N = weights.shape[1]
+    n_resamples = weights.shape[0]
+    n_outputs = dx.size
+    # Binned sample counts per resample, output, class and grid point, and sample counts and moments per class:
+    h = np.asarray(bins.T.dot(weights.T).T).reshape((n_resamples, n_outputs, n_classes, n_grid))
+    n = h.sum(axis=3)
+    sy = np.asarray(class_sums.T.dot(weights.T).T).reshape((n_resamples, n_outputs, n_classes))
+    sy2 = np.asarray(class_sums2.T.dot(weights.T).T).reshape((n_resamples, n_outputs, n_classes))
+    mean = sy.sum(axis=2) / N
+    # Correlation ratio, i.e., first order Sobol index, of the equal frequency partition:
+    with np.errstate(divide="ignore", invalid="ignore"):
+        class_mean = sy / np.maximum(n, 1)
+        S1 = np.sum(n / N * (class_mean - mean[:, :, np.newaxis]) ** 2, axis=2) / \
+             (sy2.sum(axis=2) / N - mean ** 2)
+    # Silverman bandwidths of the gaussian kernel density estimates of the classes and of all samples,
+    # in grid points:
+    n_all = np.concatenate([n, N * np.ones((n_resamples, n_outputs, 1))], axis=2)
+    var = np.concatenate([sy2 - n * class_mean ** 2, (sy2.sum(axis=2) - N * mean ** 2)[:, :, np.newaxis]], axis=2)
+    var = np.maximum(var, 0.0) / np.maximum(n_all - 1, 1)
+    bandwidth = (np.maximum(n_all, 1) * 3.0 / 4) ** (-1.0 / 5) * np.sqrt(var) / dx[:, np.newaxis]
+    # Binned kernel density estimates, computed by convolution in the frequency domain:
+    h = np.concatenate([h / np.maximum(n, 1)[:, :, :, np.newaxis], h.sum(axis=2)[:, :, np.newaxis] / N], axis=2)
+    density = np.fft.rfft(h, transfer_frequencies.size * 2 - 2, axis=3) * \
+              np.exp(-0.5 * (2 * np.pi * transfer_frequencies * bandwidth[:, :, :, np.newaxis]) ** 2)
+    density = np.fft.irfft(density, axis=3)[:, :, :, :n_grid] / dx[:, np.newaxis, np.newaxis]
+    # Trapezoidal integral of the distance between the densities of each class and of all samples:
+    distance = np.abs(density[:, :, :-1] - density[:, :, -1:])
+    distance = dx[:, np.newaxis] * (distance.sum(axis=3) - 0.5 * (distance[:, :, :, 0] + distance[:, :, :, -1]))
+    delta = np.sum(n / (2.0 * N) * distance, axis=2)
+    return delta, S1
+
+
+def delta_fast_analyze(problem, X, Y, num_resamples=1000, conf_level=0.95, random_state=np.random, n_grid=100):
+    """
+    Delta moment independent indices and first order Sobol indices of outputs, computed on any input samples
+    The kernel density estimates of the outputs are computed on linearly binned output values, and bootstrap resamples
+    keep the equal frequency partition of each input of the original samples.
+    :param problem: the SALib problem dictionary
+    :param X: an array of (n_samples, num_vars) input samples
+    :param Y: an array of (n_samples) or (n_samples, n_outputs) output values
+    :return: a dictionary of "delta", "delta_conf", "S1", "S1_conf" arrays of shape (n_outputs, num_vars)
+    """
+    D = problem["num_vars"]
+    X = np.array(X).reshape((X.shape[0], -1))
+    Y = _outputs_to_2d(Y)
+    N, n_outputs = Y.shape
+    if not (0.0 < conf_level < 1.0):
+        raise ValueError("conf_level = " + str(conf_level) + " is not in the (0.0, 1.0) interval as it should!")
+    Z = norm.ppf(0.5 + conf_level / 2)
+    # Equal frequency partition, as in SALib:
+    n_classes = int(min(np.ceil(N ** (2.0 / (7 + np.tanh((1500.0 - N) / 500)))), 48))
+    partition = np.linspace(0, N, n_classes + 1)
+    # Point estimates with all samples, followed by the bootstrap resamples:
+    weights = np.vstack([np.ones((1, N)), bootstrap_counts(N, num_resamples, random_state)])
+    # Linear binning of outputs on a grid from their minimum to their maximum:
+    y_min = Y.min(axis=0)
+    dx = (Y.max(axis=0) - y_min) / (n_grid - 1)
+    dx[dx == 0.0] = 1.0
+    lo = np.clip(np.floor((Y - y_min) / dx), 0, n_grid - 2).astype("i")
+    frac = (Y - y_min) / dx - lo
+    # Frequencies of a zero padded fft, long enough to avoid wrapping kernels around the grid:
+    transfer_frequencies = np.fft.rfftfreq(int(2 ** np.ceil(np.log2(2.5 * n_grid))))
+    # Blocks of outputs and of resamples, to bound the size of the stacked densities:
+    n_output_block = max(1, min(n_outputs, MAX_BLOCK_SIZE / ((n_classes + 1) * transfer_frequencies.size)))
+    n_block = max(1, MAX_BLOCK_SIZE / ((n_classes + 1) * transfer_frequencies.size * n_output_block))
+    S = dict((k, np.zeros((n_outputs, D))) for k in ("delta", "delta_conf", "S1", "S1_conf"))
+    for i in range(D):
+        classes = np.searchsorted(partition, rankdata(X[:, i], method="ordinal"), side="left") - 1
+        for o in range(0, n_outputs, n_output_block):
+            outputs = np.arange(o, min(o + n_output_block, n_outputs))
+            # Columns of the (output, class) pairs and of the (output, class, grid point) triplets of each sample:
+            class_cols = (np.arange(outputs.size) * n_classes + classes[:, np.newaxis]).flatten()
+            cols = class_cols * n_grid + lo[:, outputs].flatten()
+            rows = np.repeat(np.arange(N), outputs.size)
+            bins = sparse.csr_matrix((np.concatenate([1.0 - frac[:, outputs].flatten(), frac[:, outputs].flatten()]),
+                                      (np.concatenate([rows, rows]), np.concatenate([cols, cols + 1]))),
+                                     shape=(N, outputs.size * n_classes * n_grid))
+            class_sums = sparse.csr_matrix((Y[:, outputs].flatten(), (rows, class_cols)),
+                                           shape=(N, outputs.size * n_classes))
+            class_sums2 = sparse.csr_matrix((Y[:, outputs].flatten() ** 2, (rows, class_cols)),
+                                            shape=(N, outputs.size * n_classes))
+            delta = []
+            S1 = []
+            for r in range(0, weights.shape[0], n_block):
+                d, s = _delta_indices(weights[r:r + n_block], n_classes, bins, class_sums, class_sums2, dx[outputs],
+                                      transfer_frequencies, n_grid)
+                delta.append(d)
+                S1.append(s)
+            delta = np.concatenate(delta)
+            S1 = np.concatenate(S1)
+            # Bias reduction of Plischke et al. 2013 (eqn 30):
+            delta = 2 * delta[0] - delta[1:]
+            S["delta"][outputs, i] = delta.mean(axis=0)
+            S["delta_conf"][outputs, i] = Z * delta.std(axis=0, ddof=1)
+            S["S1"][outputs, i] = S1[0]
+            S["S1_conf"][outputs, i] = Z * S1[1:].std(axis=0, ddof=1)
+    return S
@@ -0,0 +1,115 @@
+"""
+Surrogate models (emulators) of expensive model evaluations, such as the LSA runs of a parameter search exploration,
+to be fitted on a modest design of evaluations and then evaluated on the large designs of sensitivity analysis.
+"""
+from itertools import combinations_with_replacement
+
+import numpy as np
+
+from tvb_epilepsy.base.utils import formal_repr
+
+
+def total_degree_multi_indices(n_inputs, degree):
+    # All tuples of polynomial degrees per input, whose sum is not greater than degree, sorted by total degree
+    multi_indices = []
+    for total_degree in range(degree + 1):
+        for inputs in combinations_with_replacement(range(n_inputs), total_degree):
+            multi_index = np.zeros((n_inputs,), dtype="i")
+            for i in inputs:
+                multi_index[i] += 1
+            multi_indices.append(multi_index)
+    return np.array(multi_indices).reshape((-1, n_inputs))
+
+
+def legendre_polynomials(x, degree):
+    # Orthonormal Legendre polynomials, with respect to the uniform distribution in [-1, 1], of degrees 0 to degree
+    # for all values of x, stacked along the last axis
+    P = [np.ones(x.shape), x]
+    for k in range(1, degree):
+        P.append(((2 * k + 1) * x * P[k] - k * P[k - 1]) / (k + 1))
+    P = np.stack(P[:degree + 1], axis=-1)
+    return P * np.sqrt(2 * np.arange(degree + 1) + 1)
+
+
+class PolynomialChaosSurrogate(object):
+
+    def __init__(self, bounds, degree=3, regularization=0.0):
+        """
+        Polynomial chaos expansion of outputs, on a Legendre basis of total degree for inputs uniform within bounds,
+        fitted by (optionally ridge regularized) least squares.
+        :param bounds: a list of [low, high] bounds per input
+        :param degree: the maximum total degree of the polynomials
+        :param regularization: the ridge regularization parameter (default 0.0 for ordinary least squares)
+        """
+        self.bounds = np.array(bounds, dtype="float64").reshape((-1, 2))
+        if np.any(self.bounds[:, 1] <= self.bounds[:, 0]):
+            raise ValueError("\nHigh bounds " + str(self.bounds[:, 1]) +
+                             " are not all greater than the low ones " + str(self.bounds[:, 0]) + "!")
+        self.n_inputs = self.bounds.shape[0]
+        self.degree = degree
+        self.regularization = regularization
+        self.multi_indices = total_degree_multi_indices(self.n_inputs, self.degree)
+        self.n_terms = self.multi_indices.shape[0]
+        self.coefficients = None
+        self.n_train_samples = 0
+        self.validation_error = None
+
+    def __repr__(self):
+        d = {"01. Number of inputs": self.n_inputs,
+             "02. Input bounds": self.bounds,
+             "03. Total degree": self.degree,
+             "04. Number of polynomial terms": self.n_terms,
+             "05. Ridge regularization": self.regularization,
+             "06. Number of training samples": self.n_train_samples,
+             "07. Leave-one-out relative error per output": self.validation_error}
+        return formal_repr(self, d)
+
+    def __str__(self):
+        return self.__repr__()
+
+    def _design_matrix(self, inputs):
+        # inputs: (n_samples, n_inputs) -> (n_samples, n_terms)
+        inputs = np.array(inputs, dtype="float64").reshape((-1, self.n_inputs))
+        x = 2 * (inputs - self.bounds[:, 0]) / (self.bounds[:, 1] - self.bounds[:, 0]) - 1
+        P = legendre_polynomials(x, self.degree)
+        return np.prod(P[:, np.arange(self.n_inputs), self.multi_indices], axis=2)
+
+    def fit(self, inputs, outputs):
+        """
+        :param inputs: an array of (n_samples, n_inputs) input samples
+        :param outputs: an array of (n_samples) or (n_samples, n_outputs) output values
+        :return: the leave-one-out error of each output, relative to its variance
+        """
+        psi = self._design_matrix(inputs)
+        outputs = np.array(outputs, dtype="float64").reshape((psi.shape[0], -1))
+        if psi.shape[0] <= self.n_terms:
+            raise ValueError("\nNumber of training samples " + str(psi.shape[0]) +
+                             " is not greater than the number of polynomial terms " + str(self.n_terms) + "!")
+        self.n_train_samples = psi.shape[0]
+        # Solve the (regularized) normal equations via the singular value decomposition of the design matrix,
+        # which also gives the diagonal of the hat matrix for the closed form leave-one-out residuals:
+        U, s, Vt = np.linalg.svd(psi, full_matrices=False)
+        shrinkage = s / (s ** 2 + self.regularization)
+        self.coefficients = np.dot(Vt.T * shrinkage, np.dot(U.T, outputs))
+        hat = np.sum(U ** 2 * (s * shrinkage), axis=1)
+        residuals = (outputs - np.dot(psi, self.coefficients)) / (1.0 - hat)[:, np.newaxis]
+        variance = outputs.var(axis=0)
+        variance[variance == 0.0] = 1.0
+        self.validation_error = np.mean(residuals ** 2, axis=0) / variance
+        return self.validation_error
+
+    def predict(self, inputs):
+        """
+        :param inputs: an array of (n_samples, n_inputs) input samples
+        :return: an array of (n_samples, n_outputs) output values
+        """
+        if self.coefficients is None:
+            raise ValueError("\nSurrogate model has not been fitted yet!")
+        return np.dot(self._design_matrix(inputs), self.coefficients)
+
+    def validate(self, inputs, outputs):
+        # The error of each output on an independent test set, relative to its variance
+        outputs = np.array(outputs, dtype="float64").reshape((-1, self.coefficients.shape[1]))
+        variance = outputs.var(axis=0)
+        variance[variance == 0.0] = 1.0
+        return np.mean((outputs - self.predict(inputs)) ** 2, axis=0) / variance
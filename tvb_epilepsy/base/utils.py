@@ -12,10 +12,9 @@ import h5py
 import numpy as np
 from matplotlib import use
 
-from tvb_epilepsy.base.constants import FOLDER_LOGS, WEIGHTS_NORM_PERCENT, INTERACTIVE_ELBOW_POINT
+from tvb_epilepsy.base.constants import FOLDER_LOGS, WEIGHTS_NORM_PERCENT
 
 use('Qt4Agg')
-from matplotlib import pyplot
 
 
 # Logs and errors
@@ -377,7 +376,7 @@ def weighted_vector_sum(weights, vectors, normalize=True):
         vectors = list(vectors.T)
 
     if normalize:
-        weights /= np.sum(weights)
+        weights = weights / np.sum(weights)
 
     vector_sum = weights[0] * vectors[0]
     for iv in range(1, len(weights)):
@@ -430,84 +429,16 @@ def calculate_projection(sensors, connectivity):
 
 
 def curve_elbow_point(vals):
-
-    logger = initialize_logger(__name__)
-
-    vals = np.array(vals).flatten()
-
-    if np.any(vals[0:-1] - vals[1:] < 0):
-        vals = np.sort(vals)
-        vals = vals[::-1]
-
-    cumsum_vals = np.cumsum(vals)
-
-    grad = np.gradient(np.gradient(np.gradient(cumsum_vals)))
-
-    elbow = np.argmax(grad)
-
-    if INTERACTIVE_ELBOW_POINT:
-
-        pyplot.ion()
-
-        fig, ax = pyplot.subplots()
-
-        xdata = range(len(vals))
-        lines=[]
-        lines.append(ax.plot(xdata, cumsum_vals, 'g*', picker=None, label="values' cumulative sum")[0])
-        lines.append(ax.plot(xdata, vals, 'bo', picker=None, label="values in descending order")[0])
-
-        lines.append(ax.plot(elbow, vals[elbow], "rd",
-                             label="suggested elbow point (maximum of third central difference)")[0])
-
-        lines.append(ax.plot(elbow, cumsum_vals[elbow], "rd")[0])
-
-        pyplot.legend(handles=lines[:2])
-
-        class MyClickableLines(object):
-
-            def __init__(self, fig, ax, lines):
-                self.x = None
-                #self.y = None
-                self.ax = ax
-                title = "Mouse lef-click please to select the elbow point..." + \
-                        "\n...or click ENTER to continue accepting our automatic choice in red..."
-                self.ax.set_title(title)
-                self.lines = lines
-                self.fig = fig
-
-            def event_loop(self):
-                self.fig.canvas.mpl_connect('button_press_event', self.onclick)
-                self.fig.canvas.mpl_connect('key_press_event', self.onkey)
-                self.fig.canvas.draw_idle()
-                self.fig.canvas.start_event_loop(timeout=-1)
-                return
-
-            def onkey(self, event):
-                if event.key == "enter":
-                    self.fig.canvas.stop_event_loop()
-                return
-
-            def onclick(self, event):
-                if event.inaxes != self.lines[0].axes: return
-                dist = np.sqrt((self.lines[0].get_xdata() - event.xdata) ** 2.0)  # + (self.lines[0].get_ydata() - event.ydata) ** 2.)
-                self.x = np.argmin(dist)
-                self.fig.canvas.stop_event_loop()
-                return
-
-        click_point = MyClickableLines(fig, ax, lines)
-        click_point.event_loop()
-
-        if click_point.x is not None:
-            elbow = click_point.x
-            logger.info("\nmanual selection: " + str(elbow))
-        else:
-            logger.info("\nautomatic selection: " + str(elbow))
-
-        return elbow
-
-    else:
-
-        return elbow
+    """
+    The elbow point of curves, at the maximum of the third central difference of their cumulative sum,
+    after sorting their values in descending order
+    :param vals: an array of (n, ) values of a curve, or of (n_samples, n) values of a batch of curves
+    :return: the index of the elbow point of the curve, or an array of (n_samples, ) indices for a batch of curves
+    """
+    vals = np.atleast_1d(np.array(vals, dtype="float64"))
+    cumsum_vals = np.cumsum(-np.sort(-vals, axis=-1), axis=-1)
+    grad = np.gradient(np.gradient(np.gradient(cumsum_vals, axis=-1), axis=-1), axis=-1)
+    return np.argmax(grad, axis=-1)
 
 
 # File writing/reading and manipulations
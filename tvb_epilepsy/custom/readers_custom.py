@@ -93,13 +93,7 @@ class CustomReader(ABCReader):
     def read_projection(self, path, s_type):
         raise NotImplementedError()
 
-    def read_head(self, root_folder, name=''):
-        conn = self.read_connectivity(os.path.join(root_folder, "Connectivity.h5"))
-        srf = self.read_cortical_surface(os.path.join(root_folder, "CorticalSurface.h5"))
-        rm = self.read_region_mapping(os.path.join(root_folder, "RegionMapping.h5"))
-        vm = self.read_volume_mapping(os.path.join(root_folder, "VolumeMapping.h5"))
-        t1 = self.read_volume_mapping(os.path.join(root_folder, "StructuralMRI.h5"))
-
+    def _read_seeg_sensors_dict(self, root_folder, conn):
         seeg_sensors_dict = {}
         s_114 = self.read_sensors(os.path.join(root_folder, "SensorsSEEG_114.h5"), Sensors.TYPE_SEEG)
         if isinstance(s_114, Sensors):
@@ -111,6 +105,21 @@ class CustomReader(ABCReader):
             p_125 = calculate_projection(s_125, conn)
             seeg_sensors_dict[s_125] = p_125
 
+        return seeg_sensors_dict
+
+    def read_head(self, root_folder, name='', lazy=False, n_threads=0):
+        conn = self.read_connectivity(os.path.join(root_folder, "Connectivity.h5"))
+
+        read, pool = self._component_reader(lazy, n_threads)
+        srf = read(self.read_cortical_surface, os.path.join(root_folder, "CorticalSurface.h5"))
+        rm = read(self.read_region_mapping, os.path.join(root_folder, "RegionMapping.h5"))
+        vm = read(self.read_volume_mapping, os.path.join(root_folder, "VolumeMapping.h5"))
+        t1 = read(self.read_volume_mapping, os.path.join(root_folder, "StructuralMRI.h5"))
+        seeg_sensors_dict = read(self._read_seeg_sensors_dict, root_folder, conn)
+        if pool is not None:
+            # The threads go on reading in the background
+            pool.close()
+
         eeg_sensors_dict = {}
         meg_sensors_dict = {}
 
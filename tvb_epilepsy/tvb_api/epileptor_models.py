@@ -615,9 +615,9 @@ class EpileptorDPrealistic(Model):
                 xp = z * g
                 xp1 = -0.7
                 xp2 = 0.1
-            slope_eq = interval_scaling(xp, xp1, 1.0, xp2, slope)
+            slope_eq = interval_scaling(xp, 1.0, slope, xp1, xp2)
             # slope_eq = self.slope
-            Iext2_eq = interval_scaling(xp, xp1, 0.0, xp2, Iext2)
+            Iext2_eq = interval_scaling(xp, 0.0, Iext2, xp1, xp2)
 
         else:
             slope_eq = slope
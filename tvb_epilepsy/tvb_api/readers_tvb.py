@@ -54,26 +54,34 @@ class TVBReader(ABCReader):
             tvb_prj = projections.ProjectionSurfaceSEEG.from_file(path)
         return tvb_prj.projection_data
 
-    def read_head(self, root_folder, name=''):
+    def _read_sensors_dict(self, sensors_path, projection_path, s_type):
+        return {self.read_sensors(sensors_path, s_type): self.read_projection(projection_path, s_type)}
+
+    def read_head(self, root_folder, name='', lazy=False, n_threads=0):
         conn = self.read_connectivity(os.path.join(root_folder, "connectivity", "connectivity_76.zip"))
-        srf = self.read_cortical_surface(os.path.join(root_folder, "surfaceData", "cortex_16384.zip"))
-        rm = self.read_region_mapping(os.path.join(root_folder, "regionMapping", "regionMapping_16k_76.txt"))
+
+        read, pool = self._component_reader(lazy, n_threads)
+        srf = read(self.read_cortical_surface, os.path.join(root_folder, "surfaceData", "cortex_16384.zip"))
+        rm = read(self.read_region_mapping, os.path.join(root_folder, "regionMapping", "regionMapping_16k_76.txt"))
         vm = None
         t1 = None
 
-        s = self.read_sensors(os.path.join(root_folder, "sensors", "eeg_brainstorm_65.txt"), Sensors.TYPE_EEG)
-        pm = self.read_projection(os.path.join(root_folder, "projectionMatrix", "projection_eeg_65_surface_16k.npy"),
-                                  Sensors.TYPE_EEG)
-        eeg_sensors_dict = {s: pm}
-
-        s = self.read_sensors(os.path.join(root_folder, "sensors", "meg_brainstorm_276.txt"), Sensors.TYPE_MEG)
-        pm = self.read_projection(os.path.join(root_folder, "projectionMatrix", "projection_meg_276_surface_16k.npy"),
-                                  Sensors.TYPE_MEG)
-        meg_sensors_dict = {s: pm}
-
-        s = self.read_sensors(os.path.join(root_folder, "sensors", "seeg_588.txt"), Sensors.TYPE_SEEG)
-        pm = self.read_projection(os.path.join(root_folder, "projectionMatrix", "projection_seeg_588_surface_16k.npy"),
-                                  Sensors.TYPE_SEEG)
-        seeg_sensors_dict = {s: pm}
+        eeg_sensors_dict = read(self._read_sensors_dict,
+                                os.path.join(root_folder, "sensors", "eeg_brainstorm_65.txt"),
+                                os.path.join(root_folder, "projectionMatrix", "projection_eeg_65_surface_16k.npy"),
+                                Sensors.TYPE_EEG)
+
+        meg_sensors_dict = read(self._read_sensors_dict,
+                                os.path.join(root_folder, "sensors", "meg_brainstorm_276.txt"),
+                                os.path.join(root_folder, "projectionMatrix", "projection_meg_276_surface_16k.npy"),
+                                Sensors.TYPE_MEG)
+
+        seeg_sensors_dict = read(self._read_sensors_dict,
+                                 os.path.join(root_folder, "sensors", "seeg_588.txt"),
+                                 os.path.join(root_folder, "projectionMatrix", "projection_seeg_588_surface_16k.npy"),
+                                 Sensors.TYPE_SEEG)
+        if pool is not None:
+            # The threads go on reading in the background
+            pool.close()
 
         return Head(conn, srf, rm, vm, t1, name, eeg_sensors_dict, meg_sensors_dict, seeg_sensors_dict)